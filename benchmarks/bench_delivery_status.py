@@ -0,0 +1,96 @@
+"""
+Benchmark of update_order_with_delivery_status against the per-order legacy implementation.
+
+Synthetic orders are generated by resampling data/raw/orders.csv at 10x-1000x its size. Both
+implementations run on identical copies of the data and their statuses are compared.
+
+    python benchmarks/bench_delivery_status.py --uri mongodb://localhost:27017/?directConnection=true --scales 10 100 1000
+
+Without --uri the benchmark runs against mongomock, which only shows the algorithmic difference.
+"""
+import argparse
+import contextlib
+import os
+import sys
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+from mongodb_utils import (  # noqa: E402
+    update_order_with_delivery_status,
+    update_order_with_delivery_status_legacy,
+)
+
+DB_NAME = "bench_delivery_status"
+
+
+def synthetic_data(scale: int, seed: int = 0):
+    """Resamples the sample orders `scale` times and scales the inventory so some products run short."""
+    rng = np.random.default_rng(seed)
+    orders = pd.read_csv(os.path.join(ROOT_DIR, "data", "raw", "orders.csv"))
+    inventory = pd.read_csv(os.path.join(ROOT_DIR, "data", "raw", "inventory.csv"))
+
+    orders = orders.sample(n=len(orders) * scale, replace=True, random_state=seed).reset_index(drop=True)
+    orders["orderId"] = [str(uuid.UUID(int=int(i))) for i in rng.integers(0, 2**63, len(orders))]
+    inventory["quantity"] = inventory["quantity"] * scale
+
+    # Same balance the enrichment steps would compute
+    ordered = orders.groupby("productId")["quantity"].sum()
+    inventory["InventoryBalanceAfterOrder"] = inventory["quantity"] - inventory["productId"].map(ordered).fillna(0)
+    return orders, inventory
+
+
+def run(client, update, orders: pd.DataFrame, inventory: pd.DataFrame):
+    db = client[DB_NAME]
+    db.drop_collection("orders")
+    db.drop_collection("inventory")
+    db["orders"].insert_many(orders.to_dict("records"))
+    db["inventory"].insert_many(inventory.to_dict("records"))
+
+    # The legacy implementation prints one line per order
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        update(db["orders"], db["inventory"])
+        elapsed = time.perf_counter() - start
+
+    statuses = {order["orderId"]: order["deliveryStatus"] for order in db["orders"].find({}, {"orderId": 1, "deliveryStatus": 1})}
+    return elapsed, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", help="MongoDB URI, defaults to mongomock")
+    parser.add_argument("--scales", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--legacy-max-rows", type=int, default=300_000,
+                        help="Skip the legacy implementation above this many orders")
+    args = parser.parse_args()
+
+    if args.uri:
+        from pymongo import MongoClient
+        client = MongoClient(args.uri)
+    else:
+        import mongomock
+        client = mongomock.MongoClient()
+
+    print(f"{'scale':>6} {'orders':>10} {'legacy s':>10} {'bulk s':>10} {'speedup':>8} identical")
+    for scale in args.scales:
+        orders, inventory = synthetic_data(scale)
+        bulk_time, bulk_statuses = run(client, update_order_with_delivery_status, orders, inventory)
+
+        if len(orders) <= args.legacy_max_rows:
+            legacy_time, legacy_statuses = run(client, update_order_with_delivery_status_legacy, orders, inventory)
+            print(f"{scale:>6} {len(orders):>10} {legacy_time:>10.2f} {bulk_time:>10.2f} "
+                  f"{legacy_time / bulk_time:>7.1f}x {legacy_statuses == bulk_statuses}")
+        else:
+            print(f"{scale:>6} {len(orders):>10} {'skipped':>10} {bulk_time:>10.2f} {'-':>8} -")
+
+    client.drop_database(DB_NAME)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Benchmark of every pipeline stage on synthetic data, see generate_data.py.
+
+Each stage runs on its own, on the output of the previous stages, and is measured for wall
+time, CPU time and peak memory (RSS sampled in the background, and optionally the peak of
+Python allocations with tracemalloc). The results are stored as JSON in benchmarks/results,
+named after the current commit, so runs of two commits can be compared:
+
+    python benchmarks/bench_pipeline.py --uri mongodb://localhost:27017/?directConnection=true --rows 10000 100000 1000000
+    python benchmarks/bench_pipeline.py --rows 100000 --compare benchmarks/results/<baseline>.json
+
+Without --uri the Mongo stages run against mongomock, which is only useful to check the harness.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Callable, List, Optional
+
+import pandas as pd
+from pymongo import WriteConcern
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+from backends import MergeBackend, PandasBackend  # noqa: E402
+from dedup import Deduplicator  # noqa: E402
+from encoding import DocumentEncoder, ORDERS_FIELDS, ORDERS_ENCODER, INVENTORY_ENCODER  # noqa: E402
+from generate_data import write_dataset  # noqa: E402
+from indexes import ensure_indexes  # noqa: E402
+from ingestion import load_csv, ORDERS_DTYPES, ORDERS_DATE_COLUMNS, INVENTORY_DTYPES  # noqa: E402
+from instrumentation import PeakRSS  # noqa: E402
+from mongo_config import MongoSettings, create_client, load_settings  # noqa: E402
+from mongodb_utils import (  # noqa: E402
+    combine_orders_to_inventory_with_aggregates,
+    store_raw_data_to_mongo,
+    update_order_with_delivery_status,
+    update_quantity_per_product,
+    upsert_dataframe_to_mongo,
+)
+from reporting import build_report  # noqa: E402
+from schema import SCHEMAS, apply_schema  # noqa: E402
+from validation import INVENTORY_RULES, ORDERS_RULES, remove_dublicates, validate_data, validate_rows  # noqa: E402
+
+DB_NAME = "bench_pipeline"
+RESULTS_DIR = os.path.join(ROOT_DIR, "benchmarks", "results")
+# A stage slower than this factor of the baseline is reported as a regression
+REGRESSION_FACTOR = 1.2
+
+
+def measure(stage: str, rows: int, fn: Callable, trace_memory: bool = False):
+    """Runs fn once and returns its result and the measurements of the stage."""
+    if trace_memory:
+        tracemalloc.start()
+    rss_before = PeakRSS.current()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), PeakRSS() as rss:
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = fn()
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+    stats = {
+        "stage": stage,
+        "rows": rows,
+        "seconds": round(wall, 4),
+        "cpu_seconds": round(cpu, 4),
+        "rows_per_sec": round(rows / wall) if wall > 0 else None,
+        "peak_rss_mb": round(rss.peak / 2**20, 1),
+        "rss_growth_mb": round((rss.peak - rss_before) / 2**20, 1),
+    }
+    if trace_memory:
+        stats["peak_traced_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+        tracemalloc.stop()
+    print(f"  {stage:<36} {wall:>9.3f} s {cpu:>9.3f} cpu s {stats['peak_rss_mb']:>9.1f} MB")
+    return result, stats
+
+
+def dedup_chunks(df: pd.DataFrame, key: str, chunk_size: int = 50_000) -> int:
+    """Streams df through a Deduplicator in chunks, like the streaming ingestion, and returns the rows kept."""
+    deduplicator = Deduplicator(key)
+    return sum(len(deduplicator.drop_duplicates(df.iloc[i:i + chunk_size])) for i in range(0, len(df), chunk_size))
+
+
+def bench_scale(client, rows: int, data_dir: str, stages: Optional[List[str]], trace_memory: bool, seed: int,
+                server_side: bool = False, settings: MongoSettings = MongoSettings()) -> List[dict]:
+    """
+    Generates `rows` order rows and runs every stage once on them, server_side adds the $merge stages.
+
+    The raw inserts are measured with the "raw" write concern of settings and journaled, to show what it saves.
+    """
+    dataset = write_dataset(os.path.join(data_dir, str(rows)), rows, seed=seed)
+    processed_dir = os.path.join(data_dir, "processed")
+    client.drop_database(DB_NAME)
+    db = client[DB_NAME]
+    ensure_indexes(db)
+
+    results = []
+
+    def run(stage: str, stage_rows: int, fn: Callable, fallback: Optional[Callable] = None):
+        """Measures a stage, a stage that isn't selected runs its unmeasured fallback (if any) instead."""
+        if stages and stage not in stages:
+            return fallback() if fallback else None
+        result, stats = measure(stage, stage_rows, fn, trace_memory)
+        results.append(stats)
+        return result
+
+    def load(path: str, **types) -> pd.DataFrame:
+        # load_csv moves the file it reads, keep the generated one for later runs
+        return load_csv(shutil.copy(path, path + ".bench"), processed_dir, **types)
+
+    orders_types = {"dtype": ORDERS_DTYPES, "parse_dates": ORDERS_DATE_COLUMNS}
+    print(f"{rows} orders, {dataset['products']} products")
+    orders = run("load_csv orders", rows, lambda: load(dataset["orders"], **orders_types),
+                 lambda: pd.read_csv(dataset["orders"], date_format="ISO8601", **orders_types))
+    inventory = run("load_csv inventory", dataset["products"], lambda: load(dataset["inventory"], dtype=INVENTORY_DTYPES),
+                    lambda: pd.read_csv(dataset["inventory"], dtype=INVENTORY_DTYPES))
+
+    run("validate_data orders", rows, lambda: validate_data(orders, ["orderId", "productId", "dateTime", "quantity"]))
+    orders = run("validate_rows orders", rows, lambda: validate_rows(orders, ORDERS_RULES, parse_datetimes=True).valid,
+                 lambda: validate_rows(orders, ORDERS_RULES, parse_datetimes=True).valid)
+    inventory = run("validate_rows inventory", len(inventory), lambda: validate_rows(inventory, INVENTORY_RULES).valid,
+                    lambda: validate_rows(inventory, INVENTORY_RULES).valid)
+    orders = run("apply_schema orders", rows, lambda: apply_schema(orders, SCHEMAS["orders"]),
+                 lambda: apply_schema(orders, SCHEMAS["orders"]))
+    inventory = apply_schema(inventory, SCHEMAS["inventory"])
+    unique_orders = run("remove_dublicates orders", rows, lambda: remove_dublicates(orders, "orderId", "orders"),
+                        lambda: orders.drop_duplicates(subset=["orderId"]))
+    run("Deduplicator orders", rows, lambda: dedup_chunks(orders, "orderId"))
+
+    run("store_raw_data_to_mongo orders", rows,
+        lambda: store_raw_data_to_mongo(DB_NAME, "raw_orders", orders, client, batch_size=1000, concurrency=4,
+                                        write_concern=settings.write_concern("raw")))
+    run("store_raw_data_to_mongo journaled", rows,
+        lambda: store_raw_data_to_mongo(DB_NAME, "raw_orders_journaled", orders, client, batch_size=1000, concurrency=4,
+                                        write_concern=WriteConcern(w=1, j=True)))
+    run("store_raw_data_to_mongo compact", rows,
+        lambda: store_raw_data_to_mongo(DB_NAME, "raw_orders_compact", orders, client, batch_size=1000, concurrency=4,
+                                        encoder=DocumentEncoder(ORDERS_FIELDS, short_names=True, omit_defaults=True)))
+    run("upsert_dataframe_to_mongo orders", len(unique_orders),
+        lambda: upsert_dataframe_to_mongo(DB_NAME, "orders", unique_orders, client, match_field="orderId", concurrency=4,
+                                          encoder=ORDERS_ENCODER),
+        lambda: db["orders"].insert_many(ORDERS_ENCODER.encode(unique_orders)))
+    run("upsert_dataframe_to_mongo inventory", len(inventory),
+        lambda: upsert_dataframe_to_mongo(DB_NAME, "inventory", inventory, client, match_field="productId", concurrency=4,
+                                          encoder=INVENTORY_ENCODER),
+        lambda: db["inventory"].insert_many(INVENTORY_ENCODER.encode(inventory)))
+
+    run("combine_orders_to_inventory", len(unique_orders),
+        lambda: combine_orders_to_inventory_with_aggregates(db["inventory"], db["orders"]))
+    run("update_quantity_per_product", len(inventory), lambda: update_quantity_per_product(db["inventory"]))
+    run("update_order_with_delivery_status", len(unique_orders),
+        lambda: update_order_with_delivery_status(db["orders"], db["inventory"]))
+    run("build_report", len(unique_orders), lambda: build_report(db["inventory"], db["orders"]))
+    if server_side:
+        # mongomock has neither $merge nor $setWindowFields
+        run("merge backend enrich", len(unique_orders), lambda: MergeBackend(db["inventory"], db["orders"]).enrich())
+    run("pandas backend enrich", len(unique_orders), lambda: PandasBackend(inventory, unique_orders).enrich())
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(baseline_path: str, results: List[dict]) -> None:
+    """Prints the time of every stage relative to a baseline run and flags the regressions."""
+    with open(baseline_path) as f:
+        baseline = {(item["rows_generated"], item["stage"]): item for item in json.load(f)["results"]}
+
+    print(f"\nCompared to {os.path.basename(baseline_path)}:")
+    for item in results:
+        before = baseline.get((item["rows_generated"], item["stage"]))
+        if not before or not before["seconds"]:
+            continue
+        ratio = item["seconds"] / before["seconds"]
+        flag = "REGRESSION" if ratio > REGRESSION_FACTOR else ""
+        print(f"  {item['rows_generated']:>10} {item['stage']:<36} {before['seconds']:>9.3f} -> {item['seconds']:>9.3f} s {ratio:>6.2f}x {flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", help="MongoDB URI, defaults to mongomock")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000],
+                        help="Order rows per run, from 10k up to 50M")
+    parser.add_argument("--stages", nargs="+", help="Only measure these stages")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Also record the peak of Python allocations with tracemalloc (slows the stages down)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="Where the synthetic data is written, defaults to a temporary directory")
+    parser.add_argument("--out", help="Result file, defaults to benchmarks/results/<time>-<commit>.json")
+    parser.add_argument("--compare", help="A previous result file to compare with")
+    args = parser.parse_args()
+
+    # Pool sizes, compressors and write concerns from MONGO_CONFIG and MONGO_*, like the pipeline
+    settings = load_settings()._replace(uri=args.uri) if args.uri else load_settings()
+    if args.uri:
+        client = create_client(settings)
+    else:
+        import mongomock
+        client = mongomock.MongoClient()
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="bench_pipeline_")
+    results = []
+    try:
+        for rows in args.rows:
+            for stats in bench_scale(client, rows, data_dir, args.stages, args.trace_memory, args.seed, server_side=bool(args.uri),
+                                     settings=settings):
+                results.append({"rows_generated": rows, **stats})
+    finally:
+        client.drop_database(DB_NAME)
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    commit = git_commit()
+    started = datetime.now(timezone.utc)
+    out = args.out or os.path.join(RESULTS_DIR, f"{started:%Y%m%dT%H%M%S}-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump({
+            "commit": commit,
+            "created": started.isoformat(),
+            "mongo": "mongodb" if args.uri else "mongomock",
+            "compressors": list(settings.compressors),
+            "write_concerns": settings.write_concerns,
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "results": results,
+        }, f, indent=2)
+    print(f"\nResults written to {out}")
+
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Generator of synthetic orders.csv and inventory.csv files in the format of data/raw.
+
+Values are drawn from the distributions of the sample files, with realistic skew: product
+popularity follows a Zipf distribution (a few hot products get most of the orders), orders
+repeat the same orderId over several rows like in the sample, dateTime is spread over a
+period, and stock is sized around the expected demand so hot products run short.
+
+    python benchmarks/generate_data.py --rows 1000000 --out /tmp/bench_data
+
+Orders are written in chunks, so 50M rows need about as much memory as one chunk.
+"""
+import argparse
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_DIR = os.path.join(ROOT_DIR, "data", "raw")
+
+ORDER_COLUMNS = ["orderId", "productId", "currency", "quantity", "shippingCost", "amount",
+                 "channel", "channelGroup", "campaign", "dateTime"]
+
+
+def products_for_rows(rows: int) -> int:
+    """Number of products for a number of order rows, about the ratio of the sample data."""
+    return max(1_000, rows // 20)
+
+
+def generate_inventory(products: int, rows: int, seed: int = 0, zipf_a: float = 1.1) -> pd.DataFrame:
+    """
+    Generates an inventory of `products` unique products.
+
+    The products are ranked by popularity (the first one is the hottest), see popularity().
+    Stock is the expected demand for `rows` order rows times a lognormal factor, so a share
+    of the products, hot ones included, can't cover their orders.
+    """
+    rng = np.random.default_rng(seed)
+    sample = pd.read_csv(os.path.join(SAMPLE_DIR, "inventory.csv"))
+
+    # productId like prod1548#prod104001000080: a model number and a unique variant number
+    models = rng.integers(1500, 2400, products)
+    variants = rng.choice(10**11, products, replace=False) + 10**11
+    descriptions = sample[["name", "category", "subCategory"]].sample(n=products, replace=True, random_state=seed)
+
+    mean_quantity = pd.read_csv(os.path.join(SAMPLE_DIR, "orders.csv"), usecols=["quantity"])["quantity"].mean()
+    expected_demand = popularity(products, zipf_a) * rows * mean_quantity
+    quantity = np.floor(expected_demand * rng.lognormal(0.0, 0.5, products)).astype("int64")
+
+    return pd.DataFrame({
+        "productId": [f"prod{model}#prod{variant}" for model, variant in zip(models, variants)],
+        "name": descriptions["name"].to_numpy(),
+        "quantity": quantity,
+        "category": descriptions["category"].to_numpy(),
+        "subCategory": descriptions["subCategory"].to_numpy(),
+    })
+
+
+def popularity(products: int, zipf_a: float = 1.1) -> np.ndarray:
+    """Share of the orders of every product by popularity rank, a Zipf distribution."""
+    weights = 1.0 / np.arange(1, products + 1) ** zipf_a
+    return weights / weights.sum()
+
+
+def generate_orders(rows: int, inventory: pd.DataFrame, seed: int = 0, zipf_a: float = 1.1,
+                    lines_per_order: float = 7.0, first_order: int = 0,
+                    start: str = "2023-02-01", days: int = 106) -> pd.DataFrame:
+    """
+    Generates `rows` order rows for the products of the inventory.
+
+    Every orderId is repeated over about lines_per_order rows (the sample has 2858 rows for 409
+    orders), the repeated rows keep their own product and dateTime like in the sample. The
+    orders are numbered from first_order, chunks with distinct numbers have distinct orderIds.
+    """
+    rng = np.random.default_rng(seed)
+    sample = pd.read_csv(os.path.join(SAMPLE_DIR, "orders.csv"))
+
+    product_index = rng.choice(len(inventory), rows, p=popularity(len(inventory), zipf_a))
+    orders = max(1, int(rows / lines_per_order))
+    order_numbers = (first_order + rng.integers(0, orders, rows)).astype("uint64")
+    # Random looking but unique UUIDs, multiplying by an odd number is a bijection modulo 2**64
+    high = (order_numbers * np.uint64(0x9E3779B97F4A7C15)).tolist()
+    low = ((order_numbers * np.uint64(0xC2B2AE3D27D4EB4F)) ^ np.uint64(0x165667B19E3779F9)).tolist()
+    order_ids = [f"{h >> 32:08x}-{(h >> 16) & 0xffff:04x}-{h & 0xffff:04x}-{l >> 48:04x}-{l & 0xffffffffffff:012x}"
+                 for h, l in zip(high, low)]
+
+    # Channel, channelGroup and campaign are drawn together so the combinations stay realistic
+    marketing = sample[["channel", "channelGroup", "campaign"]].sample(n=rows, replace=True, random_state=seed)
+    seconds = rng.integers(0, days * 86_400, rows)
+
+    return pd.DataFrame({
+        "orderId": order_ids,
+        "productId": inventory["productId"].to_numpy()[product_index],
+        "currency": "SEK",
+        "quantity": rng.choice(sample["quantity"].to_numpy(), rows),
+        "shippingCost": rng.choice(sample["shippingCost"].to_numpy(), rows),
+        "amount": rng.choice(sample["amount"].to_numpy(), rows),
+        "channel": marketing["channel"].to_numpy(),
+        "channelGroup": marketing["channelGroup"].to_numpy(),
+        "campaign": marketing["campaign"].to_numpy(),
+        "dateTime": (pd.Timestamp(start, tz="UTC") + pd.to_timedelta(seconds, unit="s")).strftime("%Y-%m-%dT%H:%M:%SZ"),
+    }, columns=ORDER_COLUMNS)
+
+
+def write_dataset(out_dir: str, rows: int, products: Optional[int] = None, seed: int = 0,
+                  zipf_a: float = 1.1, chunk_size: int = 1_000_000) -> dict:
+    """
+    Writes orders.csv and inventory.csv to out_dir.
+
+    Returns:
+        dict: The paths and the number of rows and products.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    products = products or products_for_rows(rows)
+    inventory = generate_inventory(products, rows, seed=seed, zipf_a=zipf_a)
+    inventory_path = os.path.join(out_dir, "inventory.csv")
+    inventory.to_csv(inventory_path, index=False)
+
+    orders_path = os.path.join(out_dir, "orders.csv")
+    for i, offset in enumerate(range(0, rows, chunk_size)):
+        chunk = generate_orders(min(chunk_size, rows - offset), inventory, seed=seed + i, zipf_a=zipf_a, first_order=offset)
+        chunk.to_csv(orders_path, index=False, mode="w" if i == 0 else "a", header=i == 0)
+
+    return {"orders": orders_path, "inventory": inventory_path, "rows": rows, "products": products}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000, help="Number of order rows")
+    parser.add_argument("--products", type=int, help="Number of products, defaults to rows / 20")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Skew of the product popularity")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", required=True, help="Output directory")
+    args = parser.parse_args()
+
+    dataset = write_dataset(args.out, args.rows, products=args.products, seed=args.seed, zipf_a=args.zipf)
+    print(f"Wrote {dataset['rows']} orders and {dataset['products']} products to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+
+try:
+    from .queries import DELIVERED, CANNOT_DELIVER
+except ImportError:
+    from queries import DELIVERED, CANNOT_DELIVER
+
+
+def allocate_delivery_status(orders: pd.DataFrame, stock: dict) -> pd.Series:
+    """
+    Allocates inventory to orders first-in-first-out and returns the delivery status of every order.
+
+    Orders are consumed per product in 'dateTime' order (oldest first). As soon as the running
+    total of ordered quantity exceeds the stock of the product, that order and every later order
+    for the same product is marked "Cannot Deliver". Products missing from `stock` are treated
+    as fully in stock.
+
+    Args:
+        orders (pd.DataFrame): Orders with at least 'productId', 'quantity' and 'dateTime'.
+        stock (dict): Available quantity keyed by productId.
+
+    Returns:
+        pd.Series: The delivery status of each order, aligned with the index of `orders`.
+    """
+    if orders.empty:
+        return pd.Series([], index=orders.index, dtype=object)
+
+    # Stable sort so orders with the same dateTime keep their original order
+    ordered = orders.sort_values(["productId", "dateTime"], kind="mergesort")
+
+    # Running total of ordered quantity within each product
+    demand = ordered.groupby("productId", sort=False)["quantity"].cumsum().to_numpy()
+    available = ordered["productId"].map(stock).to_numpy(dtype=float, na_value=np.inf)
+
+    status = np.where(demand > available, CANNOT_DELIVER, DELIVERED)
+    return pd.Series(status, index=ordered.index, dtype=object).reindex(orders.index)
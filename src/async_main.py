@@ -0,0 +1,218 @@
+import asyncio
+import contextlib
+import logging
+import os
+import main as batch
+from ingestion import discover_files, iter_csv_chunks, move_to_processed, ORDERS_DTYPES, ORDERS_DATE_COLUMNS, INVENTORY_DTYPES
+from validation import validate_rows, ORDERS_RULES, INVENTORY_RULES
+from reporting import print_report
+from dag import Stage, run_stages
+from schema import SCHEMAS, apply_schema
+from dedup import Deduplicator
+from checkpoint import source_id
+from incremental import file_fingerprint
+from rollups import previous_orders, sales_deltas, apply_sales_deltas, refresh_rollups
+from instrumentation import Instrumentation, count, ROUND_TRIPS
+from async_mongodb_utils import (
+    get_async_mongo_client,
+    store_raw_data_async,
+    upsert_dataframe_async,
+    build_report_async,
+    iterate_in_thread,
+)
+# Parsed chunks waiting to be written, bounds the memory when parsing is faster than MongoDB
+ASYNC_QUEUE_SIZE: int = int(os.environ.get("ASYNC_QUEUE_SIZE", 4))
+
+async def quarantine_rows_async(db, rejected, source: str, raw_id: str = None) -> None:
+    """The asyncio counterpart of main.quarantine_rows."""
+    if rejected is None or rejected.empty:
+        return
+    print(f"{source}: {len(rejected)} rows failed validation and were moved to {batch.QUARANTINE_COLLECTION}")
+    rejected = rejected.astype(object).where(rejected.notna(), None).assign(source=source)
+    quarantine = db.get_collection(batch.QUARANTINE_COLLECTION, write_concern=batch.MONGO_SETTINGS.write_concern("raw"))
+    await store_raw_data_async(quarantine, rejected, concurrency=batch.WRITE_OPTIONS["concurrency"], source_id=raw_id)
+
+async def stream_csv_async(db, file_path: str, raw_collection_name: str, collection_name: str, match_field: str,
+                           rules: list, dtype: dict, parse_dates: list = None, deduplicator: Deduplicator = None,
+                           chunk_size: int = batch.CHUNK_SIZE, queue_size: int = ASYNC_QUEUE_SIZE, sync_db=None) -> int:
+    """
+    Streams a CSV file into its raw and processed collections, like main.stream_csv_to_mongo.
+
+    A producer parses and validates the chunks in worker threads and puts them on a queue of at
+    most queue_size chunks. A consumer writes them, the raw insert and the upsert of a chunk run
+    concurrently. Parsing the next chunk overlaps with writing the previous one, and a full queue
+    makes the producer wait, so memory stays bounded when MongoDB is the bottleneck.
+
+    sync_db is the database of the blocking client. With it, raw rows without a date go to the
+    partition of the file's first ingestion (see main.raw_source_month) and, with ROLLUPS, the
+    sales rollups are updated like by main.upsert_processed: the stored versions of a chunk's
+    orders are read before its upsert and the difference is applied once it is written.
+
+    Returns:
+        int: The number of rows read.
+    """
+    deduplicator = deduplicator or Deduplicator(match_field)
+    concurrency = batch.WRITE_OPTIONS["concurrency"]
+    raw_write_concern = batch.MONGO_SETTINGS.write_concern("raw")
+    collection = db.get_collection(collection_name, write_concern=batch.MONGO_SETTINGS.write_concern("processed"))
+    source = os.path.basename(file_path)
+    # Raw documents get ids from the file's content, storing the file again replaces them
+    raw_id = source_id(await asyncio.to_thread(file_fingerprint, file_path))
+    month = await asyncio.to_thread(batch.raw_source_month, sync_db, raw_id) if sync_db is not None else None
+    rollups_db = sync_db if batch.ROLLUPS and collection_name == batch.ORDERS_COLLECTION else None
+    queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    rows = 0
+    count(bytes_read=os.path.getsize(file_path))
+
+    async def produce() -> None:
+        nonlocal rows
+        async for chunk in iterate_in_thread(iter_csv_chunks(file_path, chunk_size, dtype=dtype, parse_dates=parse_dates)):
+            rows += len(chunk)
+            count(rows_in=len(chunk))
+            result = await asyncio.to_thread(validate_rows, chunk, rules, parse_datetimes=bool(parse_dates))
+            await quarantine_rows_async(db, result.rejected_with_reasons(), source, raw_id)
+            valid = await asyncio.to_thread(apply_schema, result.valid, SCHEMAS[collection_name], uuid_binary=batch.BINARY_UUIDS)
+            await queue.put(await asyncio.to_thread(deduplicator.drop_ingested, valid))
+        # On errors the task group cancels the consumer instead
+        await queue.put(None)
+
+    async def consume() -> None:
+        while (chunk := await queue.get()) is not None:
+            # Keep the first row of every key, like remove_dublicates does for a whole file. Safe while
+            # the producer runs drop_ingested in its thread, the two don't share any state
+            unique = deduplicator.drop_duplicates(chunk)
+            # The raw collection, or its monthly partitions with PARTITION_RAW
+            writes = [store_raw_data_async(db.get_collection(name, write_concern=raw_write_concern), rows, concurrency=concurrency,
+                                           encoder=batch.ENCODERS[raw_collection_name], source_id=raw_id)
+                      for name, rows in batch.raw_partitions(raw_collection_name, chunk, month)]
+            previous = None
+            if not unique.empty:
+                if rollups_db is not None:
+                    previous = await asyncio.to_thread(previous_orders, rollups_db[collection_name], unique)
+                writes.append(upsert_dataframe_async(collection, unique, match_field, concurrency=concurrency,
+                                                     encoder=batch.ENCODERS[collection_name]))
+            await asyncio.gather(*writes)
+            if previous is not None:
+                deltas = await asyncio.to_thread(sales_deltas, unique, previous)
+                await asyncio.to_thread(apply_sales_deltas, rollups_db, deltas, concurrency)
+            count(rows_out=len(unique))
+
+    async with asyncio.TaskGroup() as group:
+        group.create_task(produce())
+        group.create_task(consume())
+
+    print(f"{collection_name}: streamed {rows} rows, {deduplicator.unique_keys} unique {match_field}")
+    print(deduplicator.summary())
+    # Only move the file once everything read from it has been stored
+    move_to_processed(file_path, batch.PROCESSED_DIR)
+    return rows
+
+def pipeline_stages(backend: str = batch.BACKEND, chunk_size: int = batch.CHUNK_SIZE,
+                    queue_size: int = ASYNC_QUEUE_SIZE, resources: contextlib.AsyncExitStack = None) -> list:
+    """
+    The stages of the async pipeline.
+
+    Orders and inventory are ingested concurrently once connected, the enrichment waits for
+    both and the report for the enrichment. The enrichment is a chain of dependent aggregations
+    and updates, it runs with the blocking client in a worker thread.
+
+    The connect stage registers the closing of both clients with resources, so they are closed
+    when it exits even if a later stage fails. Without it the caller closes them.
+    """
+    async def connect():
+        # The blocking client creates the indexes and runs the enrichment
+        client = await asyncio.to_thread(batch.connect)
+        if not client:
+            raise ConnectionError("Failed to connect to MongoDB")
+        if resources is not None:
+            resources.callback(client.close)
+        async_client = get_async_mongo_client(event_listeners=[ROUND_TRIPS], settings=batch.MONGO_SETTINGS)
+        if resources is not None:
+            resources.push_async_callback(async_client.close)
+        return client, async_client
+
+    async def ingest_orders(clients):
+        client, async_client = clients
+        deduplicator = batch.orders_deduplicator(client)
+        rows = 0
+        # Files are streamed one after another sorted by name, of a key in several files the first one wins
+        for file_path in discover_files(batch.RAW_DIR, batch.ORDERS_PATTERN):
+            rows += await stream_csv_async(async_client[batch.DB_NAME], file_path,
+                                           batch.RAW_ORDERS_COLLECTION, batch.ORDERS_COLLECTION, "orderId",
+                                           ORDERS_RULES, ORDERS_DTYPES, ORDERS_DATE_COLUMNS, deduplicator,
+                                           chunk_size=chunk_size, queue_size=queue_size, sync_db=client[batch.DB_NAME])
+        deduplicator.save()
+        # Cached reports of the orders are computed again
+        await asyncio.to_thread(batch.data_versions(client[batch.DB_NAME]).bump, batch.ORDERS_COLLECTION)
+        return rows
+
+    async def ingest_inventory(clients):
+        client, async_client = clients
+        deduplicator = Deduplicator("productId")
+        rows = 0
+        for file_path in discover_files(batch.RAW_DIR, batch.INVENTORY_PATTERN):
+            rows += await stream_csv_async(async_client[batch.DB_NAME], file_path,
+                                           batch.RAW_INVENTORY_COLLECTION, batch.INVENTORY_COLLECTION, "productId",
+                                           INVENTORY_RULES, INVENTORY_DTYPES, None, deduplicator,
+                                           chunk_size=chunk_size, queue_size=queue_size, sync_db=client[batch.DB_NAME])
+        await asyncio.to_thread(batch.data_versions(client[batch.DB_NAME]).bump, batch.INVENTORY_COLLECTION)
+        return rows
+
+    async def rollups(clients, orders_rows, inventory_rows):
+        client, _ = clients
+        # The category rollup is derived from the product rollup and the categories of the ingested inventory,
+        # every rollup is rebuilt if an update of them failed
+        db = client[batch.DB_NAME]
+        await asyncio.to_thread(refresh_rollups, db, db[batch.ORDERS_COLLECTION], db[batch.INVENTORY_COLLECTION],
+                                concurrency=batch.WRITE_OPTIONS["concurrency"])
+
+    async def enrich(clients, orders_rows, inventory_rows):
+        client, _ = clients
+        # The pandas backend already reads the collections when it is made
+        pipeline = await asyncio.to_thread(batch.make_backend, backend, client[batch.DB_NAME])
+        summary = await asyncio.to_thread(pipeline.enrich)
+        await asyncio.to_thread(batch.data_versions(client[batch.DB_NAME]).bump, batch.ORDERS_COLLECTION, batch.INVENTORY_COLLECTION)
+        count(rows_out=sum(summary.values()))
+        print("Inventory updated successfully and data saved to MongoDB!")
+        return pipeline
+
+    async def report(clients, pipeline):
+        _, async_client = clients
+        if backend == "pandas":
+            # Computed from the DataFrames the enrichment already holds
+            return pipeline.report()
+        db = async_client[batch.DB_NAME]
+        return await build_report_async(db[batch.INVENTORY_COLLECTION], db[batch.ORDERS_COLLECTION])
+
+    stages = [
+        Stage("connect", connect),
+        Stage("ingest orders", ingest_orders, ("connect",)),
+        Stage("ingest inventory", ingest_inventory, ("connect",)),
+        Stage("enrich", enrich, ("connect", "ingest orders", "ingest inventory")),
+        Stage("report", report, ("connect", "enrich")),
+    ]
+    if batch.ROLLUPS:
+        stages.append(Stage("rollups", rollups, ("connect", "ingest orders", "ingest inventory")))
+    return stages
+
+async def main(backend: str = batch.BACKEND, chunk_size: int = batch.CHUNK_SIZE, queue_size: int = ASYNC_QUEUE_SIZE,
+               instrumentation: Instrumentation = None):
+    """
+    Runs the pipeline on PyMongo's asyncio API, an alternative to main.main.
+
+    Reads the files in RAW_DIR matching ORDERS_PATTERN and INVENTORY_PATTERN like the parallel mode
+    and uses the same settings as the streaming mode (BACKEND, CHUNK_SIZE,
+    DEDUP_STORE, COMPACT_RAW, ROLLUPS, ...). Incremental, parallel, staging and service mode are only
+    available in main.py. The stage metrics of both entry points can be compared directly.
+    """
+    instrumentation = instrumentation or Instrumentation(batch.PROFILE_STAGES, batch.TRACE_MEMORY_STAGES, batch.PROFILE_DIR)
+    # Closes the clients opened by the connect stage, also when a later stage fails
+    async with contextlib.AsyncExitStack() as resources:
+        results = await run_stages(pipeline_stages(backend, chunk_size, queue_size, resources), instrumentation)
+        print_report(results["report"])
+        if batch.METRICS_FILE:
+            instrumentation.write_openmetrics(batch.METRICS_FILE)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=batch.LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    asyncio.run(main())
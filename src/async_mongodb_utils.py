@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Iterable, List, Optional
+import pandas as pd
+from pymongo import UpdateOne
+
+try:
+    from pymongo import AsyncMongoClient
+except ImportError:  # Optional, PyMongo's asyncio API needs pymongo 4.9+
+    AsyncMongoClient = None
+
+try:
+    from .bulk_writer import WriteStats
+    from .encoding import DocumentEncoder
+    from .mongo_config import MongoSettings, load_settings
+    from .mongodb_utils import iter_record_batches, raw_operations
+    from .reporting import (
+        PipelineReport,
+        BEST_SELLING_PIPELINE,
+        NEGATIVE_BALANCE_PIPELINE,
+        DELIVERY_SUMMARY_PIPELINE,
+        inventory_report_from,
+        delivery_summaries_from,
+    )
+except ImportError:
+    from bulk_writer import WriteStats
+    from encoding import DocumentEncoder
+    from mongo_config import MongoSettings, load_settings
+    from mongodb_utils import iter_record_batches, raw_operations
+    from reporting import (
+        PipelineReport,
+        BEST_SELLING_PIPELINE,
+        NEGATIVE_BALANCE_PIPELINE,
+        DELIVERY_SUMMARY_PIPELINE,
+        inventory_report_from,
+        delivery_summaries_from,
+    )
+
+def get_async_mongo_client(uri: Optional[str] = None, event_listeners: Optional[list] = None,
+                           settings: Optional[MongoSettings] = None) -> "AsyncMongoClient":
+    """The asyncio counterpart of mongodb_utils.get_mongo_client, connects lazily on the first command."""
+    if AsyncMongoClient is None:
+        raise ImportError("The async pipeline requires pymongo 4.9+ (AsyncMongoClient), install it with: pip install -U pymongo")
+    settings = settings or load_settings()
+    return AsyncMongoClient(uri or settings.uri, event_listeners=event_listeners or [], **settings.client_options())
+
+async def bulk_write_batches(collection, batches: Iterable[List[Any]], concurrency: int = 4) -> WriteStats:
+    """
+    Writes batches of operations as unordered bulk_writes, at most `concurrency` in flight.
+
+    The batches are independent, so operations on the same document must not be in two batches.
+    Retryable errors are retried by the driver (retryWrites), the first other error is raised
+    once the batches in flight are done.
+    """
+    started = time.perf_counter()
+    slots = asyncio.Semaphore(concurrency)
+    documents = 0
+    tasks = []
+
+    async def write(operations: List[Any]) -> None:
+        nonlocal documents
+        try:
+            await collection.bulk_write(operations, ordered=False)
+            documents += len(operations)
+        finally:
+            slots.release()
+
+    for operations in batches:
+        if not operations:
+            continue
+        # Wait for a free slot before the next batch is built, so memory stays bounded
+        await slots.acquire()
+        tasks.append(asyncio.create_task(write(operations)))
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    stats = WriteStats(documents=documents, batches=len(tasks), retries=0,
+                       failed=sum(isinstance(result, BaseException) for result in results),
+                       seconds=time.perf_counter() - started)
+    logging.info(f"{collection.name}: wrote {stats.documents} documents in {stats.batches} batches, "
+                 f"{stats.docs_per_sec:.0f} docs/sec ({stats.failed} batches failed)")
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return stats
+
+async def store_raw_data_async(collection, df: pd.DataFrame, batch_size: int = 1000, concurrency: int = 4,
+                               encoder: Optional[DocumentEncoder] = None, source_id: Optional[str] = None) -> WriteStats:
+    """The asyncio counterpart of mongodb_utils.store_raw_data_to_mongo."""
+    rows = iter(df.index)
+    batches = (raw_operations(records, rows, source_id) for records in iter_record_batches(df, batch_size, encoder))
+    return await bulk_write_batches(collection, batches, concurrency)
+
+async def upsert_dataframe_async(collection, df: pd.DataFrame, match_field: str, batch_size: int = 1000,
+                                 concurrency: int = 4, encoder: Optional[DocumentEncoder] = None) -> Optional[WriteStats]:
+    """
+    The asyncio counterpart of mongodb_utils.upsert_dataframe_to_mongo.
+
+    Batches are written concurrently without ordering between them, so match_field must be
+    unique in df (e.g. after Deduplicator.drop_duplicates).
+    """
+    if match_field not in df.columns:
+        raise ValueError(f"match_field '{match_field}' is not a valid column in the DataFrame.")
+    if df[match_field].duplicated().any():
+        raise ValueError(f"match_field '{match_field}' must be unique, concurrent batches aren't applied in order.")
+    if encoder is not None and encoder.short_names:
+        raise ValueError("Short field names are only supported for raw collections, upserts match and query by column name.")
+    if df.empty:
+        logging.warning("The provided DataFrame is empty. No data to upsert.")
+        return None
+
+    fields = [encoder.field_name(column) for column in df.columns] if encoder else []
+
+    def operations(records: List[dict]) -> List[UpdateOne]:
+        batch = []
+        for record in records:
+            update = {"$set": record}
+            unset = {field: "" for field in fields if field not in record}
+            if unset:
+                update["$unset"] = unset
+            batch.append(UpdateOne({match_field: record[match_field]}, update, upsert=True))
+        return batch
+
+    batches = (operations(records) for records in iter_record_batches(df, batch_size, encoder))
+    return await bulk_write_batches(collection, batches, concurrency)
+
+async def aggregate_to_list(collection, pipeline: list) -> List[dict]:
+    """Runs an aggregation and returns all its results."""
+    cursor = await collection.aggregate(pipeline)
+    return await cursor.to_list(None)
+
+async def build_report_async(inventory, orders) -> PipelineReport:
+    """The asyncio counterpart of reporting.build_report, the aggregations run concurrently."""
+    best_selling, negative_balance, delivery_results = await asyncio.gather(
+        aggregate_to_list(inventory, BEST_SELLING_PIPELINE),
+        aggregate_to_list(inventory, NEGATIVE_BALANCE_PIPELINE),
+        aggregate_to_list(orders, DELIVERY_SUMMARY_PIPELINE),
+    )
+    return PipelineReport(
+        inventory_report_from(best_selling, negative_balance),
+        delivery_summaries_from(delivery_results),
+    )
+
+async def iterate_in_thread(iterator) -> AsyncIterator[Any]:
+    """Iterates a blocking iterator (e.g. CSV chunks) in a worker thread, one item at a time."""
+    sentinel = object()
+    while True:
+        item = await asyncio.to_thread(next, iterator, sentinel)
+        if item is sentinel:
+            return
+        yield item
@@ -0,0 +1,256 @@
+import math
+from abc import ABC, abstractmethod
+from typing import Iterable, Optional
+import pandas as pd
+from pymongo import UpdateMany, UpdateOne
+from pymongo.collection import Collection
+
+try:
+    from .allocation import allocate_delivery_status, DELIVERED, CANNOT_DELIVER
+    from .bulk_writer import BulkWriter
+    from .encoding import decimal_to_float
+    from .mongodb_utils import (
+        combine_orders_to_inventory_with_aggregates,
+        merge_order_delivery_status,
+        merge_quantity_per_product,
+        update_quantity_per_product,
+        update_order_with_delivery_status,
+    )
+    from .report_cache import ReportCache
+    from .reporting import build_report, PipelineReport, InventoryReport, DeliverySummary
+    from .staging import list_staged_files, read_latest
+except ImportError:
+    from allocation import allocate_delivery_status, DELIVERED, CANNOT_DELIVER
+    from bulk_writer import BulkWriter
+    from encoding import decimal_to_float
+    from mongodb_utils import (
+        combine_orders_to_inventory_with_aggregates,
+        merge_order_delivery_status,
+        merge_quantity_per_product,
+        update_quantity_per_product,
+        update_order_with_delivery_status,
+    )
+    from report_cache import ReportCache
+    from reporting import build_report, PipelineReport, InventoryReport, DeliverySummary
+    from staging import list_staged_files, read_latest
+
+# Fields the enrichment adds to the inventory documents
+INVENTORY_ENRICHED_FIELDS: list = [
+    "ordersDetailsCount",
+    "ordersQuantity",
+    "firstOrderDate",
+    "lastOrderDate",
+    "totalQuantityOrdered",
+    "InventoryBalanceAfterOrder",
+]
+
+def _is_negative(values: pd.Series) -> pd.Series:
+    """Boolean mask of the negative values, missing values count as not negative."""
+    return values.lt(0).fillna(False).astype(bool)
+
+class PipelineBackend(ABC):
+    """Computes the enrichment (order aggregates, inventory balance, delivery status) and the report."""
+
+    @abstractmethod
+    def enrich(self, product_ids: Optional[Iterable] = None) -> dict:
+        """Enriches inventory and orders and returns the number of orders per delivery status."""
+
+    @abstractmethod
+    def report(self) -> PipelineReport:
+        """Computes the end of run report."""
+
+class MongoBackend(PipelineBackend):
+    """Runs the enrichment and the report as aggregation pipelines on the MongoDB server."""
+
+    def __init__(self, inventory: Collection, orders: Collection, cache: Optional[ReportCache] = None):
+        self.inventory = inventory
+        self.orders = orders
+        self.cache = cache
+
+    def enrich(self, product_ids: Optional[Iterable] = None) -> dict:
+        # In incremental mode only the given products are recomputed
+        combine_orders_to_inventory_with_aggregates(self.inventory, self.orders, product_ids=product_ids)
+        update_quantity_per_product(self.inventory, product_ids=product_ids)
+        return self.allocate(product_ids)
+
+    def allocate(self, product_ids: Optional[Iterable] = None) -> dict:
+        """Runs only the first-in-first-out allocation of the delivery statuses, from the stored inventory balances."""
+        return update_order_with_delivery_status(self.orders, self.inventory, product_ids=product_ids)
+
+    def report(self) -> PipelineReport:
+        # With a cache the report is only computed again once orders or inventory changed
+        if self.cache is not None:
+            return self.cache.call(build_report, self.inventory, self.orders)
+        return build_report(self.inventory, self.orders)
+
+class MergeBackend(MongoBackend):
+    """
+    Runs the enrichment entirely on the MongoDB server: every derived field is written with
+    $merge, so no document crosses the wire and the wall time hardly depends on the latency to
+    the server. Requires MongoDB 5.0+, see merge_order_delivery_status.
+    """
+
+    def enrich(self, product_ids: Optional[Iterable] = None) -> dict:
+        combine_orders_to_inventory_with_aggregates(self.inventory, self.orders, use_merge=True, product_ids=product_ids)
+        merge_quantity_per_product(self.inventory, product_ids=product_ids)
+        return self.allocate(product_ids)
+
+    def allocate(self, product_ids: Optional[Iterable] = None) -> dict:
+        return merge_order_delivery_status(self.orders, self.inventory, product_ids=product_ids)
+
+class PandasBackend(PipelineBackend):
+    """
+    Runs the enrichment and the report on DataFrames with vectorized groupby/merge.
+
+    Gives the same results as MongoBackend. Without collections everything stays in memory, so
+    the pipeline logic can be run, tested and benchmarked without a server. With collections
+    (see from_collections) the enriched fields are written back as bulk updates, MongoDB is
+    then only a bulk source and sink.
+
+    Orders with the same productId and dateTime are allocated in row order, and productId is
+    expected to be unique in the inventory, like in the processed collections.
+    """
+
+    def __init__(self, inventory: pd.DataFrame, orders: pd.DataFrame,
+                 inventory_collection: Optional[Collection] = None, orders_collection: Optional[Collection] = None,
+                 batch_size: int = 1000, concurrency: int = 4):
+        self.inventory = inventory.reset_index(drop=True)
+        self.orders = orders.reset_index(drop=True)
+        self.inventory_collection = inventory_collection
+        self.orders_collection = orders_collection
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+
+    @classmethod
+    def from_collections(cls, inventory: Collection, orders: Collection, **kwargs) -> "PandasBackend":
+        """Reads the processed collections once, the results are written back to them by enrich."""
+        # In _id order, the same tie break MongoBackend uses for orders with the same dateTime
+        orders_df = pd.DataFrame(
+            list(orders.find({}, {"_id": 1, "orderId": 1, "productId": 1, "quantity": 1, "amount": 1, "dateTime": 1}).sort("_id", 1)),
+            columns=["_id", "orderId", "productId", "quantity", "amount", "dateTime"]
+        )
+        # Amounts are stored as Decimal128, see encoding.ORDERS_FIELDS
+        orders_df["amount"] = orders_df["amount"].map(decimal_to_float)
+        inventory_df = pd.DataFrame(
+            list(inventory.find({}, {"_id": 1, "productId": 1, "name": 1, "quantity": 1})),
+            columns=["_id", "productId", "name", "quantity"]
+        )
+        return cls(inventory_df, orders_df, inventory_collection=inventory, orders_collection=orders, **kwargs)
+
+    @classmethod
+    def from_staged(cls, staging_dir: str, inventory: Optional[Collection] = None, orders: Optional[Collection] = None,
+                    **kwargs) -> "PandasBackend":
+        """
+        Reads the staged Parquet files, memory-mapped and only the columns the enrichment needs.
+
+        The rows are the ones the processed collections hold after replaying the staged files,
+        see staging.read_latest. The results are written back to the collections, if given.
+        """
+        orders_df = read_latest(list_staged_files(staging_dir, "orders"), "orderId", ["productId", "quantity", "amount", "dateTime"])
+        inventory_df = read_latest(list_staged_files(staging_dir, "inventory"), "productId", ["name", "quantity"])
+        return cls(inventory_df, orders_df, inventory_collection=inventory, orders_collection=orders, **kwargs)
+
+    def enrich(self, product_ids: Optional[Iterable] = None) -> dict:
+        """
+        Enriches inventory and orders, see MongoBackend.
+
+        Everything is recomputed from the DataFrames, product_ids only limits what is written
+        back to the collections.
+        """
+        self.inventory = self._with_order_aggregates(self.inventory.drop(columns=INVENTORY_ENRICHED_FIELDS, errors="ignore"))
+
+        # Products that can't cover all their orders, allocated first-in-first-out
+        short = self.inventory[_is_negative(self.inventory["InventoryBalanceAfterOrder"])]
+        stock = short.groupby("productId")["quantity"].min().to_dict()
+        status = pd.Series(DELIVERED, index=self.orders.index, dtype=object)
+        short_orders = self.orders[self.orders["productId"].isin(stock.keys())]
+        status[short_orders.index] = allocate_delivery_status(short_orders, stock)
+        self.orders = self.orders.assign(deliveryStatus=status)
+
+        if self.inventory_collection is not None and self.orders_collection is not None:
+            self._store(None if product_ids is None else set(product_ids))
+
+        summary = {DELIVERED: int((status == DELIVERED).sum()), CANNOT_DELIVER: int((status == CANNOT_DELIVER).sum())}
+        print(f"Delivery status updated: {summary[DELIVERED]} delivered, {summary[CANNOT_DELIVER]} can't be delivered")
+        return summary
+
+    def _with_order_aggregates(self, inventory: pd.DataFrame) -> pd.DataFrame:
+        """Adds the per-product order aggregates and the inventory balance of the ordered products."""
+        aggregates = self.orders.groupby("productId", sort=False).agg(
+            ordersDetailsCount=("productId", "size"),
+            ordersQuantity=("quantity", "sum"),
+            firstOrderDate=("dateTime", "min"),
+            lastOrderDate=("dateTime", "max"),
+        )
+        inventory = inventory.merge(aggregates, how="left", left_on="productId", right_index=True)
+
+        ordered = inventory["ordersDetailsCount"].notna()
+        inventory["ordersDetailsCount"] = inventory["ordersDetailsCount"].fillna(0).astype("int64")
+        inventory["ordersQuantity"] = inventory["ordersQuantity"].fillna(0).astype(aggregates["ordersQuantity"].dtype)
+        inventory["totalQuantityOrdered"] = inventory["ordersQuantity"].where(ordered)
+        inventory["InventoryBalanceAfterOrder"] = (inventory["quantity"] - inventory["ordersQuantity"]).where(ordered)
+        if pd.api.types.is_integer_dtype(aggregates["ordersQuantity"].dtype):
+            # Integers like the ones MongoDB computes, missing for products without orders
+            inventory = inventory.astype({"totalQuantityOrdered": "Int64", "InventoryBalanceAfterOrder": "Int64"})
+        return inventory
+
+    def _store(self, product_ids: Optional[set]) -> None:
+        """Writes the enriched fields and the delivery statuses back to the collections."""
+        inventory, orders = self.inventory, self.orders
+        if product_ids is not None:
+            inventory = inventory[inventory["productId"].isin(product_ids)]
+            orders = orders[orders["productId"].isin(product_ids)]
+
+        # Missing values as unset fields, BSON can't encode pandas' NA values
+        fields = inventory[["productId"] + INVENTORY_ENRICHED_FIELDS].astype(object)
+        fields = fields.where(fields.notna(), None)
+        with BulkWriter(self.inventory_collection, concurrency=self.concurrency, batch_size=self.batch_size) as writer:
+            for record in fields.to_dict("records"):
+                product_id = record.pop("productId")
+                unset = {field: "" for field, value in record.items() if value is None}
+                unset["ordersDetails"] = ""
+                writer.add(UpdateOne(
+                    {"productId": product_id},
+                    {"$set": {field: value for field, value in record.items() if value is not None}, "$unset": unset}
+                ), key=product_id)
+
+        key = "_id" if "_id" in orders.columns else "orderId"
+        with BulkWriter(self.orders_collection, concurrency=self.concurrency, batch_size=self.batch_size) as writer:
+            for delivery_status, ids in orders.groupby("deliveryStatus")[key]:
+                ids = ids.tolist()
+                for i in range(0, len(ids), self.batch_size):
+                    writer.add(UpdateMany({key: {"$in": ids[i:i + self.batch_size]}}, {"$set": {"deliveryStatus": delivery_status}}))
+
+    def report(self) -> PipelineReport:
+        inventory, orders = self.inventory, self.orders
+
+        ordered = inventory[inventory["ordersDetailsCount"] > 0]
+        # Only the top row, like BEST_SELLING_PIPELINE
+        top = (
+            ordered.groupby("productId", sort=False)
+            .agg(Productname=("name", "first"), totalQuantityOrdered=("ordersQuantity", "sum"))
+            .rename_axis("_id")
+            .reset_index()
+            .sort_values(["totalQuantityOrdered", "_id"], ascending=[False, True], kind="mergesort")
+            .head(1)
+            .astype(object)
+            .to_dict("records")
+        )
+        best_selling = None
+        if top:
+            best_selling = {
+                "productId": top[0]["_id"],
+                "productName": top[0]["Productname"],
+                "totalOrderQuantity": top[0]["totalQuantityOrdered"],
+            }
+        negative_balance = [
+            {"productId": product_id, "productName": name}
+            for product_id, name in inventory.loc[_is_negative(inventory["InventoryBalanceAfterOrder"]), ["productId", "name"]].itertuples(index=False)
+        ]
+
+        # fsum, like the server's $sum, doesn't depend on the order of the amounts
+        deliveries = {
+            delivery_status: DeliverySummary(len(amounts), math.fsum(amounts))
+            for delivery_status, amounts in orders.groupby("deliveryStatus")["amount"]
+        }
+        return PipelineReport(InventoryReport(best_selling, negative_balance), deliveries)
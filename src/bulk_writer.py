@@ -0,0 +1,227 @@
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, Hashable, List, NamedTuple, Optional
+
+import bson
+from pymongo import InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.collection import Collection
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+# Write errors worth retrying: write conflicts, timeouts and primary step downs / shutdowns
+RETRYABLE_ERROR_CODES: set = {6, 7, 89, 91, 112, 189, 262, 9001, 10107, 11600, 11602, 13435, 13436}
+
+# Only retried for updates and replacements, where two concurrent upserts of a new key race to
+# insert it. An insert that fails with it after a lost connection was applied by the lost attempt
+DUPLICATE_KEY_ERROR: int = 11000
+UPDATE_OPERATIONS: tuple = (UpdateOne, UpdateMany, ReplaceOne)
+
+class WriteStats(NamedTuple):
+    """Summary of everything written by a BulkWriter."""
+    documents: int
+    batches: int
+    retries: int
+    failed: int
+    seconds: float
+
+    @property
+    def docs_per_sec(self) -> float:
+        return self.documents / self.seconds if self.seconds > 0 else 0.0
+
+class BulkWriter:
+    """
+    Writes operations to a collection as unordered bulk_write batches, several batches in flight at once.
+
+    Batches are cut at batch_size operations or max_batch_bytes of encoded documents, whichever
+    comes first, and written by a pool of `concurrency` threads sharing the client's connection
+    pool. Operations added with the same key are applied in the order they were added: a key is
+    never twice in the same batch, and a batch waits for the earlier in-flight batch holding the
+    same key. Operations without a key have no ordering guarantee.
+
+    Failed operations with a retryable error code are retried up to max_retries times, duplicate
+    key errors only for updates and replacements (the upserts among them race to insert new
+    keys). An insert that fails with a duplicate key right after an attempt that lost its
+    connection was written by the lost attempt and counts as written. With
+    idempotent=False (e.g. $inc updates) operations of a batch whose connection was lost aren't
+    retried, since they may have been applied, they fail instead. Operations that still fail
+    are logged, counted in WriteStats.failed and raised from close(), as is the
+    first unexpected exception of any batch.
+
+    Usage:
+        with BulkWriter(collection, concurrency=4) as writer:
+            for record in records:
+                writer.add(UpdateOne({"orderId": record["orderId"]}, {"$set": record}, upsert=True), key=record["orderId"])
+        print(writer.stats.docs_per_sec)
+    """
+
+    def __init__(self, collection: Collection, concurrency: int = 4, batch_size: int = 1000,
+                 max_batch_bytes: Optional[int] = None, max_retries: int = 3, retry_backoff: float = 0.1,
+                 idempotent: bool = True):
+        if not isinstance(concurrency, int) or concurrency <= 0:
+            raise ValueError("concurrency must be a positive integer.")
+        if not isinstance(batch_size, int) or batch_size <= 0:
+            raise ValueError("batch_size must be a positive integer.")
+        if max_batch_bytes is not None and max_batch_bytes <= 0:
+            raise ValueError("max_batch_bytes must be a positive integer.")
+
+        self.collection = collection
+        self.batch_size = batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.idempotent = idempotent
+
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bulk-writer")
+        # Bounds the number of batches submitted but not yet written, and so the memory they hold
+        self._slots = threading.BoundedSemaphore(2 * concurrency)
+        self._lock = threading.Lock()
+        self._batch: List[Any] = []
+        self._batch_keys: set = set()
+        self._batch_bytes = 0
+        self._batch_dependencies: set = set()
+        self._inflight_keys: Dict[Hashable, Future] = {}
+        self._exceptions: List[BaseException] = []
+        self._documents = 0
+        self._batches = 0
+        self._retries = 0
+        self._errors: List[dict] = []
+        self._started = time.perf_counter()
+        self._closed = False
+        self.stats: Optional[WriteStats] = None
+
+    def __enter__(self) -> "BulkWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        # Don't hide the original error behind a write error
+        self.close(raise_on_error=exc_type is None)
+
+    def add(self, operation: Any, key: Optional[Hashable] = None, document: Optional[dict] = None) -> None:
+        """
+        Adds a write operation (InsertOne, UpdateOne, ...) to the current batch.
+
+        Args:
+            operation: The pymongo write operation.
+            key: Operations with the same key are applied in the order they were added.
+            document: The document written by the operation, used for the batch size in bytes.
+        """
+        if self._closed:
+            raise ValueError("The BulkWriter is closed.")
+
+        if key is not None and key in self._batch_keys:
+            self.flush()
+
+        size = len(bson.encode(document)) if self.max_batch_bytes and document is not None else 0
+        if self._batch and self.max_batch_bytes and self._batch_bytes + size > self.max_batch_bytes:
+            self.flush()
+
+        if key is not None:
+            self._batch_keys.add(key)
+            with self._lock:
+                earlier = self._inflight_keys.get(key)
+            if earlier is not None:
+                self._batch_dependencies.add(earlier)
+        self._batch.append(operation)
+        self._batch_bytes += size
+
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Submits the current batch to the writer threads."""
+        if not self._batch:
+            return
+        operations, keys, dependencies = self._batch, self._batch_keys, self._batch_dependencies
+        self._batch, self._batch_keys, self._batch_bytes, self._batch_dependencies = [], set(), 0, set()
+
+        self._slots.acquire()
+        # In a copy of the caller's context, so the round-trips are counted for its stage (see instrumentation.py)
+        future = self._executor.submit(contextvars.copy_context().run, self._write, operations, dependencies)
+        with self._lock:
+            for key in keys:
+                self._inflight_keys[key] = future
+        future.add_done_callback(lambda done: self._release(done, keys))
+
+    def close(self, raise_on_error: bool = True) -> WriteStats:
+        """Writes the remaining operations, waits for all batches and returns the write statistics."""
+        if not self._closed:
+            self.flush()
+            self._closed = True
+            self._executor.shutdown(wait=True)
+            self.stats = WriteStats(
+                documents=self._documents,
+                batches=self._batches,
+                retries=self._retries,
+                failed=len(self._errors),
+                seconds=time.perf_counter() - self._started,
+            )
+            logging.info(f"{self.collection.name}: wrote {self.stats.documents} documents in {self.stats.batches} batches, "
+                         f"{self.stats.docs_per_sec:.0f} docs/sec ({self.stats.retries} retries, {self.stats.failed} failed)")
+            for error in self._errors[:10]:
+                logging.error(f"{self.collection.name}: write failed: {error}")
+
+        if raise_on_error and self._exceptions:
+            raise self._exceptions[0]
+        if raise_on_error and self._errors:
+            raise BulkWriteError({"writeErrors": self._errors, "nInserted": 0, "nUpserted": 0,
+                                  "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []})
+        return self.stats
+
+    def _release(self, future: Future, keys: set) -> None:
+        with self._lock:
+            for key in keys:
+                if self._inflight_keys.get(key) is future:
+                    del self._inflight_keys[key]
+            if future.exception() is not None:
+                self._exceptions.append(future.exception())
+        self._slots.release()
+
+    def _write(self, operations: List[Any], dependencies: set) -> None:
+        # Earlier batches holding the same keys were submitted first, so they are already running or done
+        if dependencies:
+            wait(dependencies)
+
+        attempt = 0
+        lost: set = set()
+        while operations:
+            # The operations of the previous attempt if it lost its connection, they may have been applied
+            maybe_applied, lost = lost, set()
+            try:
+                self.collection.bulk_write(operations, ordered=False)
+                failed = []
+            except BulkWriteError as e:
+                failed = e.details.get("writeErrors", [])
+            except AutoReconnect as e:
+                # The whole batch may not have been applied, or only some of it
+                failed = [{"index": i, "code": 6, "errmsg": str(e), "lost": True} for i in range(len(operations))]
+                lost = {id(operation) for operation in operations}
+
+            retry, final = [], []
+            for error in failed:
+                operation = operations[error["index"]]
+                if error.get("lost") and not self.idempotent:
+                    final.append(error)
+                elif error.get("code") == DUPLICATE_KEY_ERROR:
+                    if isinstance(operation, InsertOne) and id(operation) in maybe_applied:
+                        continue  # Written before the connection was lost
+                    (retry if isinstance(operation, UPDATE_OPERATIONS) else final).append(error)
+                else:
+                    (retry if error.get("code") in RETRYABLE_ERROR_CODES else final).append(error)
+            written = len(operations) - len(retry) - len(final)
+            if attempt >= self.max_retries:
+                final, retry = final + retry, []
+
+            with self._lock:
+                self._documents += written
+                self._batches += attempt == 0
+                self._retries += len(retry)
+                self._errors.extend({"code": error.get("code"), "errmsg": error.get("errmsg"), "op": str(operations[error["index"]])}
+                                    for error in final)
+
+            # Retry only the failed operations, in their original order
+            operations = [operations[error["index"]] for error in sorted(retry, key=lambda error: error["index"])]
+            attempt += 1
+            if operations:
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
@@ -0,0 +1,119 @@
+import logging
+import uuid
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+from pymongo.collection import Collection
+
+def source_id(fingerprint: str) -> str:
+    """The _id prefix of the raw documents of a source file, the start of the SHA-256 of its content."""
+    return fingerprint[:16]
+
+class RunManifest:
+    """
+    The completion markers of a pipeline run, so a run that crashed can be resumed where it stopped.
+
+    A run is one document in the runs collection with its mode, its status ("running",
+    "completed" or "abandoned"), the stages that are done and, per source file, the number of
+    batches (e.g. CSV chunks) committed and the SHA-256 of the file they were read from. A batch
+    is committed once all its writes succeeded. The writes are idempotent (raw documents have
+    deterministic ids, see source_id, processed documents are upserted), so a batch that was
+    written but not committed is simply written again. When the content of a source changed
+    since its batches were committed it starts from its first batch.
+
+    Usage:
+        manifest = RunManifest.open(db["pipeline_runs"], "streaming")
+        if not manifest.is_done("ingest"):
+            for batch, chunk in enumerate(chunks):
+                if batch < manifest.committed_batches(file_path, fingerprint):
+                    continue
+                ...
+                manifest.commit_batch(file_path, fingerprint, len(chunk))
+            manifest.mark_done("ingest")
+        ...
+        manifest.complete()
+    """
+
+    def __init__(self, collection: Collection, document: dict, resumed: bool = False):
+        self.collection = collection
+        self.run_id: str = document["_id"]
+        self.mode: str = document["mode"]
+        self.resumed = resumed
+        self.stages: dict = dict(document.get("stages", {}))
+        self.sources: dict = {source["source"]: source for source in document.get("sources", [])}
+        self.changed_products: set = set(document.get("changedProducts", []))
+
+    @classmethod
+    def open(cls, collection: Collection, mode: str, resume: bool = True) -> "RunManifest":
+        """
+        Resumes the latest run of the mode that didn't complete, or starts a new run.
+
+        With resume=False runs that didn't complete are abandoned and a new run is started.
+        """
+        unfinished = collection.find_one({"mode": mode, "status": "running"}, sort=[("startedAt", -1)])
+        if unfinished and resume:
+            manifest = cls(collection, unfinished, resumed=True)
+            committed = sum(source["batches"] for source in manifest.sources.values())
+            print(f"Resuming run {manifest.run_id}: stages done {sorted(manifest.stages) or 'none'}, "
+                  f"{committed} batches of {len(manifest.sources)} sources committed")
+            return manifest
+        if unfinished:
+            collection.update_many({"mode": mode, "status": "running"}, {"$set": {"status": "abandoned"}})
+
+        now = datetime.now(timezone.utc)
+        document = {"_id": f"{now:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}", "mode": mode, "status": "running",
+                    "startedAt": now, "updatedAt": now, "stages": {}, "sources": [], "changedProducts": []}
+        collection.insert_one(document)
+        logging.info(f"Started run {document['_id']} ({mode})")
+        return cls(collection, document)
+
+    def is_done(self, stage: str) -> bool:
+        return stage in self.stages
+
+    def mark_done(self, stage: str) -> None:
+        """Records that every write of a stage succeeded, a resumed run skips it."""
+        now = datetime.now(timezone.utc)
+        self.stages[stage] = {"finishedAt": now}
+        self.collection.update_one({"_id": self.run_id}, {"$set": {f"stages.{stage}": self.stages[stage], "updatedAt": now}})
+
+    def _marker(self, source: str, fingerprint: Optional[str]) -> dict:
+        """The marker of a source, a new one if its content changed since it was recorded."""
+        marker = self.sources.get(source)
+        if marker is None or marker.get("sha256") != fingerprint:
+            return {"source": source, "sha256": fingerprint, "batches": 0, "rows": 0, "done": False}
+        return marker
+
+    def committed_batches(self, source: str, fingerprint: Optional[str] = None) -> int:
+        """The number of batches of a source already committed, 0 if the source's content changed since."""
+        return self._marker(source, fingerprint)["batches"]
+
+    def is_source_done(self, source: str, fingerprint: Optional[str] = None) -> bool:
+        """Whether every batch of a source is committed, see finish_source."""
+        return self._marker(source, fingerprint)["done"]
+
+    def commit_batch(self, source: str, fingerprint: Optional[str] = None, rows: int = 0,
+                     changed_products: Optional[Iterable] = None) -> None:
+        """
+        Records that the next batch of a source is stored, with the products it changed in incremental mode.
+
+        Committing the first batch of a source whose fingerprint differs from the recorded one
+        restarts its count.
+        """
+        marker = self._marker(source, fingerprint)
+        self.sources[source] = {**marker, "batches": marker["batches"] + 1, "rows": marker["rows"] + rows}
+        update = {"$set": {"sources": list(self.sources.values()), "updatedAt": datetime.now(timezone.utc)}}
+        new_products = set(changed_products or ()) - self.changed_products
+        if new_products:
+            self.changed_products |= new_products
+            update["$addToSet"] = {"changedProducts": {"$each": sorted(new_products)}}
+        self.collection.update_one({"_id": self.run_id}, update)
+
+    def finish_source(self, source: str, fingerprint: Optional[str] = None) -> None:
+        """Records that every batch of a source is committed, e.g. so a resumed run doesn't stage it again."""
+        self.sources[source] = {**self._marker(source, fingerprint), "done": True}
+        self.collection.update_one({"_id": self.run_id}, {"$set": {"sources": list(self.sources.values()),
+                                                                   "updatedAt": datetime.now(timezone.utc)}})
+
+    def complete(self) -> None:
+        """Marks the run as completed, the next run of the mode starts from scratch."""
+        now = datetime.now(timezone.utc)
+        self.collection.update_one({"_id": self.run_id}, {"$set": {"status": "completed", "finishedAt": now, "updatedAt": now}})
@@ -0,0 +1,204 @@
+"""
+Command line entry point of the pipeline.
+
+    python src/cli.py run                               # Every stage, like main.py
+    python src/cli.py run --stages enrich,report        # Some stages, see main.PIPELINE_STAGES
+    python src/cli.py ingest --streaming --incremental  # Ingestion, archival and rollups
+    python src/cli.py enrich --backend merge            # The enrichment of the stored data
+    python src/cli.py allocate --products P1 P2         # Only the delivery statuses
+    python src/cli.py report                            # The report of the stored data
+    python src/cli.py raw-orders --start 2023-02-01     # Raw orders of a time range, as JSON lines
+    python src/cli.py health                            # Exits with 1 if MongoDB can't be reached
+    python src/cli.py serve                             # Long-running service, like SERVICE=true
+    python src/cli.py bench -- --rows 10000             # benchmarks/bench_pipeline.py
+
+The paths, the database and the URI can be given as options, the other settings are read from
+the environment like by main.py. Heavy modules (pandas, pymongo and everything of main.py) are
+only imported by the commands that use them: report and health don't import pandas, so they
+start in a fraction of the time of a pipeline run.
+"""
+import argparse
+import logging
+import os
+import subprocess
+import sys
+from datetime import datetime
+from typing import List, Optional
+
+# The same as in main.py, which the report doesn't import
+INVENTORY_COLLECTION: str = "inventory"
+ORDERS_COLLECTION: str = "orders"
+VERSIONS_COLLECTION: str = "data_versions"
+REPORT_CACHE_COLLECTION: str = "report_cache"
+
+# The options of the ingest command, the ones not given default to the environment like in main.py
+INGEST_OPTIONS: tuple = ("streaming", "chunk_size", "incremental", "parallel", "max_workers", "staging", "replay_staged")
+
+BENCHMARK_SCRIPT: str = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "bench_pipeline.py")
+
+def parse_stages(value: str) -> List[str]:
+    """The stages of a comma separated list, e.g. "enrich,report"."""
+    return [stage.strip() for stage in value.split(",") if stage.strip()]
+
+def export_options(args: argparse.Namespace) -> None:
+    """Passes the global options on to main.py, which reads them from the environment when it is imported."""
+    if args.uri:
+        os.environ["MONGO_URI"] = args.uri
+    os.environ["MONGO_DB"] = args.db
+    os.environ["RAW_DIR"] = args.raw_dir
+    os.environ["PROCESSED_DIR"] = args.processed_dir
+
+def mongo_client(args: argparse.Namespace, **overrides):
+    """A client with the settings of MONGO_CONFIG and MONGO_*, and the URI of --uri."""
+    from mongo_config import create_client, load_settings
+
+    settings = load_settings()
+    return create_client(settings._replace(uri=args.uri) if args.uri else settings, **overrides)
+
+def run(args: argparse.Namespace) -> int:
+    import main
+
+    main.main(stages=args.stages)
+    return 0
+
+def ingest(args: argparse.Namespace) -> int:
+    import main
+
+    options = {name: getattr(args, name) for name in INGEST_OPTIONS if hasattr(args, name)}
+    main.main(stages=["ingest", "archive", "rollups"], **options)
+    return 0
+
+def enrich(args: argparse.Namespace) -> int:
+    import main
+
+    main.main(backend=args.backend, stages=["enrich"], product_ids=args.products)
+    return 0
+
+def allocate(args: argparse.Namespace) -> int:
+    import main
+
+    main.main(backend=args.backend, stages=["allocate"], product_ids=args.products)
+    return 0
+
+def report(args: argparse.Namespace) -> int:
+    from reporting import build_report, print_report
+
+    with mongo_client(args) as client:
+        db = client[args.db]
+        # Only a persistent cache helps a single report, one of an earlier run or of the service
+        cache_type = os.environ.get("REPORT_CACHE", "memory").lower()
+        if cache_type in ("mongo", "file"):
+            from report_cache import DataVersions, ReportCache, open_store
+
+            store = open_store(cache_type, db[REPORT_CACHE_COLLECTION], os.path.join(args.processed_dir, REPORT_CACHE_COLLECTION))
+            cache = ReportCache(DataVersions(db[VERSIONS_COLLECTION]), ttl=float(os.environ.get("REPORT_CACHE_TTL", 0)) or None, store=store)
+            result = cache.call(build_report, db[INVENTORY_COLLECTION], db[ORDERS_COLLECTION])
+        else:
+            result = build_report(db[INVENTORY_COLLECTION], db[ORDERS_COLLECTION])
+    print_report(result)
+    return 0
+
+def raw_orders(args: argparse.Namespace) -> int:
+    from bson import json_util
+    import main
+    from partitions import find_partitioned
+
+    # With PARTITION_RAW only the monthly partitions of the range are read
+    field = main.ENCODERS[main.RAW_ORDERS_COLLECTION].field_name("dateTime")
+    with mongo_client(args) as client:
+        for document in find_partitioned(client[args.db], main.RAW_ORDERS_COLLECTION, start=args.start, end=args.end,
+                                         field=field, partitioned=main.PARTITION_RAW):
+            print(json_util.dumps(document))
+    return 0
+
+def health(args: argparse.Namespace) -> int:
+    from pymongo.errors import PyMongoError
+
+    try:
+        with mongo_client(args, serverSelectionTimeoutMS=int(args.timeout * 1000)) as client:
+            client.admin.command("ping")
+    except PyMongoError as e:
+        print(f"MongoDB is not reachable: {e}", file=sys.stderr)
+        return 1
+    print("MongoDB is reachable")
+    return 0
+
+def serve(args: argparse.Namespace) -> int:
+    import signal
+    import threading
+    import main
+
+    # docker stop sends SIGTERM, finish the current batch and stop
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    main.serve(stop=stop)
+    return 0
+
+def bench(args: argparse.Namespace) -> int:
+    # The benchmarks aren't part of the image, see the Dockerfile
+    if not os.path.exists(BENCHMARK_SCRIPT):
+        print(f"{BENCHMARK_SCRIPT} not found, run the benchmarks from a checkout of the repository", file=sys.stderr)
+        return 1
+    bench_args = args.bench_args[1:] if args.bench_args[:1] == ["--"] else args.bench_args
+    return subprocess.call([sys.executable, BENCHMARK_SCRIPT, *bench_args])
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default=os.environ.get("MONGO_URI"), help="MongoDB URI (MONGO_URI)")
+    parser.add_argument("--db", default=os.environ.get("MONGO_DB", "data_pipeline"), help="Database name (MONGO_DB)")
+    parser.add_argument("--raw-dir", default=os.environ.get("RAW_DIR", "/app/data/raw/"), help="Folder of the CSV files (RAW_DIR)")
+    parser.add_argument("--processed-dir", default=os.environ.get("PROCESSED_DIR", "/app/data/processed/"),
+                        help="Folder of the processed files, staged files and archives (PROCESSED_DIR)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("run", help="Run the pipeline")
+    command.add_argument("--stages", type=parse_stages,
+                         help="Comma separated stages to run: ingest, archive, rollups, enrich, allocate, report, explain")
+    command.set_defaults(handler=run)
+
+    command = commands.add_parser("ingest", help="Ingest the CSV files of the raw folder", argument_default=argparse.SUPPRESS)
+    mode = command.add_mutually_exclusive_group()
+    mode.add_argument("--streaming", action="store_true", help="Read the files in chunks")
+    mode.add_argument("--parallel", action="store_true", help="Parse the files in worker processes")
+    mode.add_argument("--replay-staged", action="store_true", help="Ingest the staged Parquet files of an earlier run")
+    command.add_argument("--incremental", action="store_true", help="Skip processed files and unchanged rows")
+    command.add_argument("--staging", action="store_true", help="Also write the parsed rows as Parquet files")
+    command.add_argument("--chunk-size", type=int, help="Rows per chunk in streaming mode")
+    command.add_argument("--max-workers", type=int, help="Worker processes in parallel mode, defaults to the CPUs")
+    command.set_defaults(handler=ingest)
+
+    for name, handler, help_text in (("enrich", enrich, "Enrich inventory and orders and allocate the deliveries"),
+                                     ("allocate", allocate, "Only allocate the deliveries, from the stored inventory balances")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("--backend", choices=["mongo", "merge", "pandas"], default=os.environ.get("BACKEND", "mongo").lower())
+        command.add_argument("--products", nargs="+", metavar="PRODUCT_ID", help="Only these products, defaults to every product")
+        command.set_defaults(handler=handler)
+
+    command = commands.add_parser("report", help="Print the report of the stored data")
+    command.set_defaults(handler=report)
+
+    command = commands.add_parser("raw-orders", help="Print the raw orders of a time range as JSON lines")
+    command.add_argument("--start", type=datetime.fromisoformat, help="First dateTime (UTC), e.g. 2023-02-01")
+    command.add_argument("--end", type=datetime.fromisoformat, help="dateTime (UTC) after the range")
+    command.set_defaults(handler=raw_orders)
+
+    command = commands.add_parser("health", help="Check that MongoDB can be reached")
+    command.add_argument("--timeout", type=float, default=5.0, help="Seconds to wait for the server")
+    command.set_defaults(handler=health)
+
+    command = commands.add_parser("serve", help="Ingest new files as they arrive")
+    command.set_defaults(handler=serve)
+
+    command = commands.add_parser("bench", help="Run benchmarks/bench_pipeline.py, its arguments follow --")
+    command.add_argument("bench_args", nargs=argparse.REMAINDER)
+    command.set_defaults(handler=bench)
+    return parser
+
+def cli(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    export_options(args)
+    return args.handler(args)
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -0,0 +1,68 @@
+import asyncio
+import contextlib
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+try:
+    from .instrumentation import Instrumentation
+except ImportError:
+    from instrumentation import Instrumentation
+
+class Stage(NamedTuple):
+    """A step of the pipeline, run with the results of the stages it depends on as arguments."""
+    name: str
+    run: Callable[..., Awaitable[Any]]
+    depends_on: Tuple[str, ...] = ()
+
+def topological_order(stages: Iterable[Stage]) -> List[Stage]:
+    """The stages ordered so every stage comes after the stages it depends on."""
+    by_name = {stage.name: stage for stage in stages}
+    for stage in by_name.values():
+        unknown = [name for name in stage.depends_on if name not in by_name]
+        if unknown:
+            raise ValueError(f"Stage '{stage.name}' depends on unknown stages: {', '.join(unknown)}")
+
+    ordered, done, visiting = [], set(), set()
+
+    def visit(stage: Stage) -> None:
+        if stage.name in done:
+            return
+        if stage.name in visiting:
+            raise ValueError(f"Stage '{stage.name}' depends on itself through a cycle")
+        visiting.add(stage.name)
+        for name in stage.depends_on:
+            visit(by_name[name])
+        visiting.discard(stage.name)
+        done.add(stage.name)
+        ordered.append(stage)
+
+    for stage in by_name.values():
+        visit(stage)
+    return ordered
+
+async def run_stages(stages: Iterable[Stage], instrumentation: Optional[Instrumentation] = None) -> Dict[str, Any]:
+    """
+    Runs the stages concurrently, each one as soon as the stages it depends on are done.
+
+    Independent stages, e.g. the ingestion of orders and inventory, overlap their round-trips to
+    MongoDB. If a stage fails the stages still running are cancelled and the error is raised.
+    Every stage is measured with instrumentation, if given.
+
+    Returns:
+        dict: The result of every stage by name.
+    """
+    tasks: Dict[str, asyncio.Task] = {}
+
+    async def run(stage: Stage) -> Any:
+        arguments = [await tasks[name] for name in stage.depends_on]
+        with instrumentation.stage(stage.name) if instrumentation else contextlib.nullcontext():
+            return await stage.run(*arguments)
+
+    try:
+        async with asyncio.TaskGroup() as group:
+            # Dependencies first, so every task can await the tasks of its dependencies
+            for stage in topological_order(stages):
+                tasks[stage.name] = group.create_task(run(stage), name=stage.name)
+    except BaseExceptionGroup as errors:
+        # Stages awaiting a failed stage raise its error again, report the first failure
+        raise errors.exceptions[0]
+    return {name: task.result() for name, task in tasks.items()}
@@ -0,0 +1,247 @@
+import logging
+import math
+import os
+from typing import Callable, Iterable, List, Optional
+import numpy as np
+import pandas as pd
+
+try:
+    from .schema import is_uuid_binary, binary_to_uuid
+except ImportError:
+    from schema import is_uuid_binary, binary_to_uuid
+
+def key_strings(values: pd.Series) -> pd.Series:
+    """The keys as they are stored, binary UUIDs (see schema.apply_schema) as their canonical strings."""
+    return binary_to_uuid(values) if is_uuid_binary(values) else values
+
+def hash_keys(values: pd.Series) -> np.ndarray:
+    """
+    64-bit hashes of the keys, vectorized.
+
+    The keys are hashed as strings, so the hash of a key doesn't depend on the dtype it was
+    read with (object, pyarrow strings, binary UUIDs) and is the same from run to run.
+    """
+    return pd.util.hash_array(key_strings(values).astype(str).to_numpy(dtype=object))
+
+def _save_array(path: str, **arrays) -> None:
+    # Replace the file at once so a failed run never leaves half of it
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+class HashedKeySet:
+    """
+    A set of 64-bit key hashes, 8 bytes per key.
+
+    The hashes are kept in a few sorted arrays. New hashes are added as a new array and arrays
+    of similar size are merged, so there are never more than about log2(n) of them and a lookup
+    is a binary search per array. Two keys with the same 64-bit hash are the same key here; with
+    a billion keys the odds of one such collision are about 3%.
+    """
+
+    def __init__(self, runs: Iterable[np.ndarray] = ()):
+        self.runs: List[np.ndarray] = [run for run in runs if len(run)]
+
+    def __len__(self) -> int:
+        return sum(len(run) for run in self.runs)
+
+    def contains(self, hashes: np.ndarray) -> np.ndarray:
+        """Boolean mask of the hashes that are in the set."""
+        found = np.zeros(len(hashes), dtype=bool)
+        for run in self.runs:
+            positions = np.minimum(np.searchsorted(run, hashes), len(run) - 1)
+            found |= run[positions] == hashes
+        return found
+
+    def add(self, hashes: np.ndarray) -> None:
+        new = np.unique(hashes)
+        new = new[~self.contains(new)]
+        if not len(new):
+            return
+        self.runs.append(new)
+        while len(self.runs) > 1 and len(self.runs[-2]) <= 2 * len(self.runs[-1]):
+            last = self.runs.pop()
+            self.runs.append(np.union1d(self.runs.pop(), last))
+
+    def save(self, path: str) -> None:
+        """Stores the set as one sorted array."""
+        merged = np.unique(np.concatenate(self.runs)) if self.runs else np.array([], dtype=np.uint64)
+        _save_array(path, hashes=merged)
+
+    @classmethod
+    def load(cls, path: str) -> "HashedKeySet":
+        with np.load(path) as stored:
+            return cls([stored["hashes"]])
+
+class BloomFilter:
+    """
+    A fixed size probabilistic set of 64-bit key hashes.
+
+    Takes about 1.8 bytes per key at the default error_rate of 0.1% (a key that was never added
+    is reported as present once in a thousand lookups), however many keys there are. Keys are
+    never reported as missing once added. The error rate grows once more than capacity keys are
+    added. Hashes are added and looked up slice_size at a time: besides the filter and a sorted
+    copy of the added hashes, only the bit positions of one slice (about 10 MB) are in memory.
+    """
+
+    slice_size: int = 1 << 17
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = np.zeros((self.num_bits + 7) // 8, dtype=np.uint8)
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _positions(self, hashes: np.ndarray) -> np.ndarray:
+        # Double hashing: the i-th bit of a key is h1 + i * h2, both taken from its 64-bit hash
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        h1 = hashes & np.uint64(0xFFFFFFFF)
+        h2 = (hashes >> np.uint64(32)) | np.uint64(1)
+        steps = np.arange(self.num_hashes, dtype=np.uint64)
+        return (h1[:, None] + steps[None, :] * h2[:, None]) % np.uint64(self.num_bits)
+
+    def _contains_slice(self, hashes: np.ndarray) -> np.ndarray:
+        positions = self._positions(hashes)
+        bits = (self.bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+        return bits.all(axis=1)
+
+    def contains(self, hashes: np.ndarray) -> np.ndarray:
+        """Boolean mask of the hashes that are (probably) in the filter."""
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        found = np.zeros(len(hashes), dtype=bool)
+        for start in range(0, len(hashes), self.slice_size):
+            found[start:start + self.slice_size] = self._contains_slice(hashes[start:start + self.slice_size])
+        return found
+
+    def add(self, hashes: np.ndarray) -> None:
+        unique = np.unique(np.asarray(hashes, dtype=np.uint64))
+        for start in range(0, len(unique), self.slice_size):
+            new = unique[start:start + self.slice_size]
+            new = new[~self._contains_slice(new)]
+            positions = self._positions(new).ravel()
+            np.bitwise_or.at(self.bits, positions >> np.uint64(3), np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+            self.count += len(new)
+        if self.count > self.capacity:
+            logging.warning(f"Bloom filter holds {self.count} keys, more than its capacity of {self.capacity}: "
+                            f"the false positive rate is now above {self.error_rate}")
+
+    def save(self, path: str) -> None:
+        _save_array(path, bits=self.bits, params=np.array([self.capacity, self.count]),
+                    error_rate=np.array([self.error_rate]))
+
+    @classmethod
+    def load(cls, path: str) -> "BloomFilter":
+        with np.load(path) as stored:
+            capacity, count = (int(value) for value in stored["params"])
+            bloom = cls(capacity, float(stored["error_rate"][0]))
+            bloom.bits = stored["bits"]
+            bloom.count = count
+        return bloom
+
+# File suffix of every kind of key store
+KEY_STORES: dict = {"exact": ".keys.npz", "bloom": ".bloom.npz"}
+
+def open_key_store(path: str, kind: str, capacity: int = 10_000_000):
+    """
+    Loads the key store at path (without suffix) or creates an empty one.
+
+    Args:
+        path (str): The store file, KEY_STORES adds the suffix of the kind.
+        kind (str): "exact" (HashedKeySet, 8 bytes per key) or "bloom" (BloomFilter, fixed size).
+        capacity (int): Keys a new Bloom filter is sized for.
+    """
+    if kind not in KEY_STORES:
+        raise ValueError(f"Unknown key store '{kind}', expected one of {', '.join(KEY_STORES)}.")
+    file_path = path + KEY_STORES[kind]
+    store_type = HashedKeySet if kind == "exact" else BloomFilter
+    if os.path.exists(file_path):
+        return store_type.load(file_path)
+    return HashedKeySet() if kind == "exact" else BloomFilter(capacity)
+
+class Deduplicator:
+    """
+    Drops duplicate keys from streamed chunks: keys seen earlier in the run and, with a store,
+    keys ingested by earlier runs.
+
+    Within a run the first row of a key wins, like remove_dublicates over the whole data. The
+    keys seen in the run are kept as 64-bit hashes (see HashedKeySet), not as Python strings.
+    The store (HashedKeySet or BloomFilter, see open_key_store) persists between runs; the keys
+    of a run are only added to it by save, once they are stored. As a Bloom filter can report a
+    key that was never added, its hits can be checked with confirm, which gets the candidate
+    keys and returns the ones that really were ingested (e.g. by looking them up in MongoDB).
+    With drop_stored=False the store is only kept up to date and drop_ingested keeps every row,
+    e.g. in incremental mode, where the rows of ingested keys can be corrections.
+
+    Usage:
+        deduplicator = Deduplicator("orderId", store=open_key_store(path, "exact"), store_path=path)
+        for chunk in chunks:
+            chunk = deduplicator.drop_ingested(chunk)
+            chunk = deduplicator.drop_duplicates(chunk)
+            ...
+        deduplicator.save()
+        print(deduplicator.summary())
+    """
+
+    def __init__(self, key: str, store=None, store_path: Optional[str] = None,
+                 confirm: Optional[Callable[[list], set]] = None, drop_stored: bool = True):
+        self.key = key
+        self.store = store
+        self.drop_stored = drop_stored
+        self.store_path = store_path
+        self.confirm = confirm
+        self.seen = HashedKeySet()
+        self.rows = 0
+        self.run_duplicates = 0
+        self.ingested_duplicates = 0
+
+    def drop_ingested(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Drops the rows whose key was ingested by an earlier run, does nothing without a store or with drop_stored=False."""
+        if self.store is None or not self.drop_stored or df.empty:
+            return df
+        hit = self.store.contains(hash_keys(df[self.key]))
+        if self.confirm is not None and hit.any():
+            keys = key_strings(df[self.key])
+            ingested = self.confirm(keys[hit].unique().tolist())
+            hit &= keys.isin(ingested).to_numpy()
+        self.ingested_duplicates += int(hit.sum())
+        return df[~hit]
+
+    def drop_duplicates(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Keeps the first row of every key not seen before in the run."""
+        self.rows += len(df)
+        hashes = hash_keys(df[self.key])
+        keep = ~pd.Series(hashes).duplicated().to_numpy() & ~self.seen.contains(hashes)
+        self.seen.add(hashes[keep])
+        self.run_duplicates += len(df) - int(keep.sum())
+        return df[keep]
+
+    @property
+    def unique_keys(self) -> int:
+        return len(self.seen)
+
+    @property
+    def hit_rate(self) -> float:
+        """Share of the rows dropped as duplicates, within the run or of earlier runs."""
+        rows = self.rows + self.ingested_duplicates
+        return (self.run_duplicates + self.ingested_duplicates) / rows if rows else 0.0
+
+    def summary(self) -> str:
+        rows = self.rows + self.ingested_duplicates
+        return (f"{self.key}: {self.run_duplicates + self.ingested_duplicates} of {rows} rows were duplicates "
+                f"({self.hit_rate:.1%}), {self.run_duplicates} within the run and "
+                f"{self.ingested_duplicates} ingested by an earlier run")
+
+    def save(self) -> None:
+        """Adds the keys of the run to the store and writes it to store_path."""
+        if self.store is None or self.store_path is None:
+            return
+        for run in self.seen.runs:
+            self.store.add(run)
+        os.makedirs(os.path.dirname(self.store_path) or ".", exist_ok=True)
+        self.store.save(self.store_path + KEY_STORES["exact" if isinstance(self.store, HashedKeySet) else "bloom"])
@@ -0,0 +1,133 @@
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+import pandas as pd
+from bson import Decimal128, Int64
+
+try:
+    from .queries import decimal_to_float
+    from .schema import is_uuid_binary, binary_to_uuid
+except ImportError:
+    from queries import decimal_to_float
+    from schema import is_uuid_binary, binary_to_uuid
+
+class FieldSpec(NamedTuple):
+    """How one column is stored in MongoDB."""
+    column: str
+    bson_type: str  # "string", "int32", "int64", "double", "decimal128" or "datetime"
+    short_name: Optional[str] = None  # Field name in compact documents
+    default: Any = None  # Value left out of compact documents, e.g. the currency every order has
+
+ORDERS_FIELDS: List[FieldSpec] = [
+    FieldSpec("orderId", "string", "o"),
+    FieldSpec("productId", "string", "p"),
+    FieldSpec("currency", "string", "cu", default="SEK"),
+    FieldSpec("quantity", "int32", "q"),
+    FieldSpec("shippingCost", "double", "sc"),
+    FieldSpec("amount", "decimal128", "a"),
+    FieldSpec("channel", "string", "ch"),
+    FieldSpec("channelGroup", "string", "cg"),
+    FieldSpec("campaign", "string", "ca"),
+    FieldSpec("dateTime", "datetime", "t"),
+]
+
+INVENTORY_FIELDS: List[FieldSpec] = [
+    FieldSpec("productId", "string", "p"),
+    FieldSpec("name", "string", "n"),
+    FieldSpec("quantity", "int32", "q"),
+    FieldSpec("category", "string", "c"),
+    FieldSpec("subCategory", "string", "sc"),
+]
+
+def _missing(values: pd.Series) -> pd.Series:
+    """Nulls (None, NaN, NaT, NA) and empty or blank strings."""
+    if isinstance(values.dtype, pd.StringDtype):
+        return values.isna() | values.str.strip().eq("").fillna(False).astype(bool)
+    blank = values.map(lambda value: isinstance(value, str) and not value.strip()) if values.dtype == object else False
+    return values.isna() | blank
+
+def _to_python(values: pd.Series, missing: pd.Series) -> List[Any]:
+    return values.astype(object).where(~missing, None).tolist()
+
+def convert_column(values: pd.Series, bson_type: Optional[str]) -> List[Any]:
+    """
+    Converts a column to values pymongo encodes natively, None for missing values.
+
+    The column is converted as a whole, so no numpy scalar, NaN or ISO string reaches the
+    BSON encoder. Columns without a bson_type are only converted to Python objects. Binary
+    UUIDs (see schema.apply_schema) are stored as their canonical strings.
+    """
+    if is_uuid_binary(values):
+        values = binary_to_uuid(values)
+    missing = _missing(values)
+    if bson_type == "datetime":
+        if not pd.api.types.is_datetime64_any_dtype(values):
+            values = pd.to_datetime(values.where(~missing), format="ISO8601", utc=True)
+        if values.dt.tz is not None:
+            values = values.dt.tz_convert("UTC").dt.tz_localize(None)
+        # datetime64[ms] converts to datetime.datetime objects (and NaT to None), BSON datetimes are in ms
+        return values.to_numpy(dtype="datetime64[ms]").astype(object).tolist()
+    if bson_type in ("int32", "int64"):
+        ints = _to_python(pd.to_numeric(values.where(~missing)).astype("Int64"), missing)
+        return [None if value is None else Int64(value) for value in ints] if bson_type == "int64" else ints
+    if bson_type == "double":
+        return _to_python(pd.to_numeric(values.where(~missing)).astype("float64"), missing)
+    if bson_type == "decimal128":
+        # The shortest repr of the float, i.e. the value as written in the source file
+        floats = _to_python(pd.to_numeric(values.where(~missing)).astype("float64"), missing)
+        return [None if value is None else Decimal128(repr(value)) for value in floats]
+    if bson_type == "string":
+        return _to_python(values.astype(object).where(~missing).map(str, na_action="ignore"), missing)
+    return _to_python(values, missing)
+
+class DocumentEncoder:
+    """
+    Converts DataFrames to MongoDB documents with native BSON types, driven by a list of FieldSpecs.
+
+    Every column is converted once and vectorized (see convert_column): ISO strings become
+    datetimes, quantities int32, amounts Decimal128. Missing values and empty strings are left
+    out of the documents. With short_names the fields get their short names, and with
+    omit_defaults fields holding their default value are left out as well; decode restores
+    both. Columns without a FieldSpec are stored as they are, under their own name.
+
+    Usage:
+        encoder = DocumentEncoder(ORDERS_FIELDS, short_names=True, omit_defaults=True)
+        collection.insert_many(encoder.encode(df))
+    """
+
+    def __init__(self, fields: Iterable[FieldSpec], short_names: bool = False, omit_defaults: bool = False):
+        self.fields: Dict[str, FieldSpec] = {field.column: field for field in fields}
+        self.short_names = short_names
+        self.omit_defaults = omit_defaults
+
+    def field_name(self, column: str) -> str:
+        """The name a column is stored under."""
+        field = self.fields.get(column)
+        return field.short_name if self.short_names and field and field.short_name else column
+
+    def encode(self, df: pd.DataFrame) -> List[Dict[str, Any]]:
+        """Converts the rows of df to documents."""
+        names, columns = [], []
+        for column in df.columns:
+            field = self.fields.get(column)
+            values = df[column]
+            if self.omit_defaults and field and field.default is not None:
+                values = values.where(values != field.default)
+            names.append(self.field_name(column))
+            columns.append(convert_column(values, field.bson_type if field else None))
+        return [
+            {name: value for name, value in zip(names, row) if value is not None}
+            for row in zip(*columns)
+        ]
+
+    def decode(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        """Restores the column names and left out default values of a document."""
+        columns = {self.field_name(column): column for column in self.fields}
+        decoded = {columns.get(name, name): value for name, value in document.items()}
+        if self.omit_defaults:
+            for column, field in self.fields.items():
+                if field.default is not None:
+                    decoded.setdefault(column, field.default)
+        return decoded
+
+# The processed collections, with native types but the column names the pipeline queries by
+ORDERS_ENCODER = DocumentEncoder(ORDERS_FIELDS)
+INVENTORY_ENCODER = DocumentEncoder(INVENTORY_FIELDS)
@@ -0,0 +1,85 @@
+import hashlib
+import os
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+import pandas as pd
+from pymongo.collection import Collection
+
+try:
+    from .dedup import key_strings
+    from .schema import is_uuid_binary
+except ImportError:
+    from dedup import key_strings
+    from schema import is_uuid_binary
+
+# Field holding the content hash of the source row in the processed collections
+ROW_HASH_FIELD: str = "rowHash"
+
+def file_fingerprint(file_path: str, block_size: int = 1 << 20) -> str:
+    """Returns the SHA-256 hex digest of a file's content, read in blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def is_file_processed(state: Collection, file_path: str, fingerprint: str) -> bool:
+    """Checks whether a file with the same name and content has already been processed."""
+    return state.count_documents({"_id": os.path.basename(file_path), "sha256": fingerprint}, limit=1) > 0
+
+def mark_file_processed(state: Collection, file_path: str, fingerprint: str, rows: int) -> None:
+    """Stores the fingerprint of a processed file, replacing the one of the previous drop with the same name."""
+    state.update_one(
+        {"_id": os.path.basename(file_path)},
+        {"$set": {"sha256": fingerprint, "rows": rows, "processedAt": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+
+def add_row_hashes(df: pd.DataFrame) -> pd.DataFrame:
+    """Returns a copy of the DataFrame with a vectorized 64-bit content hash of every row in ROW_HASH_FIELD."""
+    # Binary UUIDs are hashed as the strings they are stored as, the hash doesn't depend on the dtypes
+    columns = df.drop(columns=[ROW_HASH_FIELD], errors="ignore")
+    uuids = {name: key_strings(values) for name, values in columns.items() if is_uuid_binary(values)}
+    hashes = pd.util.hash_pandas_object(columns.assign(**uuids) if uuids else columns, index=False)
+    # BSON has no unsigned 64-bit integer, store the same bits as a signed one
+    return df.assign(**{ROW_HASH_FIELD: hashes.to_numpy().view("int64")})
+
+def filter_changed_rows(collection: Collection, df: pd.DataFrame, match_field: str,
+                        related_field: Optional[str] = None, batch_size: int = 1000) -> Tuple[pd.DataFrame, set]:
+    """
+    Keeps only the rows that are new or differ from the stored document with the same key.
+
+    The stored row hashes are looked up only for the keys in the DataFrame, so the cost is
+    proportional to the DataFrame and not to the size of the collection.
+
+    Args:
+        collection (Collection): The processed collection the rows are upserted into.
+        df (pd.DataFrame): Rows with a ROW_HASH_FIELD column, see add_row_hashes.
+        match_field (str): The key the rows are upserted on.
+        related_field (str): Optional field whose stored values of the changed rows are returned,
+            e.g. the previous productId of a changed order.
+        batch_size (int): Max number of keys per lookup query.
+
+    Returns:
+        Tuple[pd.DataFrame, set]: The new or changed rows and the stored values of related_field.
+    """
+    projection = {"_id": 0, match_field: 1, ROW_HASH_FIELD: 1}
+    if related_field:
+        projection[related_field] = 1
+
+    stored_hashes = {}
+    previous_values = {}
+    df_keys = key_strings(df[match_field])
+    keys = df_keys.drop_duplicates().tolist()
+    for i in range(0, len(keys), batch_size):
+        for doc in collection.find({match_field: {"$in": keys[i:i + batch_size]}}, projection):
+            stored_hashes[doc[match_field]] = doc.get(ROW_HASH_FIELD)
+            if related_field:
+                previous_values[doc[match_field]] = doc.get(related_field)
+
+    # Nullable integers keep the full 64 bits, keys without a stored hash compare as changed
+    stored = df_keys.map(pd.Series(stored_hashes, dtype="Int64"))
+    changed_mask = stored.ne(df[ROW_HASH_FIELD]).fillna(True).to_numpy(dtype=bool)
+    changed = df[changed_mask]
+    related = {previous_values[key] for key in df_keys[changed_mask] if key in previous_values}
+    return changed, related
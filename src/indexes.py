@@ -0,0 +1,163 @@
+import logging
+from typing import Any, Dict, List, NamedTuple, Optional
+from pymongo import ASCENDING, IndexModel
+from pymongo.database import Database
+from pymongo.errors import OperationFailure
+
+try:
+    from .queries import (SHORT_INVENTORY_QUERY, in_products, order_aggregates_pipeline, quantity_per_product_pipeline,
+                          merge_quantity_pipeline, delivered_orders_query, merge_delivery_status_pipeline)
+    from .reporting import BEST_SELLING_PIPELINE, NEGATIVE_BALANCE_PIPELINE, DELIVERY_SUMMARY_PIPELINE
+except ImportError:
+    from queries import (SHORT_INVENTORY_QUERY, in_products, order_aggregates_pipeline, quantity_per_product_pipeline,
+                         merge_quantity_pipeline, delivered_orders_query, merge_delivery_status_pipeline)
+    from reporting import BEST_SELLING_PIPELINE, NEGATIVE_BALANCE_PIPELINE, DELIVERY_SUMMARY_PIPELINE
+
+# Indexes every pipeline query relies on, by collection name. Default index names, so creating
+# the same index elsewhere is a no-op. The enrichment doesn't create any, $merge relies on these
+PIPELINE_INDEXES: Dict[str, List[IndexModel]] = {
+    "orders": [
+        IndexModel([("orderId", ASCENDING)], unique=True),  # Upserts
+        IndexModel([("productId", ASCENDING), ("dateTime", ASCENDING)]),  # $lookup, enrichment, FIFO allocation
+        IndexModel([("deliveryStatus", ASCENDING)]),  # Delivery summaries
+    ],
+    "inventory": [
+        IndexModel([("productId", ASCENDING)], unique=True),  # Upserts, $merge
+        IndexModel([("InventoryBalanceAfterOrder", ASCENDING)]),  # Negative balances
+        IndexModel([("ordersDetailsCount", ASCENDING)]),  # Ordered products
+    ],
+    # Sales rollups (see rollups.ROLLUPS): $inc upserts and day range queries
+    "sales_by_product_day": [
+        IndexModel([("day", ASCENDING), ("productId", ASCENDING)], unique=True),
+        IndexModel([("productId", ASCENDING), ("day", ASCENDING)]),  # Sales of a product over time
+    ],
+    "sales_by_channel_day": [IndexModel([("day", ASCENDING), ("channel", ASCENDING), ("channelGroup", ASCENDING)], unique=True)],
+    "sales_by_campaign_day": [IndexModel([("day", ASCENDING), ("campaign", ASCENDING)], unique=True)],
+    "sales_by_category_day": [IndexModel([("day", ASCENDING), ("category", ASCENDING)], unique=True)],
+}
+
+def ensure_indexes(db: Database, indexes: Dict[str, List[IndexModel]] = PIPELINE_INDEXES) -> Dict[str, List[str]]:
+    """
+    Creates the indexes of the pipeline collections, existing indexes are left as they are.
+
+    A collection whose indexes can't be built (e.g. a unique index over data that already has
+    duplicates) is logged and skipped, so the pipeline still runs, only slower.
+
+    Returns:
+        Dict[str, List[str]]: The names of the indexes per collection.
+    """
+    created = {}
+    for collection_name, models in indexes.items():
+        try:
+            created[collection_name] = db[collection_name].create_indexes(models)
+        except OperationFailure as e:
+            logging.error(f"Failed to create indexes on {collection_name}: {e}")
+    return created
+
+class QueryPlan(NamedTuple):
+    """The winning plan stages of one pipeline query."""
+    name: str
+    collection: str
+    stages: List[str]
+    reads_everything: bool = False  # A full run reads or writes every document, a COLLSCAN is expected
+
+    @property
+    def uses_collscan(self) -> bool:
+        return "COLLSCAN" in self.stages
+
+def _find(collection: str, query: dict, sort: Optional[dict] = None) -> dict:
+    return {"find": collection, "filter": query, **({"sort": sort} if sort else {})}
+
+def _update(collection: str, query: dict, multi: bool = True, upsert: bool = False) -> dict:
+    return {"update": collection, "updates": [{"q": query, "u": {"$set": {"explained": True}}, "multi": multi, "upsert": upsert}]}
+
+def _aggregate(collection: str, pipeline: list) -> dict:
+    return {"aggregate": collection, "pipeline": pipeline, "cursor": {}}
+
+def _pipeline_queries() -> List[Dict[str, Any]]:
+    """
+    The commands the pipeline runs, with representative values.
+
+    The filters and pipelines are the ones of queries.py and reporting.py, so a change there is
+    explained as it runs. Scoped variants are the ones of incremental runs and the service.
+    """
+    product_id = "prod1520#prod100011001100"
+    order_id = "efb921c1-6733-3811-b4c2-aa0d80800638"
+    products = [product_id]
+    return [
+        {"name": "upsert orders by orderId", "collection": "orders",
+         "command": _update("orders", {"orderId": order_id}, multi=False, upsert=True)},
+        {"name": "upsert inventory by productId", "collection": "inventory",
+         "command": _update("inventory", {"productId": product_id}, multi=False, upsert=True)},
+        {"name": "stored versions of upserted orders", "collection": "orders",
+         "command": _find("orders", {"orderId": {"$in": [order_id]}})},
+        {"name": "$lookup orders by productId", "collection": "orders",
+         "command": _find("orders", {"productId": product_id})},
+        {"name": "order aggregates of changed products", "collection": "orders",
+         "command": _aggregate("orders", order_aggregates_pipeline(products))},
+        {"name": "order aggregates of every product", "collection": "orders", "reads_everything": True,
+         "command": _aggregate("orders", order_aggregates_pipeline())},
+        {"name": "products without orders", "collection": "orders",
+         "command": {"distinct": "orders", "key": "productId", "query": in_products({}, products)}},
+        {"name": "quantity per ordered product", "collection": "inventory",
+         "command": _aggregate("inventory", quantity_per_product_pipeline())},
+        {"name": "$merge quantity per ordered product", "collection": "inventory",
+         "command": _aggregate("inventory", merge_quantity_pipeline("inventory"))},
+        {"name": "inventory with negative balance", "collection": "inventory",
+         "command": _find("inventory", SHORT_INVENTORY_QUERY)},
+        {"name": "orders of short products by dateTime", "collection": "orders",
+         "command": _find("orders", {"productId": {"$in": products}}, {"productId": ASCENDING, "dateTime": ASCENDING, "_id": ASCENDING})},
+        {"name": "delivered orders of changed products", "collection": "orders",
+         "command": _update("orders", delivered_orders_query([], products))},
+        {"name": "delivered orders of every product", "collection": "orders", "reads_everything": True,
+         "command": _update("orders", delivered_orders_query(products))},
+        {"name": "$merge delivery status of changed products", "collection": "orders",
+         "command": _aggregate("orders", merge_delivery_status_pipeline("orders", "inventory", products))},
+        {"name": "best selling product", "collection": "inventory",
+         "command": _aggregate("inventory", BEST_SELLING_PIPELINE)},
+        {"name": "products to fill up", "collection": "inventory",
+         "command": _aggregate("inventory", NEGATIVE_BALANCE_PIPELINE)},
+        {"name": "delivery summaries", "collection": "orders",
+         "command": _aggregate("orders", DELIVERY_SUMMARY_PIPELINE)},
+    ]
+
+def _plan_stages(explain: Any) -> List[str]:
+    """Collects the stage names of the winning plan in an explain output, skipping rejected plans."""
+    stages = []
+    if isinstance(explain, dict):
+        for key, value in explain.items():
+            if key == "rejectedPlans":
+                continue
+            if key == "stage" and isinstance(value, str):
+                stages.append(value)
+            else:
+                stages.extend(_plan_stages(value))
+    elif isinstance(explain, list):
+        for item in explain:
+            stages.extend(_plan_stages(item))
+    return stages
+
+def explain_pipeline_queries(db: Database) -> List[QueryPlan]:
+    """
+    Explains every command of the pipeline and returns the stages of their winning plans.
+
+    Use it after ensure_indexes to find queries that still do a collection scan, see report_collscans.
+    """
+    plans = []
+    for query in _pipeline_queries():
+        explain = db.command("explain", query["command"], verbosity="queryPlanner")
+        plans.append(QueryPlan(query["name"], query["collection"], _plan_stages(explain), query.get("reads_everything", False)))
+    return plans
+
+def report_collscans(db: Database) -> List[QueryPlan]:
+    """Prints and returns the pipeline queries whose winning plan uses a COLLSCAN stage, but shouldn't."""
+    plans = explain_pipeline_queries(db)
+    collscans = [plan for plan in plans if plan.uses_collscan and not plan.reads_everything]
+    if not collscans:
+        print("All pipeline queries use an index, apart from the ones of full runs that read every document.")
+    for plan in collscans:
+        print(f"COLLSCAN in '{plan.name}' on {plan.collection}: {' -> '.join(plan.stages)}")
+    for plan in plans:
+        if plan.reads_everything:
+            print(f"'{plan.name}' on {plan.collection} reads every document: {' -> '.join(plan.stages)}")
+    return collscans
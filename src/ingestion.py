@@ -1,24 +1,159 @@
+import glob
 import os
 import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, NamedTuple, Optional
 import pandas as pd
 
-def load_csv(file_path: str, processed_folder: str) -> pd.DataFrame:
-    """Loads a CSV file into a pandas DataFrame and moves the file to the processed folder."""
+try:
+    from .validation import validate_rows, ColumnRule
+    from .schema import ColumnType, ORDERS_SCHEMA, INVENTORY_SCHEMA, csv_dtypes, date_columns, apply_schema
+    from .incremental import file_fingerprint
+except ImportError:
+    from validation import validate_rows, ColumnRule
+    from schema import ColumnType, ORDERS_SCHEMA, INVENTORY_SCHEMA, csv_dtypes, date_columns, apply_schema
+    from incremental import file_fingerprint
+
+# Explicit column types for the readers from the schema registry, so every chunk and file gets the same dtypes
+ORDERS_DTYPES: dict = csv_dtypes(ORDERS_SCHEMA)
+ORDERS_DATE_COLUMNS: list = date_columns(ORDERS_SCHEMA)
+INVENTORY_DTYPES: dict = csv_dtypes(INVENTORY_SCHEMA)
+
+def load_csv(file_path: str, processed_folder: Optional[str], dtype: dict = None, parse_dates: list = None) -> pd.DataFrame:
+    """
+    Loads a CSV file into a pandas DataFrame, typed with dtype and parse_dates if given, and moves the file to the processed folder.
+
+    Without a processed folder the file is left in place, call move_to_processed once everything read from it has been stored.
+    """
     try:
         # Load the CSV into a DataFrame
-        df = pd.read_csv(file_path)
-        
-        # Ensure the processed folder exists, create if it doesn't
-        if not os.path.exists(processed_folder):
-            os.makedirs(processed_folder)
-        
-        # Move the file to the processed folder
-        file_name = os.path.basename(file_path)
-        new_path = os.path.join(processed_folder, file_name)
-        shutil.move(file_path, new_path)
-        
-        print(f"File {file_name} moved to {processed_folder}")
+        df = pd.read_csv(file_path, dtype=dtype, parse_dates=parse_dates, date_format="ISO8601")
+
+        if processed_folder:
+            move_to_processed(file_path, processed_folder)
         return df
     except Exception as e:
         raise ValueError(f"Failed to load and process data from {file_path}: {e}")
 
+def iter_csv_chunks(file_path: str, chunk_size: int, dtype: dict = None, parse_dates: list = None) -> Iterator[pd.DataFrame]:
+    """
+    Reads a CSV file as a stream of typed DataFrame chunks.
+
+    Only one chunk is held in memory at a time, so memory use doesn't depend on the file size.
+    Date columns are parsed as UTC datetimes. The file is left in place, call move_to_processed
+    once everything read from it has been stored.
+
+    Args:
+        file_path (str): The CSV file to read.
+        chunk_size (int): Number of rows per chunk.
+        dtype (dict): Column types, e.g. ORDERS_DTYPES.
+        parse_dates (list): Columns to parse as ISO 8601 datetimes.
+
+    Yields:
+        pd.DataFrame: The next chunk of rows.
+    """
+    if not isinstance(chunk_size, int) or chunk_size <= 0:
+        raise ValueError("chunk_size must be a positive integer.")
+
+    try:
+        reader = pd.read_csv(file_path, chunksize=chunk_size, dtype=dtype, parse_dates=parse_dates, date_format="ISO8601")
+        with reader:
+            for chunk in reader:
+                yield chunk
+    except Exception as e:
+        raise ValueError(f"Failed to load data from {file_path}: {e}")
+
+def move_to_processed(file_path: str, processed_folder: str) -> str:
+    """Moves a loaded file to the processed folder and returns its new path."""
+    # Ensure the processed folder exists, create if it doesn't
+    if not os.path.exists(processed_folder):
+        os.makedirs(processed_folder)
+
+    # Move the file to the processed folder
+    file_name = os.path.basename(file_path)
+    new_path = os.path.join(processed_folder, file_name)
+    shutil.move(file_path, new_path)
+
+    print(f"File {file_name} moved to {processed_folder}")
+    return new_path
+
+def discover_files(raw_dir: str, pattern: str) -> List[str]:
+    """Returns the files in raw_dir matching a glob pattern such as 'orders*.csv', sorted by name."""
+    return sorted(path for path in glob.glob(os.path.join(raw_dir, pattern)) if os.path.isfile(path))
+
+class ParsedFile(NamedTuple):
+    """The outcome of parsing one file in a worker process."""
+    file_path: str
+    df: Optional[pd.DataFrame]  # The valid rows
+    error: Optional[str] = None  # The file couldn't be read or lacks required columns, df is None
+    rejected: Optional[pd.DataFrame] = None  # Rows that failed validation, with their validationErrors
+    fingerprint: Optional[str] = None  # SHA-256 of the file's content, see incremental.file_fingerprint
+
+def parse_file(file_path: str, dtype: dict = None, parse_dates: list = None, rules: List[ColumnRule] = None,
+               schema: List[ColumnType] = None, uuid_binary: bool = False) -> ParsedFile:
+    """
+    Reads and validates one CSV file without raising, so a bad file only fails itself.
+
+    Runs in a worker process, the file is neither moved nor written anywhere. The valid rows
+    get the types of schema, if given, which also makes them cheaper to send back. The file is
+    also fingerprinted, for the ids of its raw documents.
+    """
+    try:
+        fingerprint = file_fingerprint(file_path)
+        df = pd.read_csv(file_path, dtype=dtype, parse_dates=parse_dates, date_format="ISO8601")
+        if not rules:
+            return ParsedFile(file_path, apply_schema(df, schema, uuid_binary) if schema else df, fingerprint=fingerprint)
+        result = validate_rows(df, rules, parse_datetimes=bool(parse_dates))
+        valid = apply_schema(result.valid, schema, uuid_binary) if schema else result.valid
+    except Exception as e:
+        return ParsedFile(file_path, None, error=f"Failed to load data from {file_path}: {e}")
+    return ParsedFile(file_path, valid, rejected=result.rejected_with_reasons(), fingerprint=fingerprint)
+
+def parse_files_parallel(file_paths: List[str], dtype: dict = None, parse_dates: list = None,
+                         rules: List[ColumnRule] = None, max_workers: int = None,
+                         max_pending: int = None, schema: List[ColumnType] = None,
+                         uuid_binary: bool = False) -> Iterator[ParsedFile]:
+    """
+    Parses and validates files in parallel worker processes.
+
+    Results are yielded in the order of file_paths, so the consumer (the single writer that owns
+    the MongoDB connection) sees the files in a deterministic order. At most max_pending files are
+    parsed or waiting to be consumed at any time, which bounds the memory held by parsed DataFrames.
+
+    Args:
+        file_paths (List[str]): The files to parse.
+        dtype (dict): Column types, e.g. ORDERS_DTYPES.
+        parse_dates (list): Columns to parse as ISO 8601 datetimes.
+        rules (List[ColumnRule]): Rules passed to validate_rows.
+        max_workers (int): Number of worker processes, defaults to the number of CPUs.
+        max_pending (int): Max number of files in flight, defaults to twice max_workers.
+        schema (List[ColumnType]): Types of the valid rows, e.g. ORDERS_SCHEMA, see schema.apply_schema.
+        uuid_binary (bool): Hold UUID columns as 16-byte binary values.
+
+    Yields:
+        ParsedFile: The outcome of each file.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * max_workers
+    remaining = iter(file_paths)
+    pending = deque()
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        def submit_next() -> bool:
+            file_path = next(remaining, None)
+            if file_path is None:
+                return False
+            pending.append((file_path, executor.submit(parse_file, file_path, dtype, parse_dates, rules, schema, uuid_binary)))
+            return True
+
+        while len(pending) < max_pending and submit_next():
+            pass
+        while pending:
+            file_path, future = pending.popleft()
+            submit_next()
+            try:
+                yield future.result()
+            except Exception as e:
+                # The worker itself died, e.g. out of memory
+                yield ParsedFile(file_path, None, error=f"Failed to load data from {file_path}: {e}")
@@ -0,0 +1,214 @@
+import contextvars
+import cProfile
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+from pymongo import monitoring
+
+logger = logging.getLogger("pipeline.metrics")
+
+class RoundTripCounter(monitoring.CommandListener):
+    """
+    Counts the commands sent to MongoDB by the clients it is registered on, i.e. the round-trips.
+
+    A command is also counted for the stage running in the context it was sent from (see
+    _current_stage), so stages running at the same time don't count each other's commands.
+    Threads only see the stage if they run in a copy of its context, see BulkWriter.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = 0
+
+    def started(self, event) -> None:
+        counters = _current_stage.get()
+        with self._lock:
+            self.total += 1
+            if counters is not None:
+                counters.round_trips += 1
+
+    def succeeded(self, event) -> None:
+        pass
+
+    def failed(self, event) -> None:
+        pass
+
+# Pass to MongoClient(event_listeners=[ROUND_TRIPS]) to count the round-trips of every stage
+ROUND_TRIPS = RoundTripCounter()
+
+class PeakRSS:
+    """Samples the resident set size in a background thread and keeps the peak."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def current() -> int:
+        """The current resident set size in bytes."""
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError:
+            # Not Linux: the high-water mark of the whole process, in KiB (bytes on macOS)
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.current())
+
+    def __enter__(self) -> "PeakRSS":
+        self.peak = self.current()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+class StageMetrics(NamedTuple):
+    """What one pipeline stage did and what it cost."""
+    stage: str
+    wall_seconds: float
+    cpu_seconds: float
+    rows_in: int
+    rows_out: int
+    bytes_read: int
+    round_trips: int
+    peak_rss_bytes: int
+
+class StageCounters:
+    """The row, byte and round-trip counts of the running stage, see count() and RoundTripCounter."""
+
+    def __init__(self):
+        self.rows_in = 0
+        self.rows_out = 0
+        self.bytes_read = 0
+        self.round_trips = 0
+
+_current_stage: contextvars.ContextVar = contextvars.ContextVar("current_stage", default=None)
+
+def count(rows_in: int = 0, rows_out: int = 0, bytes_read: int = 0) -> None:
+    """Adds to the counts of the running stage, does nothing outside of a stage."""
+    counters = _current_stage.get()
+    if counters is not None:
+        counters.rows_in += int(rows_in)
+        counters.rows_out += int(rows_out)
+        counters.bytes_read += int(bytes_read)
+
+class Instrumentation:
+    """
+    Measures the pipeline stages and reports them as JSON log lines and an OpenMetrics dump.
+
+    Every stage gets wall time, CPU time, rows in/out and bytes read (see count), MongoDB
+    round-trips (for clients registered with ROUND_TRIPS) and the peak RSS. Rows, bytes and
+    round-trips are counted per stage, also for stages running concurrently (see dag.run_stages).
+    CPU time and peak RSS are of the whole process, so concurrent stages include each other's
+    in them. Stages can also be profiled with cProfile (a .prof file per stage in profile_dir)
+    or tracemalloc (the top allocations are logged).
+
+    Usage:
+        instrumentation = Instrumentation(profile_stages={"enrich"}, profile_dir="/tmp/profiles")
+        with instrumentation.stage("enrich"):
+            count(rows_in=len(df))
+            ...
+        instrumentation.write_openmetrics("/tmp/pipeline.prom")
+    """
+
+    def __init__(self, profile_stages: Iterable[str] = (), trace_memory_stages: Iterable[str] = (),
+                 profile_dir: Optional[str] = None):
+        self.profile_stages = set(profile_stages)
+        self.trace_memory_stages = set(trace_memory_stages)
+        self.profile_dir = profile_dir or os.getcwd()
+        self.metrics: List[StageMetrics] = []
+
+    def _enabled(self, stages: set, name: str) -> bool:
+        return name in stages or "all" in stages
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageCounters]:
+        """Measures the code run in the with block as the stage `name`."""
+        counters = StageCounters()
+        token = _current_stage.set(counters)
+        profiler = cProfile.Profile() if self._enabled(self.profile_stages, name) else None
+        trace_memory = self._enabled(self.trace_memory_stages, name) and not tracemalloc.is_tracing()
+        if trace_memory:
+            tracemalloc.start()
+
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            with PeakRSS() as rss:
+                if profiler:
+                    profiler.enable()
+                try:
+                    yield counters
+                finally:
+                    if profiler:
+                        profiler.disable()
+        finally:
+            _current_stage.reset(token)
+            metrics = StageMetrics(
+                stage=name,
+                wall_seconds=time.perf_counter() - wall,
+                cpu_seconds=time.process_time() - cpu,
+                rows_in=counters.rows_in,
+                rows_out=counters.rows_out,
+                bytes_read=counters.bytes_read,
+                round_trips=counters.round_trips,
+                peak_rss_bytes=rss.peak,
+            )
+            self.metrics.append(metrics)
+            logger.info(json.dumps({"event": "stage", **metrics._asdict()}))
+
+            if profiler:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                path = os.path.join(self.profile_dir, f"{name}.prof")
+                profiler.dump_stats(path)
+                logger.info(f"{name}: cProfile stats written to {path}")
+            if trace_memory:
+                snapshot = tracemalloc.take_snapshot()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                logger.info(f"{name}: peak traced memory {peak / 2**20:.1f} MB, top allocations:")
+                for line in snapshot.statistics("lineno")[:10]:
+                    logger.info(f"{name}:   {line}")
+
+    def openmetrics(self, extra: Iterable[str] = ()) -> str:
+        """The metrics of every stage in the OpenMetrics / Prometheus text format, followed by the extra lines (e.g. ReportCache.openmetrics)."""
+        series = [
+            ("wall_seconds", "Wall time of the stage in seconds."),
+            ("cpu_seconds", "CPU time of the stage in seconds."),
+            ("rows_in", "Rows read by the stage."),
+            ("rows_out", "Rows written or produced by the stage."),
+            ("bytes_read", "Bytes read from source files by the stage."),
+            ("round_trips", "Commands sent to MongoDB by the stage."),
+            ("peak_rss_bytes", "Peak resident set size during the stage."),
+        ]
+        lines = []
+        for field, help_text in series:
+            lines.append(f"# HELP pipeline_stage_{field} {help_text}")
+            lines.append(f"# TYPE pipeline_stage_{field} gauge")
+            for metrics in self.metrics:
+                lines.append(f'pipeline_stage_{field}{{stage="{metrics.stage}"}} {getattr(metrics, field)}')
+        lines.extend(extra)
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write_openmetrics(self, path: str, extra: Iterable[str] = ()) -> None:
+        """Writes the metrics to a file, e.g. for the node_exporter textfile collector."""
+        # Replace the file at once so a scrape never reads half of it
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.openmetrics(extra))
+        os.replace(tmp_path, path)
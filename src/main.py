@@ -1,124 +1,827 @@
+import contextlib
+import logging
 import os
-from ingestion import load_csv
-from validation import validate_data, remove_dublicates
+import signal
+import threading
+from typing import Iterable
+from ingestion import (
+    load_csv,
+    iter_csv_chunks,
+    move_to_processed,
+    discover_files,
+    parse_files_parallel,
+    ORDERS_DTYPES,
+    ORDERS_DATE_COLUMNS,
+    INVENTORY_DTYPES,
+)
+from validation import validate_rows, remove_dublicates, ORDERS_RULES, INVENTORY_RULES
+from reporting import print_report
+from service import FileWatcher, ChangeListener, run_service
+from backends import MongoBackend, MergeBackend, PandasBackend
+from indexes import ensure_indexes, report_collscans
+from instrumentation import Instrumentation, count, ROUND_TRIPS
+from dedup import Deduplicator, open_key_store
+from schema import SCHEMAS, apply_schema
+from encoding import DocumentEncoder, ORDERS_FIELDS, INVENTORY_FIELDS, ORDERS_ENCODER, INVENTORY_ENCODER
+from staging import StagedFileWriter, staged_path, list_staged_files, iter_staged_batches, STAGING_SCHEMAS
+from mongo_config import MongoSettings, load_settings
+from checkpoint import RunManifest, source_id
+from report_cache import DataVersions, ReportCache, open_store
+from partitions import PARTITIONED_COLLECTIONS, partition_name, split_by_month, source_month, archive_partitions
+from rollups import previous_orders, sales_deltas, apply_sales_deltas, refresh_rollups
+from incremental import file_fingerprint, is_file_processed, mark_file_processed, add_row_hashes, filter_changed_rows, ROW_HASH_FIELD
 from mongodb_utils import (
     get_mongo_client,
     upsert_dataframe_to_mongo, 
-    total_quantity_per_product,
-    combine_orders_to_inventory_with_count,
-    update_quantity_per_product,
-    get_inventory_with_negative_balance,
-    update_order_with_delivery_status,
-    get_inventory_with_highest_order,
-    summarize_cannot_deliver_orders,
-    summarize_delivered_orders,
     store_raw_data_to_mongo
 
 )
-RAW_DIR: str = "/app/data/raw/"
-PROCESSED_DIR: str = "/app/data/processed/"
-DB_NAME: str = "data_pipeline"
+# Paths and database name, set by the options of cli.py for runs outside the container
+RAW_DIR: str = os.environ.get("RAW_DIR", "/app/data/raw/")
+PROCESSED_DIR: str = os.environ.get("PROCESSED_DIR", "/app/data/processed/")
+DB_NAME: str = os.environ.get("MONGO_DB", "data_pipeline")
 RAW_ORDERS_COLLECTION: str = "raw_orders"
 RAW_INVENTORY_COLLECTION: str = "raw_inventory"
 ORDERS_COLLECTION: str = "orders"
 INVENTORY_COLLECTION: str = "inventory"
 COMBINED_COLLECTION: str = "combined_data"
-CRITICAL_COLUMNS_ORDER: list = ['orderId','productId', 'dateTime', 'quantity']
-CRITICAL_COLUMNS_INVENTORY: list = ['productId', 'quantity', 'name', 'quantity']
+STATE_COLLECTION: str = "pipeline_state"
+RUNS_COLLECTION: str = "pipeline_runs"
+QUARANTINE_COLLECTION: str = "quarantine"
+RAW_SOURCES_COLLECTION: str = "raw_sources"
+# The stages of a run in order, see main(). "allocate" only re-runs the delivery statuses of the
+# enrichment and "explain" lists queries without index, neither runs by default
+PIPELINE_STAGES: tuple = ("ingest", "archive", "rollups", "enrich", "allocate", "report", "explain")
+DEFAULT_STAGES: tuple = ("ingest", "archive", "rollups", "enrich", "report")
+VERSIONS_COLLECTION: str = "data_versions"
+REPORT_CACHE_COLLECTION: str = "report_cache"
+# Streaming mode reads the CSV files in chunks so memory doesn't grow with the file size
+STREAMING: bool = os.environ.get("STREAMING", "false").lower() == "true"
+CHUNK_SIZE: int = int(os.environ.get("CHUNK_SIZE", 50_000))
+# Incremental mode skips unchanged files and rows and only recomputes the affected products
+INCREMENTAL: bool = os.environ.get("INCREMENTAL", "false").lower() == "true"
+# Parallel mode ingests every file in RAW_DIR matching the patterns, parsed in worker processes
+PARALLEL: bool = os.environ.get("PARALLEL", "false").lower() == "true"
+MAX_WORKERS: int = int(os.environ.get("MAX_WORKERS", 0)) or None
+ORDERS_PATTERN: str = os.environ.get("ORDERS_PATTERN", "orders*.csv")
+INVENTORY_PATTERN: str = os.environ.get("INVENTORY_PATTERN", "inventory*.csv")
+# Staging mode also writes the validated rows to typed, compressed Parquet files in PROCESSED_DIR/staged
+STAGING: bool = os.environ.get("STAGING", "false").lower() == "true"
+# Replay mode rebuilds the processed collections from the staged files instead of reading RAW_DIR
+REPLAY_STAGED: bool = os.environ.get("REPLAY_STAGED", "false").lower() == "true"
+# Where the enrichment and the report are computed: "mongo" (aggregation pipelines on the server),
+# "merge" (only on the server, every derived field is written with $merge, MongoDB 5.0+)
+# or "pandas" (vectorized on DataFrames, MongoDB is only read and written in bulk)
+BACKEND: str = os.environ.get("BACKEND", "mongo").lower()
+# Service mode keeps running: new files in RAW_DIR are ingested as they arrive and only the affected
+# products are re-enriched. With CHANGE_STREAMS (requires a replica set) any write to orders or
+# inventory, also from outside the pipeline, triggers the re-enrichment of its products
+SERVICE: bool = os.environ.get("SERVICE", "false").lower() == "true"
+CHANGE_STREAMS: bool = os.environ.get("CHANGE_STREAMS", "false").lower() == "true"
+POLL_INTERVAL: float = float(os.environ.get("POLL_INTERVAL", 1.0))
+# Explain mode reports the pipeline queries that still scan a whole collection
+EXPLAIN: bool = os.environ.get("EXPLAIN", "false").lower() == "true"
+# Level of the log messages, DEBUG also logs every order of the legacy delivery status update
+LOG_LEVEL: str = os.environ.get("LOG_LEVEL", "INFO").upper()
+# Stages ("ingest", "enrich", "report", "explain" or "all") to profile with cProfile or tracemalloc
+PROFILE_STAGES: list = [stage for stage in os.environ.get("PROFILE_STAGES", "").split(",") if stage]
+TRACE_MEMORY_STAGES: list = [stage for stage in os.environ.get("TRACE_MEMORY_STAGES", "").split(",") if stage]
+PROFILE_DIR: str = os.environ.get("PROFILE_DIR", "/app/data/profiles/")
+# Optional OpenMetrics / Prometheus textfile the stage metrics are written to
+METRICS_FILE: str = os.environ.get("METRICS_FILE", "")
+# Number of bulk_write batches in flight per writer and optional max batch size in bytes
+WRITE_OPTIONS: dict = {
+    "concurrency": int(os.environ.get("WRITE_CONCURRENCY", 4)),
+    "max_batch_bytes": int(os.environ.get("MAX_BATCH_BYTES", 0)) or None,
+}
+# Every run records its completed stages and committed batches in RUNS_COLLECTION, a run that
+# crashed is resumed where it stopped by the next run of the same mode unless RESUME is false
+RESUME: bool = os.environ.get("RESUME", "true").lower() == "true"
+# Sales by product, channel, campaign and category per day (see rollups.py), updated from every
+# upserted batch of orders so dashboards don't aggregate the orders collection
+ROLLUPS: bool = os.environ.get("ROLLUPS", "false").lower() == "true"
+# Raw collections in monthly partitions (see partitions.py): raw_orders by the orders' dateTime and
+# raw_inventory by the month its file was first ingested in. Partitions that ended more than RAW_RETENTION_DAYS
+# ago are archived to compressed files in PROCESSED_DIR/archive and dropped (0 keeps them)
+PARTITION_RAW: bool = os.environ.get("PARTITION_RAW", "false").lower() == "true"
+RAW_RETENTION_DAYS: int = int(os.environ.get("RAW_RETENTION_DAYS", 0))
+# Report results are cached by query and data version (bumped by every write of the pipeline):
+# "off", "memory" (in-process LRU), "mongo" or "file" (also kept across runs), see report_cache.py
+REPORT_CACHE: str = os.environ.get("REPORT_CACHE", "memory").lower()
+REPORT_CACHE_TTL: float = float(os.environ.get("REPORT_CACHE_TTL", 0)) or None
+REPORT_CACHE_SIZE: int = int(os.environ.get("REPORT_CACHE_SIZE", 128))
+# Pool sizes, compression, timeouts and write concerns by stage, from MONGO_CONFIG and MONGO_* (see mongo_config.py)
+MONGO_SETTINGS: MongoSettings = load_settings()
+# Cross-run dedup drops orders whose orderId an earlier run ingested: "" (off), "exact" (8 bytes
+# per orderId) or "bloom" (fixed size, hits are confirmed against the orders collection)
+DEDUP_STORE: str = os.environ.get("DEDUP_STORE", "").lower()
+DEDUP_CAPACITY: int = int(os.environ.get("DEDUP_CAPACITY", 10_000_000))
+# Compact mode stores the raw collections with short field names and without default values such as the currency
+COMPACT_RAW: bool = os.environ.get("COMPACT_RAW", "false").lower() == "true"
+# Validated orderIds are held in memory as 16-byte binary UUIDs instead of 36 character strings,
+# they are still stored as strings. Every other column gets its type from schema.SCHEMAS
+BINARY_UUIDS: bool = os.environ.get("BINARY_UUIDS", "false").lower() == "true"
+# Documents are written with native BSON types (datetimes, int32, Decimal128 amounts), see encoding.DocumentEncoder
+ENCODERS: dict = {
+    RAW_ORDERS_COLLECTION: DocumentEncoder(ORDERS_FIELDS, short_names=COMPACT_RAW, omit_defaults=COMPACT_RAW),
+    RAW_INVENTORY_COLLECTION: DocumentEncoder(INVENTORY_FIELDS, short_names=COMPACT_RAW, omit_defaults=COMPACT_RAW),
+    ORDERS_COLLECTION: ORDERS_ENCODER,
+    INVENTORY_COLLECTION: INVENTORY_ENCODER,
+}
 
-def main():
-    # Load raw data
-    orders = load_csv(os.path.join(RAW_DIR, "orders.csv"), PROCESSED_DIR)
-    inventory = load_csv(os.path.join(RAW_DIR, "inventory.csv"), PROCESSED_DIR)
-
-    # TODO: motivera varför jag anser detta rimligt
-    try:
-        validate_data(orders, CRITICAL_COLUMNS_ORDER)
-        validate_data(inventory, CRITICAL_COLUMNS_INVENTORY)
-        print("Data is valid!")
-    except ValueError as e:
-        print(f"Validation failed: {e}")
-
-    # Connect to MongoDB
-    client = get_mongo_client()
-    if not client:
+def connect():
+    """Connects to MongoDB and makes sure the pipeline indexes exist before anything is written."""
+    client = get_mongo_client(event_listeners=[ROUND_TRIPS], settings=MONGO_SETTINGS)
+    if client:
+        ensure_indexes(client[DB_NAME])
+    return client
+
+def write_options(stage: str) -> dict:
+    """WRITE_OPTIONS with the write concern of a stage ("raw" or "processed"), for the bulk writers."""
+    return {**WRITE_OPTIONS, "write_concern": MONGO_SETTINGS.write_concern(stage)}
+
+def state_collection(db):
+    """The collection of the incremental and change stream state."""
+    return db.get_collection(STATE_COLLECTION, write_concern=MONGO_SETTINGS.write_concern("state"))
+
+def upsert_processed(client, collection_name: str, df, match_field: str, batch_size: int = 1000) -> None:
+    """
+    Upserts rows into a processed collection.
+
+    With ROLLUPS the stored versions of upserted orders are read first, and the sales rollups
+    are updated by the difference once the orders are written. The data version of the
+    collection is bumped, so cached reports are computed again.
+    """
+    db = client[DB_NAME]
+    previous = previous_orders(db[ORDERS_COLLECTION], df, batch_size) if ROLLUPS and collection_name == ORDERS_COLLECTION else None
+    upsert_dataframe_to_mongo(DB_NAME, collection_name, df, client, match_field=match_field, batch_size=batch_size, encoder=ENCODERS[collection_name], **write_options("processed"))
+    if previous is not None:
+        apply_sales_deltas(db, sales_deltas(df, previous), concurrency=WRITE_OPTIONS["concurrency"])
+    data_versions(db).bump(collection_name)
+
+def raw_source_month(db, raw_id: str = None):
+    """The partition month of the raw rows of a file without a date of their own, None without PARTITION_RAW or raw_id."""
+    if not PARTITION_RAW or raw_id is None:
+        return None
+    return source_month(db.get_collection(RAW_SOURCES_COLLECTION, write_concern=MONGO_SETTINGS.write_concern("state")), raw_id)
+
+def raw_partitions(raw_collection_name: str, df, month=None) -> list:
+    """
+    The collections raw rows are stored in, with their rows: monthly partitions with PARTITION_RAW.
+
+    Rows without a date go to month, the one of raw_source_month, or the current month.
+    """
+    if not PARTITION_RAW or raw_collection_name not in PARTITIONED_COLLECTIONS:
+        return [(raw_collection_name, df)]
+    return [(partition_name(raw_collection_name, partition_month), rows)
+            for partition_month, rows in split_by_month(df, PARTITIONED_COLLECTIONS[raw_collection_name], now=month)]
+
+def store_raw(client, raw_collection_name: str, df, batch_size: int = 1000, raw_id: str = None) -> None:
+    """Stores raw rows in their collection or partitions, raw_id makes the inserts idempotent (see checkpoint.source_id)."""
+    month = raw_source_month(client[DB_NAME], raw_id)
+    for collection_name, rows in raw_partitions(raw_collection_name, df, month):
+        store_raw_data_to_mongo(DB_NAME, collection_name, rows, client, batch_size=batch_size, encoder=ENCODERS[raw_collection_name], source_id=raw_id, **write_options("raw"))
+
+def archive_raw(db) -> list:
+    """Archives the raw partitions older than RAW_RETENTION_DAYS, see partitions.archive_partitions."""
+    if not PARTITION_RAW or not RAW_RETENTION_DAYS:
+        return []
+    archived = []
+    for collection_name in PARTITIONED_COLLECTIONS:
+        archived.extend(archive_partitions(db, collection_name, RAW_RETENTION_DAYS, os.path.join(PROCESSED_DIR, "archive")))
+    for partition in archived:
+        print(f"Archived {partition.documents} documents of {partition.collection} to {partition.path}")
+    return archived
+
+def data_versions(db) -> DataVersions:
+    """The data versions of the collections, which invalidate cached report results."""
+    return DataVersions(db.get_collection(VERSIONS_COLLECTION, write_concern=MONGO_SETTINGS.write_concern("state")))
+
+def report_cache(db):
+    """The report cache of REPORT_CACHE, None if it is off."""
+    if REPORT_CACHE == "off":
+        return None
+    store = open_store(REPORT_CACHE, db[REPORT_CACHE_COLLECTION], os.path.join(PROCESSED_DIR, REPORT_CACHE_COLLECTION))
+    return ReportCache(data_versions(db), max_entries=REPORT_CACHE_SIZE, ttl=REPORT_CACHE_TTL, store=store)
+
+def staging_dir() -> str:
+    """The folder of the staged Parquet files."""
+    return os.path.join(PROCESSED_DIR, "staged")
+
+def orders_deduplicator(client, incremental: bool = False) -> Deduplicator:
+    """
+    Drops duplicate orderIds within the run and, with DEDUP_STORE, orderIds ingested by earlier runs.
+
+    In incremental mode the rows of ingested orderIds are kept, filter_changed_rows decides if
+    they are corrections to apply. The store is still kept up to date.
+    """
+    if not DEDUP_STORE:
+        return Deduplicator("orderId")
+    path = os.path.join(PROCESSED_DIR, "dedup", ORDERS_COLLECTION)
+    confirm = None
+    if DEDUP_STORE == "bloom":
+        orders = client[DB_NAME][ORDERS_COLLECTION]
+        confirm = lambda keys: {doc["orderId"] for doc in orders.find({"orderId": {"$in": keys}}, {"_id": 0, "orderId": 1})}
+    return Deduplicator("orderId", store=open_key_store(path, DEDUP_STORE, capacity=DEDUP_CAPACITY), store_path=path, confirm=confirm,
+                        drop_stored=not incremental)
+
+def stage_rows(df, dataset: str, source_file: str) -> None:
+    """Writes validated rows of a source file to a new staged Parquet file of the dataset."""
+    with StagedFileWriter(staged_path(staging_dir(), dataset, source_file), STAGING_SCHEMAS[dataset]) as writer:
+        writer.write(df)
+
+def quarantine_rows(client, rejected, source: str, raw_id: str = None) -> None:
+    """
+    Stores rows that failed validation, with their validationErrors and source file, in the quarantine collection.
+
+    With the raw_id of the source file (see checkpoint.source_id) storing them again replaces them.
+    """
+    if rejected is None or rejected.empty:
         return
+    print(f"{source}: {len(rejected)} rows failed validation and were moved to {QUARANTINE_COLLECTION}")
+    # Missing values as None, BSON can't encode pandas' NA values
+    rejected = rejected.astype(object).where(rejected.notna(), None).assign(source=source)
+    store_raw_data_to_mongo(DB_NAME, QUARANTINE_COLLECTION, rejected, client, batch_size=1000, source_id=raw_id, **write_options("raw"))
+
+def validate_and_quarantine(client, df, rules: list, source: str, parse_datetimes: bool = False, schema: list = None,
+                            raw_id: str = None):
+    """Validates every row of df and returns the valid ones with the types of schema, the rejected rows are quarantined."""
+    result = validate_rows(df, rules, parse_datetimes=parse_datetimes)
+    quarantine_rows(client, result.rejected_with_reasons(), source, raw_id)
+    return apply_schema(result.valid, schema, uuid_binary=BINARY_UUIDS) if schema else result.valid
+
+def store_changed_rows(client, df, raw_collection_name: str, collection_name: str, match_field: str,
+                       changed_products: set, batch_size: int = 1000, raw_id: str = None) -> None:
+    """
+    Stores only the rows that are new or changed since they were last upserted.
+
+    The rows are expected to be free from duplicates. The productIds of the changed rows, and
+    the productIds they had before, are added to changed_products. raw_id makes the raw
+    inserts idempotent, see checkpoint.source_id.
+    """
+    df = add_row_hashes(df)
+    changed, previous_products = filter_changed_rows(client[DB_NAME][collection_name], df, match_field,
+                                                     related_field="productId", batch_size=batch_size)
+    print(f"{collection_name}: {len(changed)} of {len(df)} rows are new or changed")
+    if changed.empty:
+        return
+
+    store_raw(client, raw_collection_name, changed.drop(columns=[ROW_HASH_FIELD]), batch_size=batch_size, raw_id=raw_id)
+    upsert_processed(client, collection_name, changed, match_field=match_field, batch_size=batch_size)
+    count(rows_out=len(changed))
+    changed_products.update(changed["productId"])
+    changed_products.update(previous_products)
+
+def stream_csv_to_mongo(client, file_path: str, raw_collection_name: str, collection_name: str, match_field: str,
+                        rules: list, dtype: dict, parse_dates: list = None,
+                        chunk_size: int = CHUNK_SIZE, batch_size: int = 1000, changed_products: set = None,
+                        staging_writer: StagedFileWriter = None, deduplicator: Deduplicator = None,
+                        manifest: RunManifest = None, fingerprint: str = None) -> int:
+    """
+    Streams a CSV file into its raw and processed collections one chunk at a time.
+
+    Each chunk is validated (rejected rows are quarantined), stored raw, cleaned from duplicates (also against keys of earlier
+    chunks) and upserted before the next chunk is read. When changed_products is given only new
+    or changed rows are stored, see store_changed_rows. The valid rows of every chunk are also
+    written to staging_writer, if given. Keys ingested by earlier runs are dropped before
+    anything is stored if the deduplicator has a store.
+
+    Every stored chunk is committed to the manifest, if given. When a crashed run is resumed
+    the chunks it committed are only parsed again for their keys (and the staging file), not
+    stored; the raw documents get ids from the file's fingerprint, so a chunk stored but not
+    committed before the crash replaces its own documents.
+
+    Returns:
+        int: The number of rows read.
+    """
+    deduplicator = deduplicator or Deduplicator(match_field)
+    fingerprint = fingerprint or file_fingerprint(file_path)
+    raw_id = source_id(fingerprint)
+    committed = manifest.committed_batches(file_path, fingerprint) if manifest else 0
+    if committed:
+        print(f"{os.path.basename(file_path)}: {committed} chunks were stored by the resumed run, skipping their writes")
+    rows = 0
+    for batch, chunk in enumerate(iter_csv_chunks(file_path, chunk_size, dtype=dtype, parse_dates=parse_dates)):
+        rows += len(chunk)
+        chunk_rows = len(chunk)
+        if batch < committed:
+            # Stored by the resumed run, the deduplicator still has to see its keys
+            chunk = apply_schema(validate_rows(chunk, rules, parse_datetimes=bool(parse_dates)).valid, SCHEMAS[collection_name],
+                                 uuid_binary=BINARY_UUIDS)
+            chunk = deduplicator.drop_ingested(chunk)
+            if staging_writer is not None:
+                staging_writer.write(chunk)
+            deduplicator.drop_duplicates(chunk)
+            continue
+
+        count(rows_in=chunk_rows)
+        chunk = validate_and_quarantine(client, chunk, rules, os.path.basename(file_path), parse_datetimes=bool(parse_dates),
+                                        schema=SCHEMAS[collection_name], raw_id=raw_id)
+        chunk = deduplicator.drop_ingested(chunk)
+        if staging_writer is not None:
+            staging_writer.write(chunk)
+
+        if changed_products is None:
+            store_raw(client, raw_collection_name, chunk, batch_size=batch_size, raw_id=raw_id)
+
+        # Keep the first row of every key, like remove_dublicates does for a whole file
+        chunk = deduplicator.drop_duplicates(chunk)
+        if not chunk.empty and changed_products is None:
+            upsert_processed(client, collection_name, chunk, match_field=match_field, batch_size=batch_size)
+            count(rows_out=len(chunk))
+        elif not chunk.empty:
+            store_changed_rows(client, chunk, raw_collection_name, collection_name, match_field, changed_products,
+                               batch_size=batch_size, raw_id=raw_id)
+        if manifest:
+            manifest.commit_batch(file_path, fingerprint, chunk_rows, changed_products)
+    if manifest:
+        manifest.finish_source(file_path, fingerprint)
+
+    print(f"{collection_name}: streamed {rows} rows, {deduplicator.unique_keys} unique {match_field}")
+    return rows
+
+def ingest_streaming(chunk_size: int = CHUNK_SIZE, incremental: bool = False, staging: bool = False,
+                     client=None, manifest: RunManifest = None):
+    """
+    Streams both datasets into MongoDB.
+
+    An open client can be passed in. With a manifest every stored chunk is committed and the
+    chunks committed by a resumed run are skipped, see stream_csv_to_mongo.
+
+    Returns:
+        The client and, in incremental mode, the set of changed productIds (otherwise None).
+        The client is None if it can't connect.
+    """
+    client = client or connect()
+    if not client:
+        return None, None
+
+    state = state_collection(client[DB_NAME])
+    # Including the products changed by the resumed run, whose files are already marked as processed
+    changed_products = set(manifest.changed_products if manifest else ()) if incremental else None
+    sources = [
+        (os.path.join(RAW_DIR, "orders.csv"), RAW_ORDERS_COLLECTION, ORDERS_COLLECTION, "orderId",
+         ORDERS_RULES, ORDERS_DTYPES, ORDERS_DATE_COLUMNS),
+        (os.path.join(RAW_DIR, "inventory.csv"), RAW_INVENTORY_COLLECTION, INVENTORY_COLLECTION, "productId",
+         INVENTORY_RULES, INVENTORY_DTYPES, None),
+    ]
+    deduplicators = {ORDERS_COLLECTION: orders_deduplicator(client, incremental), INVENTORY_COLLECTION: Deduplicator("productId")}
+    for file_path, raw_collection_name, collection_name, match_field, rules, dtype, parse_dates in sources:
+        fingerprint = file_fingerprint(file_path)
+        if incremental and is_file_processed(state, file_path, fingerprint):
+            print(f"{os.path.basename(file_path)} is unchanged since the last run, skipping it")
+            continue
+        count(bytes_read=os.path.getsize(file_path))
+        # The resumed run already staged the files it finished
+        stage_file = staging and not (manifest and manifest.is_source_done(file_path, fingerprint))
+        staging_writer = StagedFileWriter(staged_path(staging_dir(), collection_name, file_path), STAGING_SCHEMAS[collection_name]) \
+            if stage_file else contextlib.nullcontext()
+        with staging_writer:
+            rows = stream_csv_to_mongo(client, file_path, raw_collection_name, collection_name, match_field,
+                                       rules, dtype, parse_dates, chunk_size=chunk_size,
+                                       changed_products=changed_products,
+                                       staging_writer=staging_writer if stage_file else None,
+                                       deduplicator=deduplicators[collection_name],
+                                       manifest=manifest, fingerprint=fingerprint)
+        print(deduplicators[collection_name].summary())
+        if incremental:
+            mark_file_processed(state, file_path, fingerprint, rows)
+    deduplicators[ORDERS_COLLECTION].save()
+
+    # Only move the files once everything read from them has been stored
+    for file_path, *_ in sources:
+        move_to_processed(file_path, PROCESSED_DIR)
+    return client, changed_products
+
+def ingest_parallel(incremental: bool = False, max_workers: int = MAX_WORKERS, staging: bool = False,
+                    client=None, only_files: list = None, manifest: RunManifest = None):
+    """
+    Ingests every orders and inventory file in RAW_DIR, parsed and validated in worker processes.
+
+    The workers only parse, this process is the single writer that owns the MongoDB connection.
+    A file that can't be read is reported and left in RAW_DIR without failing the other files.
+    An open client can be passed in, and only_files limits the ingestion to these files.
+    Every file is a batch: it is moved once stored, so a resumed run only ingests the files
+    left in RAW_DIR, and it is committed to the manifest, if given.
+
+    Returns:
+        The client and, in incremental mode, the set of changed productIds (otherwise None).
+        The client is None if it can't connect.
+    """
+    client = client or connect()
+    if not client:
+        return None, None
+
+    state = state_collection(client[DB_NAME])
+    changed_products = set(manifest.changed_products if manifest else ()) if incremental else None
+    failed_files = []
+    sources = [
+        (ORDERS_PATTERN, RAW_ORDERS_COLLECTION, ORDERS_COLLECTION, "orderId",
+         ORDERS_RULES, ORDERS_DTYPES, ORDERS_DATE_COLUMNS),
+        (INVENTORY_PATTERN, RAW_INVENTORY_COLLECTION, INVENTORY_COLLECTION, "productId",
+         INVENTORY_RULES, INVENTORY_DTYPES, None),
+    ]
+    for pattern, raw_collection_name, collection_name, match_field, rules, dtype, parse_dates in sources:
+        file_paths = discover_files(RAW_DIR, pattern)
+        if only_files is not None:
+            file_paths = [file_path for file_path in file_paths if file_path in only_files]
+        print(f"Found {len(file_paths)} files matching {pattern}")
+
+        fingerprints = {}
+        if incremental:
+            for file_path in list(file_paths):
+                fingerprints[file_path] = file_fingerprint(file_path)
+                if is_file_processed(state, file_path, fingerprints[file_path]):
+                    print(f"{os.path.basename(file_path)} is unchanged since the last run, skipping it")
+                    file_paths.remove(file_path)
+                    move_to_processed(file_path, PROCESSED_DIR)
+
+        # Keys already stored from earlier files, the first file (by name) wins like in remove_dublicates
+        deduplicator = orders_deduplicator(client, incremental) if collection_name == ORDERS_COLLECTION else Deduplicator(match_field)
+        for parsed in parse_files_parallel(file_paths, dtype, parse_dates, rules, max_workers=max_workers,
+                                           schema=SCHEMAS[collection_name], uuid_binary=BINARY_UUIDS):
+            if parsed.error:
+                print(parsed.error)
+                failed_files.append(parsed.file_path)
+                continue
+            raw_id = source_id(parsed.fingerprint)
+            quarantine_rows(client, parsed.rejected, os.path.basename(parsed.file_path), raw_id)
+            count(rows_in=len(parsed.df) + (0 if parsed.rejected is None else len(parsed.rejected)),
+                  bytes_read=os.path.getsize(parsed.file_path))
+            if staging:
+                stage_rows(parsed.df, collection_name, parsed.file_path)
+
+            df = deduplicator.drop_ingested(parsed.df)
+            if not incremental:
+                store_raw(client, raw_collection_name, df, batch_size=1000, raw_id=raw_id)
+            df = deduplicator.drop_duplicates(df)
+            if incremental:
+                store_changed_rows(client, df, raw_collection_name, collection_name, match_field, changed_products, raw_id=raw_id)
+                mark_file_processed(state, parsed.file_path, fingerprints[parsed.file_path], len(parsed.df))
+            elif not df.empty:
+                upsert_processed(client, collection_name, df, match_field=match_field, batch_size=1000)
+                count(rows_out=len(df))
+
+            if manifest:
+                manifest.commit_batch(parsed.file_path, parsed.fingerprint, len(parsed.df), changed_products)
+            # Only move the file once everything read from it has been stored
+            move_to_processed(parsed.file_path, PROCESSED_DIR)
+        deduplicator.save()
+        print(deduplicator.summary())
+
+    if failed_files:
+        print(f"{len(failed_files)} files failed and were left in {RAW_DIR}: {', '.join(failed_files)}")
+    return client, changed_products
+
+def ingest_in_memory(incremental: bool = False, staging: bool = False, client=None, manifest: RunManifest = None):
+    """
+    Loads both datasets into memory and stores them in MongoDB.
+
+    The files are only moved once they are stored, every write is idempotent, so a resumed run
+    ingests them again. In incremental mode every stored file is committed to the manifest, if given.
+
+    Returns:
+        The client and, in incremental mode, the set of changed productIds (otherwise None).
+        The client is None if it can't connect.
+    """
+    orders_path = os.path.join(RAW_DIR, "orders.csv")
+    inventory_path = os.path.join(RAW_DIR, "inventory.csv")
+
+    # Fingerprints of the files, for incremental runs and the ids of the raw documents
+    fingerprints = {path: file_fingerprint(path) for path in (orders_path, inventory_path)}
+    raw_ids = {path: source_id(fingerprint) for path, fingerprint in fingerprints.items()}
+
+    # Connect to MongoDB and create the indexes
+    client = client or connect()
+    if not client:
+        return None, None
+
+    # Files unchanged since the last incremental run aren't read at all, like in the streaming and parallel modes
+    state = state_collection(client[DB_NAME])
+    unchanged = set()
+    if incremental:
+        for path in (orders_path, inventory_path):
+            if is_file_processed(state, path, fingerprints[path]):
+                print(f"{os.path.basename(path)} is unchanged since the last run, skipping it")
+                unchanged.add(path)
+
+    # Load raw data
+    count(bytes_read=sum(os.path.getsize(path) for path in (orders_path, inventory_path) if path not in unchanged))
+    orders = load_csv(orders_path, None, dtype=ORDERS_DTYPES, parse_dates=ORDERS_DATE_COLUMNS) if orders_path not in unchanged else None
+    inventory = load_csv(inventory_path, None, dtype=INVENTORY_DTYPES) if inventory_path not in unchanged else None
+    count(rows_in=sum(len(df) for df in (orders, inventory) if df is not None))
+
+    # Valid rows keep flowing, rows that fail a rule are quarantined instead of being loaded
+    if orders is not None:
+        orders = validate_and_quarantine(client, orders, ORDERS_RULES, os.path.basename(orders_path),
+                                         parse_datetimes=True, schema=SCHEMAS[ORDERS_COLLECTION], raw_id=raw_ids[orders_path])
+    if inventory is not None:
+        inventory = validate_and_quarantine(client, inventory, INVENTORY_RULES, os.path.basename(inventory_path),
+                                            schema=SCHEMAS[INVENTORY_COLLECTION], raw_id=raw_ids[inventory_path])
+
+    # Orders an earlier run ingested are dropped before anything is stored, with DEDUP_STORE
+    deduplicator = orders_deduplicator(client, incremental)
+    if orders is not None:
+        orders = deduplicator.drop_ingested(orders)
+
+    if incremental:
+        # Including the products changed by the resumed run, whose files are already marked as processed
+        changed_products = set(manifest.changed_products if manifest else ())
+        sources = [
+            (orders_path, orders, RAW_ORDERS_COLLECTION, ORDERS_COLLECTION, 'orderId'),
+            (inventory_path, inventory, RAW_INVENTORY_COLLECTION, INVENTORY_COLLECTION, 'productId'),
+        ]
+        for file_path, df, raw_collection_name, collection_name, match_field in sources:
+            if file_path in unchanged:
+                continue
+            if staging:
+                stage_rows(df, collection_name, file_path)
+            if collection_name == ORDERS_COLLECTION:
+                df_no_duplicates = deduplicator.drop_duplicates(df)
+                print(deduplicator.summary())
+            else:
+                df_no_duplicates = remove_dublicates(df, match_field, collection_name)
+            store_changed_rows(client, df_no_duplicates, raw_collection_name, collection_name, match_field, changed_products,
+                               raw_id=raw_ids[file_path])
+            mark_file_processed(state, file_path, fingerprints[file_path], len(df))
+            if manifest:
+                manifest.commit_batch(file_path, fingerprints[file_path], len(df), changed_products)
+        deduplicator.save()
+        for file_path, *_ in sources:
+            move_to_processed(file_path, PROCESSED_DIR)
+        return client, changed_products
     
+    if staging:
+        stage_rows(orders, ORDERS_COLLECTION, orders_path)
+        stage_rows(inventory, INVENTORY_COLLECTION, inventory_path)
+
     # ingests the two datasets and stores the raw data
     # added last minute after have re-read the instructions
-    store_raw_data_to_mongo(DB_NAME, RAW_ORDERS_COLLECTION, orders, client, batch_size=1000)
-    store_raw_data_to_mongo(DB_NAME, RAW_INVENTORY_COLLECTION, inventory, client, batch_size=1000)
+    store_raw(client, RAW_ORDERS_COLLECTION, orders, batch_size=1000, raw_id=raw_ids[orders_path])
+    store_raw(client, RAW_INVENTORY_COLLECTION, inventory, batch_size=1000, raw_id=raw_ids[inventory_path])
 
     # clean dataset from dublicates
     # since i use upsert on my shoosen keys this can see unnecessary
     # but i also wanted to print out to highlight if any dublicates was removed
-    orders_no_duplicates = remove_dublicates(orders, 'orderId', ORDERS_COLLECTION)
+    orders_no_duplicates = deduplicator.drop_duplicates(orders)
+    print(deduplicator.summary())
     inventory_no_duplicates = remove_dublicates(inventory, 'productId', INVENTORY_COLLECTION)
 
     # Insert raw and processed data into MongoDB
     # I used two collections to keep my changes to the data persisted
     # Prefered to use upsert to insert so this code is reusable, can be run through over and over and avoid creating dublicates etc. 
-    upsert_dataframe_to_mongo(DB_NAME, ORDERS_COLLECTION, orders_no_duplicates, client, match_field="orderId", batch_size=1000)
-    upsert_dataframe_to_mongo(DB_NAME, INVENTORY_COLLECTION, inventory_no_duplicates, client, match_field="productId", batch_size=1000)
+    upsert_processed(client, ORDERS_COLLECTION, orders_no_duplicates, match_field="orderId", batch_size=1000)
+    upsert_processed(client, INVENTORY_COLLECTION, inventory_no_duplicates, match_field="productId", batch_size=1000)
+    count(rows_out=len(orders_no_duplicates) + len(inventory_no_duplicates))
+    deduplicator.save()
 
-    print("Pipeline executed successfully and data saved to MongoDB!")
+    # Only move the files once everything read from them has been stored
+    move_to_processed(orders_path, PROCESSED_DIR)
+    move_to_processed(inventory_path, PROCESSED_DIR)
+    return client, None
 
-   # Connect to the database using the client and specify the database name
-    db = client[DB_NAME]
+def ingest_staged(batch_size: int = 1000, client=None, manifest: RunManifest = None):
+    """
+    Rebuilds the processed collections from the staged Parquet files, e.g. to backfill them.
+
+    The files are read memory-mapped, in the order they were staged, without parsing and
+    validating CSV again. Within a file the first row of a key wins and later files replace
+    earlier ones, like in the runs that staged them. The raw collections are left as they are.
+    Every replayed file is committed to the manifest, if given, a resumed run skips the files
+    the crashed run committed.
+
+    Returns:
+        The client and None, every product is recomputed. The client is None if it can't connect.
+    """
+    client = client or connect()
+    if not client:
+        return None, None
 
-    # Access the "inventory" collection from the database
-    inventory_collection = db[INVENTORY_COLLECTION]
+    for collection_name, match_field in ((ORDERS_COLLECTION, "orderId"), (INVENTORY_COLLECTION, "productId")):
+        paths = list_staged_files(staging_dir(), collection_name)
+        print(f"Replaying {len(paths)} staged {collection_name} files")
+        for path in paths:
+            # Staged files are never rewritten, their path identifies their content
+            if manifest and manifest.committed_batches(path):
+                continue
+            count(bytes_read=os.path.getsize(path))
+            # Every staged file was deduplicated on its own when it was ingested
+            deduplicator = Deduplicator(match_field)
+            for batch in iter_staged_batches(path):
+                count(rows_in=len(batch))
+                batch = deduplicator.drop_duplicates(batch)
+                if batch.empty:
+                    continue
+                upsert_processed(client, collection_name, batch, match_field=match_field, batch_size=batch_size)
+                count(rows_out=len(batch))
+            if manifest:
+                manifest.commit_batch(path, rows=deduplicator.rows)
+    return client, None
 
-    # Access the "orders" collection from the database
-    order_collection = db[ORDERS_COLLECTION]
+def make_backend(backend: str, db, replay_staged: bool = False, cache: ReportCache = None):
+    """
+    The enrichment and report backend, see BACKEND. Derived fields are written with the "enrich" write concern.
 
-    # Enrich the inventory collection with related order information to simplyfy data access for analytics
-    # Use Inventory collection for inventory centric views like manintaining inventory levels
-    combine_orders_to_inventory_with_count(inventory_collection)
+    The reports of the mongo and merge backends are served from the cache, if given. The pandas
+    backend computes its report from the DataFrames it holds.
+    """
+    write_concern = MONGO_SETTINGS.write_concern("enrich")
+    inventory_collection = db.get_collection(INVENTORY_COLLECTION, write_concern=write_concern)
+    order_collection = db.get_collection(ORDERS_COLLECTION, write_concern=write_concern)
+    if backend == "pandas" and replay_staged:
+        # The collections were just rebuilt from the staged files, read only the needed columns from them
+        return PandasBackend.from_staged(staging_dir(), inventory_collection, order_collection, concurrency=WRITE_OPTIONS["concurrency"])
+    elif backend == "pandas":
+        return PandasBackend.from_collections(inventory_collection, order_collection, concurrency=WRITE_OPTIONS["concurrency"])
+    elif backend == "merge":
+        return MergeBackend(inventory_collection, order_collection, cache=cache)
+    return MongoBackend(inventory_collection, order_collection, cache=cache)
 
+def serve(backend: str = BACKEND, change_streams: bool = CHANGE_STREAMS, poll_interval: float = POLL_INTERVAL,
+          max_workers: int = MAX_WORKERS, stop=None):
+    """
+    Runs the pipeline as a long-running service until stop (a threading.Event) is set.
 
-    print("Inventory updated successfully and data saved to MongoDB!")
+    Every product is enriched once at start, after that new files are ingested incrementally and
+    only the affected products are re-enriched, see service.run_service.
+    """
+    client = connect()
+    if not client:
+        return
+    with client:
+        db = client[DB_NAME]
+        if backend == "pandas":
+            # The pandas backend reads whole collections, per event that costs more than it saves
+            logging.warning("The service re-enriches single products, it uses the mongo backend instead of pandas")
+            backend = "mongo"
+        versions = data_versions(db)
+        pipeline = make_backend(backend, db, cache=report_cache(db))
 
+        def enrich(product_ids=None):
+            summary = pipeline.enrich(product_ids=product_ids)
+            versions.bump(ORDERS_COLLECTION, INVENTORY_COLLECTION)
+            return summary
 
+        # Open the change stream first so no change made during the initial enrichment is missed
+        listener = ChangeListener(db, [ORDERS_COLLECTION, INVENTORY_COLLECTION], state=state_collection(db)) if change_streams else None
+        enrich()
+        print_report(pipeline.report())
 
-    #Calculate and update inventory collection with Inventory balance
-    update_quantity_per_product(inventory_collection)
+        def ingest_files(file_paths):
+            _, changed_products = ingest_parallel(incremental=True, max_workers=max_workers, client=client, only_files=file_paths)
+            if ROLLUPS:
+                refresh_rollups(db, db[ORDERS_COLLECTION], db[INVENTORY_COLLECTION])
+            archive_raw(db)
+            return changed_products
 
-    
+        print(f"Watching {RAW_DIR}" + (" and the orders and inventory change streams" if listener else ""))
+        try:
+            run_service(enrich, ingest_files, FileWatcher(RAW_DIR, [ORDERS_PATTERN, INVENTORY_PATTERN]),
+                        listener, poll_interval=poll_interval, stop=stop)
+        finally:
+            if listener:
+                listener.close()
+
+def main(streaming: bool = STREAMING, chunk_size: int = CHUNK_SIZE, incremental: bool = INCREMENTAL,
+         parallel: bool = PARALLEL, max_workers: int = MAX_WORKERS, explain: bool = EXPLAIN,
+         backend: str = BACKEND, instrumentation: Instrumentation = None,
+         staging: bool = STAGING, replay_staged: bool = REPLAY_STAGED, resume: bool = RESUME,
+         stages: Iterable[str] = None, product_ids: Iterable[str] = None):
+    """
+    Runs the pipeline: the stages of DEFAULT_STAGES, or of stages (see PIPELINE_STAGES), and explain.
+
+    A run of some stages only is resumed by the next run of the same stages. Without ingest the
+    enrichment covers product_ids, or every product.
+    """
+    selected = set(stages or DEFAULT_STAGES) | ({"explain"} if explain else set())
+    unknown = selected - set(PIPELINE_STAGES)
+    if unknown:
+        raise ValueError(f"Unknown stages: {', '.join(sorted(unknown))}, expected some of: {', '.join(PIPELINE_STAGES)}")
+
+    # Wall/CPU time, rows, bytes, round-trips and peak RSS of every stage, logged as JSON
+    instrumentation = instrumentation or Instrumentation(PROFILE_STAGES, TRACE_MEMORY_STAGES, PROFILE_DIR)
+
+    # Connect to MongoDB and create the indexes
+    client = connect()
+    if not client:
+        return
+
+    # Every stage shares the connection pool of the client, it is closed when the run is done
+    with client:
+        # The completed stages and committed batches of the run, a run of the same mode that crashed is resumed
+        mode = "replay" if replay_staged else "parallel" if parallel else "streaming" if streaming else "memory"
+        mode += "+incremental" if incremental else ""
+        mode += f"[{','.join(stage for stage in PIPELINE_STAGES if stage in selected)}]" if stages else ""
+        runs = client[DB_NAME].get_collection(RUNS_COLLECTION, write_concern=MONGO_SETTINGS.write_concern("state"))
+        manifest = RunManifest.open(runs, mode, resume=resume)
+
+        # Batches written before a crash but not committed are upserted again, their rollup deltas may have been lost
+        rebuild_rollups = manifest.resumed and not manifest.is_done("ingest")
+
+        changed_products = set(product_ids) if product_ids is not None else None
+        if "ingest" in selected:
+            with instrumentation.stage("ingest"):
+                if manifest.is_done("ingest"):
+                    print("The resumed run already ingested every file, skipping the ingestion")
+                    changed_products = set(manifest.changed_products) if incremental else None
+                else:
+                    if replay_staged:
+                        _, changed_products = ingest_staged(client=client, manifest=manifest)
+                    elif parallel:
+                        _, changed_products = ingest_parallel(incremental=incremental, max_workers=max_workers, staging=staging,
+                                                              client=client, manifest=manifest)
+                    elif streaming:
+                        _, changed_products = ingest_streaming(chunk_size, incremental=incremental, staging=staging,
+                                                               client=client, manifest=manifest)
+                    else:
+                        _, changed_products = ingest_in_memory(incremental=incremental, staging=staging, client=client, manifest=manifest)
+                    manifest.mark_done("ingest")
+
+            print("Pipeline executed successfully and data saved to MongoDB!")
+
+        # Raw data older than the retention window moves from the database to archive files
+        if "archive" in selected and PARTITION_RAW and RAW_RETENTION_DAYS:
+            with instrumentation.stage("archive"):
+                archive_raw(client[DB_NAME])
 
-    # Enrich the order collection with related inventory information to simplyfy data access for analytics 
-    # Use Order collection for order-centric views like delivery and delivery status
-    update_order_with_delivery_status(order_collection, inventory_collection)
+        # The category rollup is derived from the product rollup and the categories of the ingested inventory
+        if "rollups" in selected and ROLLUPS and not manifest.is_done("rollups"):
+            with instrumentation.stage("rollups"):
+                db = client[DB_NAME]
+                # Also rebuilt when an update of the rollups failed, see rollups.apply_sales_deltas
+                counts = refresh_rollups(db, db[ORDERS_COLLECTION], db[INVENTORY_COLLECTION], rebuild=rebuild_rollups,
+                                         concurrency=WRITE_OPTIONS["concurrency"])
+                if counts is not None:
+                    print(f"Rebuilt the sales rollups: {counts}")
+                manifest.mark_done("rollups")
 
+       # Connect to the database using the client and specify the database name
+        db = client[DB_NAME]
 
-    # Report queries to display relevant data
+        # Access the "inventory" collection from the database
+        inventory_collection = db[INVENTORY_COLLECTION]
 
-    # Display best selling product
-    best_selling_product = get_inventory_with_highest_order(inventory_collection)
-    print(f"The best selling product is at the moment {best_selling_product['productName']}, with {best_selling_product['totalOrderQuantity']} pieces ordered")
+        # Access the "orders" collection from the database
+        order_collection = db[ORDERS_COLLECTION]
 
-    # Display which products needs to be filled up before orders can be delivered
-    inventory_negative_balance = get_inventory_with_negative_balance(inventory_collection)
-    print(f" Need to fill up stock on {len(inventory_negative_balance)} products")
-    for inv in inventory_negative_balance:
-        print(f" Need to fill up stock of: productId: {inv['productId']} and name: {inv['productName']}")
+        # Reports of unchanged collections are served from the cache, e.g. by an incremental run without new data
+        cache = report_cache(db)
 
-    #
-    total_quantity = total_quantity_per_product(inventory_collection)
+        # Enrich the inventory collection with related order information to simplyfy data access for analytics
+        # Use Inventory collection for inventory centric views like manintaining inventory levels
+        # Only per-product aggregates are stored so inventory documents don't grow with the orders
+        # Then calculate the inventory balance and enrich the order collection with the delivery status
+        # for order-centric views like delivery and delivery status
+        # In incremental mode only the products with new or changed rows are recomputed
+        if "enrich" in selected and not manifest.is_done("enrich"):
+            with instrumentation.stage("enrich"):
+                pipeline = make_backend(backend, db, replay_staged=replay_staged, cache=cache)
+                summary = pipeline.enrich(product_ids=changed_products)
+                if changed_products is None or changed_products:
+                    data_versions(db).bump(ORDERS_COLLECTION, INVENTORY_COLLECTION)
+                count(rows_out=sum(summary.values()))
+                manifest.mark_done("enrich")
 
-    # Display which orders can't be delivered and total value od these orders
+            print("Inventory updated successfully and data saved to MongoDB!")
+        else:
+            if "enrich" in selected:
+                print("The resumed run already enriched the collections, skipping the enrichment")
+            # The pandas backend can only report what it enriched itself, report the stored fields instead
+            pipeline = make_backend("mongo" if backend == "pandas" else backend, db, cache=cache)
 
-    not_delivered = summarize_cannot_deliver_orders(order_collection)
+        # Only the delivery statuses, from the inventory balances stored by an earlier enrichment
+        if "allocate" in selected and "enrich" not in selected and not manifest.is_done("allocate"):
+            with instrumentation.stage("allocate"):
+                summary = pipeline.allocate(product_ids=changed_products)
+                data_versions(db).bump(ORDERS_COLLECTION)
+                count(rows_out=sum(summary.values()))
+                manifest.mark_done("allocate")
 
-    print(f"There are {not_delivered['count']} orders that can't be delivered because of stock shortage.")
-    print(f"The total order value of these are {not_delivered['totalAmount']} SEK.")
+            print(f"Delivery statuses updated: {summary}")
 
-    # Display which orders has been delivered and total value of these orders
-    delivered = summarize_delivered_orders(order_collection)
+        # Report queries to display relevant data, small aggregations run concurrently
+        if "report" in selected:
+            with instrumentation.stage("report"):
+                report = pipeline.report()
+            print_report(report)
+            if cache:
+                cache.log_stats()
 
-    print(f"There are {delivered['count']} orders that has been delivered.")
-    print(f"The total order value of these are {delivered['totalAmount']} SEK.")
+        # Diagnostics: queries without a usable index
+        if "explain" in selected:
+            with instrumentation.stage("explain"):
+                report_collscans(db)
 
+        if METRICS_FILE:
+            instrumentation.write_openmetrics(METRICS_FILE, cache.openmetrics() if cache else ())
+        manifest.complete()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if SERVICE:
+        # docker stop sends SIGTERM, finish the current batch and stop
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        serve(stop=stop)
+    else:
+        main()
@@ -0,0 +1,153 @@
+import json
+import logging
+import os
+from typing import Any, Dict, Mapping, NamedTuple, Optional, Tuple
+from pymongo import MongoClient, WriteConcern
+
+# The stages a write concern can be set for: the raw and quarantine collections ("raw"), the
+# processed collections ("processed"), the derived fields ("enrich") and the run state ("state")
+STAGES: Tuple[str, ...] = ("raw", "processed", "enrich", "state")
+
+# The raw collections can be reloaded from the source files, their bulk loads don't wait for the journal
+DEFAULT_WRITE_CONCERNS: Dict[str, dict] = {"raw": {"w": 1, "j": False}}
+
+class MongoSettings(NamedTuple):
+    """How the pipeline connects to MongoDB, see load_settings."""
+    uri: str = "mongodb://mongodb:27017/"  # From the host of docker-compose: "mongodb://localhost:27017/?directConnection=true"
+    app_name: str = "data_pipeline"
+    max_pool_size: int = 100  # Connections per server, shared by every thread and stage
+    min_pool_size: int = 0
+    max_idle_time_ms: Optional[int] = None
+    compressors: Tuple[str, ...] = ()  # Wire compression in order of preference: "zstd", "snappy" and/or "zlib"
+    connect_timeout_ms: int = 20_000
+    server_selection_timeout_ms: int = 30_000
+    socket_timeout_ms: Optional[int] = None
+    timeout_ms: Optional[int] = None  # Client-side timeout of whole operations, retries included
+    retry_writes: bool = True
+    retry_reads: bool = True
+    write_concerns: Dict[str, dict] = DEFAULT_WRITE_CONCERNS  # By stage, stages without one use the server default
+
+    def client_options(self) -> dict:
+        """Keyword arguments for MongoClient or AsyncMongoClient."""
+        options = {
+            "appname": self.app_name,
+            "maxPoolSize": self.max_pool_size,
+            "minPoolSize": self.min_pool_size,
+            "connectTimeoutMS": self.connect_timeout_ms,
+            "serverSelectionTimeoutMS": self.server_selection_timeout_ms,
+            "retryWrites": self.retry_writes,
+            "retryReads": self.retry_reads,
+        }
+        optional = {
+            "maxIdleTimeMS": self.max_idle_time_ms,
+            "socketTimeoutMS": self.socket_timeout_ms,
+            "timeoutMS": self.timeout_ms,
+            "compressors": ",".join(self.compressors) or None,
+        }
+        options.update((name, value) for name, value in optional.items() if value is not None)
+        return options
+
+    def write_concern(self, stage: str) -> Optional[WriteConcern]:
+        """The write concern of a stage, None for the server default."""
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage '{stage}', expected one of: {', '.join(STAGES)}")
+        options = self.write_concerns.get(stage)
+        return WriteConcern(**options) if options else None
+
+def parse_write_concern(value: str) -> dict:
+    """Parses a write concern such as "w=1,j=false" or "w=majority,wtimeout=5000"."""
+    options = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, raw = item.partition("=")
+        name, raw = name.strip(), raw.strip()
+        if name == "j" or name == "fsync":
+            options[name] = raw.lower() == "true"
+        elif name == "w":
+            options[name] = int(raw) if raw.isdigit() else raw
+        elif name == "wtimeout":
+            options[name] = int(raw)
+        else:
+            raise ValueError(f"Unknown write concern option '{name}' in '{value}'")
+    return options
+
+# Environment variables and the settings they override, with their type
+_ENVIRONMENT: Dict[str, Tuple[str, type]] = {
+    "MONGO_URI": ("uri", str),
+    "MONGO_APP_NAME": ("app_name", str),
+    "MONGO_MAX_POOL_SIZE": ("max_pool_size", int),
+    "MONGO_MIN_POOL_SIZE": ("min_pool_size", int),
+    "MONGO_MAX_IDLE_TIME_MS": ("max_idle_time_ms", int),
+    "MONGO_COMPRESSORS": ("compressors", tuple),
+    "MONGO_CONNECT_TIMEOUT_MS": ("connect_timeout_ms", int),
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": ("server_selection_timeout_ms", int),
+    "MONGO_SOCKET_TIMEOUT_MS": ("socket_timeout_ms", int),
+    "MONGO_TIMEOUT_MS": ("timeout_ms", int),
+    "MONGO_RETRY_WRITES": ("retry_writes", bool),
+    "MONGO_RETRY_READS": ("retry_reads", bool),
+}
+
+def _convert(value: Any, kind: type) -> Any:
+    if kind is bool:
+        return value if isinstance(value, bool) else str(value).lower() == "true"
+    if kind is tuple:
+        return tuple(value) if isinstance(value, (list, tuple)) else tuple(part.strip() for part in str(value).split(",") if part.strip())
+    return kind(value)
+
+def load_settings(environ: Optional[Mapping[str, str]] = None, path: Optional[str] = None) -> MongoSettings:
+    """
+    The MongoDB settings of a deployment, without code changes.
+
+    Settings are read from a JSON file (path, or the MONGO_CONFIG environment variable) with
+    the MongoSettings field names as keys, and then from MONGO_* environment variables, which
+    take precedence. Write concerns are set per stage, e.g. MONGO_WRITE_CONCERN_RAW="w=1,j=false"
+    or {"write_concerns": {"raw": {"w": 1, "j": false}}} in the file.
+
+    Usage:
+        settings = load_settings()
+        with create_client(settings) as client:
+            raw_orders = client["data_pipeline"].get_collection("raw_orders", write_concern=settings.write_concern("raw"))
+    """
+    environ = os.environ if environ is None else environ
+    values: Dict[str, Any] = {}
+    path = path or environ.get("MONGO_CONFIG")
+    if path:
+        with open(path) as f:
+            config = json.load(f)
+        unknown = set(config) - set(MongoSettings._fields)
+        if unknown:
+            raise ValueError(f"Unknown MongoDB settings in {path}: {', '.join(sorted(unknown))}")
+        kinds = {field: kind for field, kind in _ENVIRONMENT.values()}
+        values.update((name, _convert(value, kinds[name]) if name in kinds and value is not None else value)
+                      for name, value in config.items())
+
+    for variable, (field, kind) in _ENVIRONMENT.items():
+        if environ.get(variable):
+            values[field] = _convert(environ[variable], kind)
+
+    write_concerns = {**DEFAULT_WRITE_CONCERNS, **{
+        stage: parse_write_concern(value) if isinstance(value, str) else dict(value)
+        for stage, value in values.get("write_concerns", {}).items()
+    }}
+    for stage in STAGES:
+        value = environ.get(f"MONGO_WRITE_CONCERN_{stage.upper()}")
+        if value is not None:
+            write_concerns[stage] = parse_write_concern(value)
+    unknown = set(write_concerns) - set(STAGES)
+    if unknown:
+        raise ValueError(f"Write concerns for unknown stages: {', '.join(sorted(unknown))}")
+    values["write_concerns"] = write_concerns
+    return MongoSettings(**values)
+
+def create_client(settings: Optional[MongoSettings] = None, event_listeners: Optional[list] = None, **overrides) -> MongoClient:
+    """
+    A MongoClient configured with the settings (load_settings by default).
+
+    The client connects lazily and holds the connection pool every stage shares, use it as a
+    context manager so it is closed at the end of the run.
+    """
+    settings = settings or load_settings()
+    options = {**settings.client_options(), **overrides}
+    logging.info(f"MongoDB client: pool {settings.min_pool_size}-{settings.max_pool_size}, "
+                 f"compressors {','.join(settings.compressors) or 'none'}, retryWrites {settings.retry_writes}, "
+                 f"timeoutMS {settings.timeout_ms}, write concerns {settings.write_concerns}")
+    return MongoClient(settings.uri, event_listeners=event_listeners or [], **options)
@@ -1,39 +1,104 @@
-from pymongo import MongoClient, UpdateOne, InsertOne
+from pymongo import MongoClient, UpdateOne, UpdateMany, InsertOne, ReplaceOne, WriteConcern
 from pymongo.collection import Collection
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterable, Iterator, List, Optional
 import pandas as pd
 import logging
 
-def get_mongo_client(uri: str = "mongodb://mongodb:27017/") -> MongoClient:
-    """Connects to the MongoDB instance."""
-    # for local development: "mongodb://localhost:27017/"
+try:
+    from .allocation import allocate_delivery_status, DELIVERED, CANNOT_DELIVER
+    from .bulk_writer import BulkWriter, WriteStats
+    from .encoding import DocumentEncoder, decimal_to_float
+    from .mongo_config import MongoSettings, create_client, load_settings
+    from .queries import (HAS_ORDERS_QUERY, ORDERED_QUANTITY_EXPR, SHORT_INVENTORY_QUERY, in_products, order_aggregates_pipeline,
+                          quantity_per_product_pipeline, merge_quantity_pipeline, delivered_orders_query, merge_delivery_status_pipeline)
+except ImportError:
+    from allocation import allocate_delivery_status, DELIVERED, CANNOT_DELIVER
+    from bulk_writer import BulkWriter, WriteStats
+    from encoding import DocumentEncoder, decimal_to_float
+    from mongo_config import MongoSettings, create_client, load_settings
+    from queries import (HAS_ORDERS_QUERY, ORDERED_QUANTITY_EXPR, SHORT_INVENTORY_QUERY, in_products, order_aggregates_pipeline,
+                         quantity_per_product_pipeline, merge_quantity_pipeline, delivered_orders_query, merge_delivery_status_pipeline)
+
+def get_mongo_client(uri: Optional[str] = None, event_listeners: Optional[list] = None,
+                     settings: Optional[MongoSettings] = None) -> MongoClient:
+    """
+    Connects to the MongoDB instance, event_listeners are pymongo monitoring listeners such as instrumentation.ROUND_TRIPS.
+
+    Pool sizes, compression, timeouts and retryable writes come from settings, by default from
+    MONGO_URI and the other MONGO_* environment variables (see mongo_config.load_settings);
+    uri overrides the URI of the settings. Close the client, e.g. with a with block, when done.
+    """
     try:
-        client = MongoClient(uri)
+        settings = settings or load_settings()
+        client = create_client(settings._replace(uri=uri) if uri else settings, event_listeners)
         print(f"Connect to MongoDB")
         return client
     except Exception as e:
         print(f"Failed to connect to MongoDB: {e}")
         return None
 
-def store_raw_data_to_mongo(db_name: str, collection_name: str, df: pd.DataFrame, client: MongoClient, batch_size: int):
+def iter_record_batches(df: pd.DataFrame, batch_size: int, encoder: Optional[DocumentEncoder] = None) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Yields the rows of a DataFrame as lists of at most batch_size records.
+
+    Only one batch of records is materialized at a time instead of the whole DataFrame. With an
+    encoder the records are documents with native BSON types, see encoding.DocumentEncoder.
+    """
+    for i in range(0, len(df), batch_size):
+        batch = df.iloc[i:i + batch_size]
+        yield encoder.encode(batch) if encoder else batch.to_dict('records')
+
+def raw_operations(records: List[Dict[str, Any]], rows: Iterator, source_id: Optional[str] = None) -> list:
+    """
+    The write operations storing raw records, rows are their row numbers in the source file.
+
+    Without a source_id the records are inserted. With one every record gets the _id
+    "<source_id>:<row>" and replaces the document with that _id, so storing the same rows again,
+    e.g. in a re-run or a resumed run, doesn't add a second copy.
+    """
+    if source_id is None:
+        return [InsertOne(record) for record in records]
+    operations = []
+    for record, row in zip(records, rows):
+        record["_id"] = f"{source_id}:{row}"
+        operations.append(ReplaceOne({"_id": record["_id"]}, record, upsert=True))
+    return operations
+
+def store_raw_data_to_mongo(db_name: str, collection_name: str, df: pd.DataFrame, client: MongoClient, batch_size: int,
+                            concurrency: int = 1, max_batch_bytes: Optional[int] = None,
+                            encoder: Optional[DocumentEncoder] = None, write_concern: Optional[WriteConcern] = None,
+                            source_id: Optional[str] = None) -> WriteStats:
     """
     Store raw data in MongoDB collection using bulk_write for efficiency.
+
+    With concurrency > 1 several unordered batches are written at once, see BulkWriter. With an
+    encoder the documents get native BSON types and, optionally, short field names. The
+    batches are written with write_concern, if given, e.g. w=1 and j=False for bulk loads.
+    With a source_id the writes are idempotent, the index of df must be the row numbers in the
+    source file (see raw_operations).
     """
     db = client[db_name]
-    collection = db[collection_name]
+    collection = db.get_collection(collection_name, write_concern=write_concern)
+    rows = iter(df.index)
     
-    # Convert DataFrame rows to a list of InsertOne operations
-    operations = [InsertOne(record) for record in df.to_dict('records')]
-    
-    # Batch and execute bulk writes
-    for i in range(0, len(operations), batch_size):
-        batch = operations[i:i + batch_size]
-        collection.bulk_write(batch)
+    # Batch and execute bulk writes, converting one batch of rows to operations at a time
+    with BulkWriter(collection, concurrency=concurrency, batch_size=batch_size, max_batch_bytes=max_batch_bytes) as writer:
+        for records in iter_record_batches(df, batch_size, encoder):
+            for record, operation in zip(records, raw_operations(records, rows, source_id)):
+                writer.add(operation, document=record)
+    return writer.stats
 
-def upsert_dataframe_to_mongo(db_name: str, collection_name: str, df: pd.DataFrame, client: MongoClient, match_field: str, batch_size: int = 1000) -> None:
+def upsert_dataframe_to_mongo(db_name: str, collection_name: str, df: pd.DataFrame, client: MongoClient, match_field: str, batch_size: int = 1000,
+                              concurrency: int = 1, max_batch_bytes: Optional[int] = None,
+                              encoder: Optional[DocumentEncoder] = None, write_concern: Optional[WriteConcern] = None) -> Optional[WriteStats]:
     """
     Upsert a DataFrame into a MongoDB collection in batches.
 
+    With concurrency > 1 several unordered batches are written at once, see BulkWriter.
+    Upserts of the same match_field value are still applied in DataFrame order.
+    With an encoder the documents get native BSON types and the fields a row has no value for
+    are unset, so an updated document never keeps a value its row no longer has.
+
     Args:
         db_name (str): The name of the database.
         collection_name (str): The name of the collection.
@@ -41,6 +106,13 @@ def upsert_dataframe_to_mongo(db_name: str, collection_name: str, df: pd.DataFra
         client (MongoClient): The MongoDB client.
         match_field (str): The field to match for upsert.
         batch_size (int): The size of each batch for upserts.
+        concurrency (int): The number of batches written at once.
+        max_batch_bytes (int): Optional max size of the documents in one batch.
+        encoder (DocumentEncoder): Optional encoder of the documents, without short field names.
+        write_concern (WriteConcern): Optional write concern of the upserts, the collection's by default.
+
+    Returns:
+        WriteStats: The number of documents written and docs/sec, None if the DataFrame is empty.
     """
     # Validate input
     if not isinstance(batch_size, int) or batch_size <= 0:
@@ -48,6 +120,9 @@ def upsert_dataframe_to_mongo(db_name: str, collection_name: str, df: pd.DataFra
     
     if match_field not in df.columns:
         raise ValueError(f"match_field '{match_field}' is not a valid column in the DataFrame.")
+
+    if encoder is not None and encoder.short_names:
+        raise ValueError("Short field names are only supported for raw collections, upserts match and query by column name.")
     
     if df.empty:
         logging.warning("The provided DataFrame is empty. No data to upsert.")
@@ -55,37 +130,37 @@ def upsert_dataframe_to_mongo(db_name: str, collection_name: str, df: pd.DataFra
     
     try:
         db = client[db_name]
-        collection = db[collection_name]
-
-        # Convert DataFrame to a list of dictionaries
-        records = df.to_dict("records")
+        collection = db.get_collection(collection_name, write_concern=write_concern)
 
-        # Prepare operations for bulk_write
-        operations = []
-        for record in records:
-            # Check if the match_field exists in the record
-            if match_field not in record:
-                logging.warning(f"Record {record} does not contain the match_field '{match_field}', skipping this record.")
-                continue  # Skip the record if match_field is missing
+        with BulkWriter(collection, concurrency=concurrency, batch_size=batch_size, max_batch_bytes=max_batch_bytes) as writer:
+            # Convert one batch of DataFrame rows to dictionaries at a time
+            fields = [encoder.field_name(column) for column in df.columns] if encoder else []
+            for records in iter_record_batches(df, batch_size, encoder):
+                for record in records:
+                    # Check if the match_field exists in the record
+                    if match_field not in record:
+                        logging.warning(f"Record {record} does not contain the match_field '{match_field}', skipping this record.")
+                        continue  # Skip the record if match_field is missing
 
-            query = {match_field: record[match_field]}
-            update = {"$set": record}
-            operations.append(UpdateOne(query, update, upsert=True))
-
-            # Perform bulk write when the batch size is reached
-            if len(operations) >= batch_size:
-                collection.bulk_write(operations)
-                operations = []  # Clear the operations list for the next batch
-
-        # If there are any remaining operations after the loop, execute them
-        if operations:
-            collection.bulk_write(operations)
+                    query = {match_field: record[match_field]}
+                    update = {"$set": record}
+                    unset = {field: "" for field in fields if field not in record}
+                    if unset:
+                        update["$unset"] = unset
+                    writer.add(UpdateOne(query, update, upsert=True), key=record[match_field], document=record)
+        return writer.stats
 
     except Exception as e:
         logging.error(f"An error occurred during upsert: {e}")
         raise  # Re-raise the exception after logging it
 
-def combine_orders_to_inventory_with_count(inventory: Collection) -> None:
+
+def combine_orders_to_inventory_with_count(inventory: Collection, batch_size: int = 1000) -> None:
+    """
+    Embeds every matching order into inventory.ordersDetails.
+
+    Documents grow with the number of orders, prefer combine_orders_to_inventory_with_aggregates.
+    """
     pipeline = [
         {
             "$lookup": {
@@ -101,25 +176,126 @@ def combine_orders_to_inventory_with_count(inventory: Collection) -> None:
             }
         }
     ]
-    # Execute the pipeline and update the collection
-    inventory_with_orders = list(inventory.aggregate(pipeline))
-    for item in inventory_with_orders:
-        inventory.update_one(
+    # Execute the pipeline and update the collection in batches
+    operations = []
+    for item in inventory.aggregate(pipeline):
+        operations.append(UpdateOne(
             {"_id": item["_id"]},
             {"$set": {"ordersDetails": item["ordersDetails"], "ordersDetailsCount": item["ordersDetailsCount"]}}
-        )
+        ))
+        if len(operations) >= batch_size:
+            inventory.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        inventory.bulk_write(operations, ordered=False)
+
+def combine_orders_to_inventory_with_aggregates(inventory: Collection, orders: Collection, include_order_ids: bool = False, use_merge: bool = False, batch_size: int = 1000, product_ids: Optional[Iterable] = None) -> None:
+    """
+    Enriches the inventory collection with precomputed per-product order aggregates.
+
+    Instead of embedding every order, each inventory document gets ordersDetailsCount,
+    ordersQuantity, firstOrderDate and lastOrderDate (and optionally the orderIds) computed
+    by one $group over the orders collection. Any embedded ordersDetails array is removed.
+
+    Args:
+        inventory (Collection): The MongoDB inventory collection.
+        orders (Collection): The MongoDB orders collection.
+        include_order_ids (bool): Also store the list of orderIds per product.
+        use_merge (bool): Write the aggregates server-side with $merge instead of bulk_write.
+            Requires MongoDB 4.2+ and the unique index on inventory.productId that
+            indexes.ensure_indexes creates.
+        batch_size (int): The size of each bulk_write batch.
+        product_ids (Iterable): Only recompute the aggregates of these products, default all.
+    """
+    if not isinstance(batch_size, int) or batch_size <= 0:
+        raise ValueError("batch_size must be a positive integer.")
+
+    if product_ids is not None:
+        product_ids = list(product_ids)
+    pipeline = order_aggregates_pipeline(product_ids, include_order_ids=include_order_ids)
+    aggregates = [field for field in pipeline[-1]["$group"] if field != "_id"]
+
+    if use_merge:
+        pipeline += [
+            {"$addFields": {"productId": "$_id"}},
+            {"$project": {"_id": 0}},
+            {
+                "$merge": {
+                    "into": inventory.name,
+                    "on": "productId",
+                    "whenMatched": [
+                        {"$set": {field: f"$$new.{field}" for field in aggregates}},
+                        {"$unset": "ordersDetails"}
+                    ],
+                    "whenNotMatched": "discard"  # Orders for unknown products don't create inventory
+                }
+            }
+        ]
+        orders.aggregate(pipeline)
+    else:
+        operations = []
+        for item in orders.aggregate(pipeline):
+            product_id = item.pop("_id")
+            operations.append(UpdateMany(
+                {"productId": product_id},
+                {"$set": item, "$unset": {"ordersDetails": ""}}
+            ))
+            if len(operations) >= batch_size:
+                inventory.bulk_write(operations, ordered=False)
+                operations = []
+        if operations:
+            inventory.bulk_write(operations, ordered=False)
+
+    # Products without any orders
+    inventory.update_many(
+        {"ordersDetailsCount": {"$exists": False}},
+        {"$set": {"ordersDetailsCount": 0, "ordersQuantity": 0}, "$unset": {"ordersDetails": ""}}
+    )
+    # Products that lost all their orders (e.g. an order moved to another product) aren't in the
+    # $group output, their old aggregates are reset
+    reset_products_without_orders(inventory, orders, product_ids, batch_size=batch_size)
+
+# Fields derived from the orders of a product, unset when it has none left
+PRODUCT_ORDER_FIELDS: list = ["firstOrderDate", "lastOrderDate", "orderIds", "ordersDetails", "totalQuantityOrdered", "InventoryBalanceAfterOrder"]
+
+def reset_products_without_orders(inventory: Collection, orders: Collection, product_ids: Optional[Iterable] = None,
+                                  batch_size: int = 1000) -> None:
+    """
+    Resets the order aggregates of products that have none of the orders anymore.
+
+    The candidates are product_ids, or every product with aggregates. Their orders are looked
+    up batch by batch with distinct on the productId index.
+    """
+    if product_ids is not None:
+        candidates = list(dict.fromkeys(product_ids))
+    else:
+        candidates = [item["productId"] for item in inventory.find({"ordersDetailsCount": {"$gt": 0}}, {"productId": 1})]
+    for i in range(0, len(candidates), batch_size):
+        batch = candidates[i:i + batch_size]
+        ordered = set(orders.distinct("productId", {"productId": {"$in": batch}}))
+        without_orders = [product_id for product_id in batch if product_id not in ordered]
+        if without_orders:
+            inventory.update_many(
+                {"productId": {"$in": without_orders}},
+                {"$set": {"ordersDetailsCount": 0, "ordersQuantity": 0}, "$unset": {field: "" for field in PRODUCT_ORDER_FIELDS}}
+            )
+
+def _unset_balance_without_orders(inventory: Collection, product_ids: Optional[List]) -> None:
+    """Unsets the balance of products without orders, like the ones that were never ordered."""
+    query = in_products({"$nor": [HAS_ORDERS_QUERY], "InventoryBalanceAfterOrder": {"$exists": True}}, product_ids)
+    inventory.update_many(query, {"$unset": {"totalQuantityOrdered": "", "InventoryBalanceAfterOrder": ""}})
 
 def total_quantity_per_product(inventory: Collection) -> list:
     pipeline = [
         {
-            "$unwind": "$ordersDetails"  # Unwind the orders details to flatten the structure
+            "$match": HAS_ORDERS_QUERY  # Only products that have been ordered
         },
         {
             "$group": {
                 "_id": "$productId",  # Group by productId
                 "Productname": {"$first": "$name"},
                 "InventoryQuantity": {"$first": "$quantity"},
-                "totalQuantityOrdered": {"$sum": "$ordersDetails.quantity"}  # Sum the quantity from orders
+                "totalQuantityOrdered": {"$sum": ORDERED_QUANTITY_EXPR}  # Sum the quantity from orders
             }
         },
         {
@@ -130,27 +306,12 @@ def total_quantity_per_product(inventory: Collection) -> list:
     result = list(inventory.aggregate(pipeline))
     return result
 
-def update_quantity_per_product(inventory: Collection) -> None:
-    pipeline = [
-        {
-            "$unwind": "$ordersDetails"  # Unwind the orders (breaks them to individual documents) details to flatten the structure
-        },
-        {
-            "$group": {
-                "_id": "$productId",  # Group by productId
-                "Productname": {"$first": "$name"},  # Get the first product name
-                "InventoryQuantity": {"$first": "$quantity"},  # Get the first inventory quantity
-                "totalQuantityOrdered": {"$sum": "$ordersDetails.quantity"}  # Sum the quantity from orders
-            }
-        },
-        {
-            "$addFields": {
-                "InventoryBalanceAfterOrder": {
-                    "$subtract": ["$InventoryQuantity", "$totalQuantityOrdered"]  # Calculate inventory balance
-                }
-            }
-        }
-    ]
+def update_quantity_per_product(inventory: Collection, product_ids: Optional[Iterable] = None) -> None:
+    # Only products that have been ordered, optionally limited to the given products
+    if product_ids is not None:
+        product_ids = list(product_ids)
+    _unset_balance_without_orders(inventory, product_ids)
+    pipeline = quantity_per_product_pipeline(product_ids)
 
     # Perform aggregation
     inventory_with_orders = list(inventory.aggregate(pipeline))
@@ -192,7 +353,122 @@ def get_inventory_with_negative_balance(inventory: Collection) -> list:
     return [{"productId": item["productId"], "productName": item["name"]} for item in negative_balance_inventory]
 
 
-def update_order_with_delivery_status(orders: Collection, inventory: Collection):
+def update_order_with_delivery_status(orders: Collection, inventory: Collection, batch_size: int = 1000, product_ids: Optional[Iterable] = None) -> dict:
+    """
+    Sets deliveryStatus on every order by allocating inventory to orders first-in-first-out.
+
+    Only products with a negative InventoryBalanceAfterOrder can have undeliverable orders, so
+    only their orders are read (once, sorted by productId and dateTime). Every other order is
+    marked "Delivered" with a single update_many, and the statuses of the short products' orders
+    are written back as batched update_many operations.
+
+    Args:
+        orders (Collection): The MongoDB orders collection.
+        inventory (Collection): The MongoDB inventory collection.
+        batch_size (int): Max number of order ids per update operation.
+        product_ids (Iterable): Only update the orders of these products, default all.
+
+    Returns:
+        dict: The number of orders per delivery status.
+    """
+    if not isinstance(batch_size, int) or batch_size <= 0:
+        raise ValueError("batch_size must be a positive integer.")
+
+    # Stock of the products that can't cover all their orders
+    if product_ids is not None:
+        product_ids = list(product_ids)
+    stock = {}
+    for item in inventory.find(in_products(SHORT_INVENTORY_QUERY, product_ids), {"productId": 1, "quantity": 1}):
+        product_id = item["productId"]
+        stock[product_id] = min(item["quantity"], stock.get(product_id, item["quantity"]))
+    short_products = list(stock)
+
+    # Orders of products with enough stock are all delivered
+    operations = [
+        UpdateMany(delivered_orders_query(short_products, product_ids), {"$set": {"deliveryStatus": DELIVERED}})
+    ]
+
+    # Read the orders of the short products once, oldest first within each product
+    cursor = orders.find(
+        {"productId": {"$in": short_products}},
+        {"productId": 1, "quantity": 1, "dateTime": 1}
+    ).sort([("productId", 1), ("dateTime", 1), ("_id", 1)])
+    short_orders = pd.DataFrame(list(cursor), columns=["_id", "productId", "quantity", "dateTime"])
+    status = allocate_delivery_status(short_orders, stock)
+
+    cannot_deliver = 0
+    for delivery_status in (DELIVERED, CANNOT_DELIVER):
+        ids = short_orders.loc[status == delivery_status, "_id"].tolist()
+        if delivery_status == CANNOT_DELIVER:
+            cannot_deliver = len(ids)
+        for i in range(0, len(ids), batch_size):
+            operations.append(
+                UpdateMany({"_id": {"$in": ids[i:i + batch_size]}}, {"$set": {"deliveryStatus": delivery_status}})
+            )
+
+    result = orders.bulk_write(operations, ordered=False)
+    summary = {DELIVERED: result.matched_count - cannot_deliver, CANNOT_DELIVER: cannot_deliver}
+    print(f"Delivery status updated: {summary[DELIVERED]} delivered, {summary[CANNOT_DELIVER]} can't be delivered")
+    return summary
+
+def merge_quantity_per_product(inventory: Collection, product_ids: Optional[Iterable] = None) -> None:
+    """
+    Server-side update_quantity_per_product: totalQuantityOrdered and InventoryBalanceAfterOrder
+    are computed and written back with $merge, no document is sent to or from the client.
+
+    Requires MongoDB 4.4+ ($merge into the collection being aggregated). Like the processed
+    collection, productId is expected to be unique.
+
+    Args:
+        inventory (Collection): The MongoDB inventory collection, enriched with the order aggregates.
+        product_ids (Iterable): Only update these products, default all.
+    """
+    if product_ids is not None:
+        product_ids = list(product_ids)
+    _unset_balance_without_orders(inventory, product_ids)
+    inventory.aggregate(merge_quantity_pipeline(inventory.name, product_ids))
+
+def merge_order_delivery_status(orders: Collection, inventory: Collection, product_ids: Optional[Iterable] = None) -> dict:
+    """
+    Server-side update_order_with_delivery_status: the first-in-first-out allocation runs as a
+    $setWindowFields running sum and the statuses are written back with $merge.
+
+    The running sum of ordered quantity per product, oldest order first (ties broken by _id like
+    allocate_delivery_status), is compared to the stock of the products with a negative
+    InventoryBalanceAfterOrder. Only the counts per status are returned to the client, so the
+    wall time doesn't depend on the latency to the server.
+
+    Requires MongoDB 5.0+ ($setWindowFields and $lookup with localField and pipeline).
+
+    Args:
+        orders (Collection): The MongoDB orders collection.
+        inventory (Collection): The MongoDB inventory collection, with InventoryBalanceAfterOrder.
+        product_ids (Iterable): Only update the orders of these products, default all.
+
+    Returns:
+        dict: The number of orders per delivery status.
+    """
+    if product_ids is not None:
+        product_ids = list(product_ids)
+    match = in_products({}, product_ids)
+    orders.aggregate(merge_delivery_status_pipeline(orders.name, inventory.name, product_ids), allowDiskUse=True)
+
+    # Only the counts come back
+    counts = {item["_id"]: item["count"] for item in orders.aggregate([
+        {"$match": match},
+        {"$group": {"_id": "$deliveryStatus", "count": {"$sum": 1}}}
+    ])}
+    summary = {DELIVERED: counts.get(DELIVERED, 0), CANNOT_DELIVER: counts.get(CANNOT_DELIVER, 0)}
+    print(f"Delivery status updated: {summary[DELIVERED]} delivered, {summary[CANNOT_DELIVER]} can't be delivered")
+    return summary
+
+def update_order_with_delivery_status_legacy(orders: Collection, inventory: Collection):
+    """
+    Per-order reference implementation of update_order_with_delivery_status.
+
+    Issues one query per short product and one update per order. Kept to verify
+    and benchmark the bulk implementation against.
+    """
     # Fetch inventory data as a dictionary with productId as the key
     inventory_data = [
         {
@@ -227,7 +503,7 @@ def update_order_with_delivery_status(orders: Collection, inventory: Collection)
                     )
                     updated_orders.append(order['_id'])
 
-                    print(f"Order with Id: {order['_id']} can't be delivered, database is updated")
+                    logging.debug(f"Order with Id: {order['_id']} can't be delivered, database is updated")
     
     orders_to_update = orders.find({"_id": {"$nin": updated_orders}})  # Exclude orders in updated_orders
             
@@ -237,7 +513,7 @@ def update_order_with_delivery_status(orders: Collection, inventory: Collection)
             {"_id": order["_id"]},  # Match by order ID
             {"$set": {"deliveryStatus": "Delivered"}}
         )
-        print(f"Order with Id: {order['_id']} has been delivered, database is updated")
+        logging.debug(f"Order with Id: {order['_id']} has been delivered, database is updated")
 
 def get_inventory_with_highest_order(inventory: Collection) -> dict:
     """
@@ -249,17 +525,17 @@ def get_inventory_with_highest_order(inventory: Collection) -> dict:
     Returns:
         dict: The inventory item with the highest total order quantity.
     """
-    # Aggregation pipeline to summarize ordersDetails.quantity for each inventory
+    # Aggregation pipeline to summarize the ordered quantity for each inventory
     pipeline = [
-        # Unwind ordersDetails to access individual quantities
-        {"$unwind": "$ordersDetails"},
+        # Only products that have been ordered
+        {"$match": HAS_ORDERS_QUERY},
         
         # Group by productId and calculate the total order quantity
         {
             "$group": {
                 "_id": "$productId",  # Group by productId
                 "productName": {"$first": "$name"},  # Include productName
-                "totalOrderQuantity": {"$sum": "$ordersDetails.quantity"},  # Summarize quantities
+                "totalOrderQuantity": {"$sum": ORDERED_QUANTITY_EXPR},  # Summarize quantities
             }
         },
         
@@ -276,64 +552,34 @@ def get_inventory_with_highest_order(inventory: Collection) -> dict:
     # Return the top result (or None if no results)
     return result[0] if result else None
 
-def summarize_cannot_deliver_orders(orders_collection: Collection) -> dict:
+def summarize_orders_by_status(orders_collection: Collection, status: str) -> dict:
     """
-    Counts the number of orders with deliveryStatus = "Cannot Deliver" and sums the amount for these orders.
-    
+    Counts the number of orders with the given deliveryStatus and sums the amount for these orders.
+
+    Both values come from a single $group. See reporting.delivery_summaries for all statuses at once.
+
     Args:
         orders_collection (Collection): The MongoDB orders collection.
-        
+        status (str): The deliveryStatus, e.g. DELIVERED.
+
     Returns:
         dict: A dictionary containing the count of orders and the total amount.
     """
-    # MongoDB query to match orders with deliveryStatus = "Cannot Deliver"
-    query = {"deliveryStatus": "Cannot Deliver"}
-    
-    # Count the number of matching documents
-    count = orders_collection.count_documents(query)
-    
-    # Aggregate to calculate the total amount
     pipeline = [
-        {"$match": query},  # Filter documents matching the query
-        {"$group": {"_id": None, "totalAmount": {"$sum": "$amount"}}}  # Sum the amount field
+        {"$match": {"deliveryStatus": status}},  # Filter documents matching the status
+        {"$group": {"_id": None, "count": {"$sum": 1}, "totalAmount": {"$sum": "$amount"}}}  # Count and sum the amount field
     ]
-    
-    # Execute the aggregation pipeline
     result = list(orders_collection.aggregate(pipeline))
-    total_amount = result[0]["totalAmount"] if result else 0
-    
+
     return {
-        "count": count,
-        "totalAmount": total_amount
+        "count": result[0]["count"] if result else 0,
+        "totalAmount": decimal_to_float(result[0]["totalAmount"]) if result else 0
     }
 
+def summarize_cannot_deliver_orders(orders_collection: Collection) -> dict:
+    """Counts the orders that can't be delivered and sums their amount."""
+    return summarize_orders_by_status(orders_collection, CANNOT_DELIVER)
+
 def summarize_delivered_orders(orders_collection: Collection) -> dict:
-    """
-    Counts the number of orders with deliveryStatus = "Delivered" and sums the amount for these orders.
-    
-    Args:
-        orders_collection (Collection): The MongoDB orders collection.
-        
-    Returns:
-        dict: A dictionary containing the count of orders and the total amount.
-    """
-    # MongoDB query to match orders with deliveryStatus = "Delivered"
-    query = {"deliveryStatus": "Delivered"}
-    
-    # Count the number of matching documents
-    count = orders_collection.count_documents(query)
-    
-    # Aggregate to calculate the total amount
-    pipeline = [
-        {"$match": query},  # Filter documents matching the query
-        {"$group": {"_id": None, "totalAmount": {"$sum": "$amount"}}}  # Sum the amount field
-    ]
-    
-    # Execute the aggregation pipeline
-    result = list(orders_collection.aggregate(pipeline))
-    total_amount = result[0]["totalAmount"] if result else 0
-    
-    return {
-        "count": count,
-        "totalAmount": total_amount
-    }
+    """Counts the delivered orders and sums their amount."""
+    return summarize_orders_by_status(orders_collection, DELIVERED)
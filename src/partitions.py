@@ -0,0 +1,170 @@
+import gzip
+import logging
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+import bson
+import pandas as pd
+from pymongo import ReturnDocument
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+# The raw collections stored in monthly partitions and the column that picks the month: the
+# orders by their dateTime, inventory snapshots (None) by the month their file was first stored in
+PARTITIONED_COLLECTIONS: Dict[str, Optional[str]] = {"raw_orders": "dateTime", "raw_inventory": None}
+
+# Suffix of a partition that is being archived, new writes of its month go to a new partition
+ARCHIVING_SUFFIX: str = "_archiving"
+
+class ArchivedPartition(NamedTuple):
+    """A partition written to an archive file and dropped from the database."""
+    collection: str
+    path: str
+    documents: int
+    bytes_written: int
+
+def partition_name(collection_name: str, month: datetime) -> str:
+    """The collection of the month, e.g. raw_orders_202302."""
+    return f"{collection_name}_{month:%Y%m}"
+
+def _month_start(when: datetime) -> datetime:
+    return datetime(when.year, when.month, 1)
+
+def _next_month(month: datetime) -> datetime:
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+def split_by_month(df: pd.DataFrame, column: Optional[str] = None, now: Optional[datetime] = None) -> Iterator[Tuple[datetime, pd.DataFrame]]:
+    """
+    Splits rows by the UTC month of column, or all of them into the current month without column.
+
+    Rows without a valid date go to the current month. The index is kept, so the raw rows keep
+    their row numbers (see mongodb_utils.raw_operations).
+    """
+    current = _month_start(now or datetime.now(timezone.utc).replace(tzinfo=None))
+    if column is None or column not in df.columns:
+        yield current, df
+        return
+    dates = pd.to_datetime(df[column], format="ISO8601", utc=True, errors="coerce")
+    months = dates.dt.tz_localize(None).dt.to_period("M").dt.to_timestamp().fillna(pd.Timestamp(current))
+    for month, rows in df.groupby(months, sort=True):
+        yield month.to_pydatetime(), rows
+
+def list_partitions(db: Database, collection_name: str) -> List[Tuple[str, datetime]]:
+    """The partitions of a collection and their months, oldest first."""
+    pattern = re.compile(rf"^{re.escape(collection_name)}_(\d{{4}})(\d{{2}})$")
+    partitions = []
+    for name in db.list_collection_names():
+        match = pattern.match(name)
+        if match:
+            partitions.append((name, datetime(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+def source_month(sources: Collection, source_id: str, now: Optional[datetime] = None) -> datetime:
+    """
+    The month a source file was first stored in, recorded in sources on its first call.
+
+    Rows without a date go to the partition of this month, so storing the same file again in a
+    later month replaces its documents (see checkpoint.source_id) instead of adding a copy.
+    """
+    current = _month_start(now or datetime.now(timezone.utc).replace(tzinfo=None))
+    doc = sources.find_one_and_update({"_id": source_id}, {"$setOnInsert": {"month": current}},
+                                      upsert=True, return_document=ReturnDocument.AFTER)
+    return doc["month"]
+
+def partitions_between(db: Database, collection_name: str, start: Optional[datetime] = None,
+                       end: Optional[datetime] = None) -> List[str]:
+    """The partitions with data from start (inclusive) to end (exclusive), the only ones a query of that range has to read."""
+    return [name for name, month in list_partitions(db, collection_name)
+            if (start is None or _next_month(month) > start) and (end is None or month < end)]
+
+def find_partitioned(db: Database, collection_name: str, query: Optional[dict] = None, start: Optional[datetime] = None,
+                     end: Optional[datetime] = None, field: str = "dateTime", projection: Optional[dict] = None,
+                     partitioned: bool = True) -> Iterator[dict]:
+    """
+    The documents from start to end that match query, with field in that range.
+
+    Only the partitions of the range are read, or the collection itself if it isn't partitioned.
+    """
+    query = dict(query or {})
+    time_range = {**({"$gte": start} if start else {}), **({"$lt": end} if end else {})}
+    if time_range:
+        query[field] = time_range
+    names = partitions_between(db, collection_name, start, end) if partitioned else [collection_name]
+    for name in names:
+        yield from db[name].find(query, projection)
+
+def archive_collection(collection: Collection, path: str, batch_size: int = 10_000) -> int:
+    """
+    Writes every document of a collection to a gzip-compressed BSON file, in _id order.
+
+    The file can be restored with `mongorestore --gzip` or restore_archive. It is written under
+    a temporary name and renamed once complete, so an archive file is never partial.
+
+    Returns:
+        int: The number of documents written.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    documents = 0
+    with open(tmp_path, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+            for document in collection.find({}, batch_size=batch_size).sort("_id", 1):
+                f.write(bson.encode(document))
+                documents += 1
+        # The collection is dropped next, the archive must be on disk first
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp_path, path)
+    return documents
+
+def read_archive(path: str) -> Iterator[dict]:
+    """The documents of an archive file, see archive_collection."""
+    with gzip.open(path, "rb") as f:
+        yield from bson.decode_file_iter(f)
+
+def restore_archive(collection: Collection, path: str, batch_size: int = 1000) -> int:
+    """Inserts the documents of an archive file into a collection, e.g. to query an archived month again."""
+    restored, batch = 0, []
+    for document in read_archive(path):
+        batch.append(document)
+        if len(batch) == batch_size:
+            restored += len(collection.insert_many(batch, ordered=False).inserted_ids)
+            batch = []
+    if batch:
+        restored += len(collection.insert_many(batch, ordered=False).inserted_ids)
+    return restored
+
+def _archive_partition(db: Database, name: str, collection_name: str, folder: str) -> ArchivedPartition:
+    """Archives and drops a renamed partition."""
+    partition = name[:-len(ARCHIVING_SUFFIX)]
+    path = os.path.join(folder, collection_name, f"{partition}-{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}.bson.gz")
+    documents = archive_collection(db[name], path)
+    db[name].drop()
+    logging.info(f"Archived {documents} documents of {partition} to {path} ({os.path.getsize(path)} bytes)")
+    return ArchivedPartition(partition, path, documents, os.path.getsize(path))
+
+def archive_partitions(db: Database, collection_name: str, retention_days: int, folder: str,
+                       now: Optional[datetime] = None) -> List[ArchivedPartition]:
+    """
+    Moves the partitions of a collection that ended more than retention_days ago to archive files.
+
+    A partition is first renamed, so writes of late data for its month start a new partition
+    instead of being lost, then written to <folder>/<collection>/<partition>-<timestamp>.bson.gz
+    and dropped. A partition left renamed by an interrupted run is archived first.
+
+    Args:
+        now (datetime): The current time, naive UTC like the partition months.
+
+    Returns:
+        List[ArchivedPartition]: The archived partitions.
+    """
+    cutoff = (now or datetime.now(timezone.utc).replace(tzinfo=None)) - timedelta(days=retention_days)
+    leftovers = [name for name in db.list_collection_names()
+                 if name.endswith(ARCHIVING_SUFFIX) and re.fullmatch(rf"{re.escape(collection_name)}_\d{{6}}", name[:-len(ARCHIVING_SUFFIX)])]
+    archived = [_archive_partition(db, name, collection_name, folder) for name in sorted(leftovers)]
+    for name, month in list_partitions(db, collection_name):
+        if _next_month(month) <= cutoff:
+            db[name].rename(name + ARCHIVING_SUFFIX)
+            archived.append(_archive_partition(db, name + ARCHIVING_SUFFIX, collection_name, folder))
+    return archived
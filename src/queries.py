@@ -0,0 +1,130 @@
+from typing import Any, List, Optional
+from bson import Decimal128
+
+# Shared by the enrichment, the report and the query plan diagnostics (see indexes.py). Kept free
+# from pandas, so the report can be run without loading it (see cli.py)
+
+# The deliveryStatus values of the first-in-first-out allocation
+DELIVERED: str = "Delivered"
+CANNOT_DELIVER: str = "Cannot Deliver"
+
+# Inventory documents that have at least one order, in either enrichment mode. Documents with
+# embedded orders but without ordersDetailsCount are from before it was stored; both branches
+# bound ordersDetailsCount, so the whole $or can use its index
+HAS_ORDERS_QUERY: dict = {"$or": [
+    {"ordersDetailsCount": {"$gt": 0}},
+    {"ordersDetailsCount": {"$exists": False}, "ordersDetails.0": {"$exists": True}},
+]}
+
+# Ordered quantity of an inventory document, from the aggregates or else from the embedded orders
+ORDERED_QUANTITY_EXPR: dict = {"$ifNull": ["$ordersQuantity", {"$sum": "$ordersDetails.quantity"}]}
+
+# Inventory documents whose stock can't cover all their orders
+SHORT_INVENTORY_QUERY: dict = {"InventoryBalanceAfterOrder": {"$lt": 0}}
+
+def decimal_to_float(value: Any) -> Any:
+    """Converts a Decimal128, e.g. a $sum of amounts, to a float. Other values are returned as they are."""
+    return float(value.to_decimal()) if isinstance(value, Decimal128) else value
+
+def in_products(query: dict, product_ids: Optional[List]) -> dict:
+    """query limited to the given products, or query itself for every product (None)."""
+    return query if product_ids is None else {**query, "productId": {"$in": product_ids}}
+
+def order_aggregates_pipeline(product_ids: Optional[List] = None, include_order_ids: bool = False) -> list:
+    """The $group of the per-product order aggregates over the orders collection."""
+    aggregates = {
+        "ordersDetailsCount": {"$sum": 1},  # Count the connected orders
+        "ordersQuantity": {"$sum": "$quantity"},  # Sum the ordered quantity
+        "firstOrderDate": {"$min": "$dateTime"},
+        "lastOrderDate": {"$max": "$dateTime"},
+    }
+    if include_order_ids:
+        aggregates["orderIds"] = {"$push": "$orderId"}
+    pipeline = [{"$group": {"_id": "$productId", **aggregates}}]
+    if product_ids is not None:
+        pipeline.insert(0, {"$match": in_products({}, product_ids)})
+    return pipeline
+
+def quantity_per_product_pipeline(product_ids: Optional[List] = None) -> list:
+    """The ordered quantity and the inventory balance of the ordered products, over the inventory collection."""
+    return [
+        {
+            "$match": in_products(HAS_ORDERS_QUERY, product_ids)  # Only products that have been ordered
+        },
+        {
+            "$group": {
+                "_id": "$productId",  # Group by productId
+                "Productname": {"$first": "$name"},  # Get the first product name
+                "InventoryQuantity": {"$first": "$quantity"},  # Get the first inventory quantity
+                "totalQuantityOrdered": {"$sum": ORDERED_QUANTITY_EXPR}  # Sum the quantity from orders
+            }
+        },
+        {
+            "$addFields": {
+                "InventoryBalanceAfterOrder": {
+                    "$subtract": ["$InventoryQuantity", "$totalQuantityOrdered"]  # Calculate inventory balance
+                }
+            }
+        }
+    ]
+
+def merge_quantity_pipeline(inventory_name: str, product_ids: Optional[List] = None) -> list:
+    """quantity_per_product_pipeline written back into the inventory collection with $merge."""
+    return [
+        {"$match": in_products(HAS_ORDERS_QUERY, product_ids)},
+        {
+            "$project": {
+                "totalQuantityOrdered": ORDERED_QUANTITY_EXPR,
+                "InventoryBalanceAfterOrder": {"$subtract": ["$quantity", ORDERED_QUANTITY_EXPR]}
+            }
+        },
+        {"$merge": {"into": inventory_name, "on": "_id", "whenMatched": "merge", "whenNotMatched": "discard"}}
+    ]
+
+def delivered_orders_query(short_products: List, product_ids: Optional[List] = None) -> dict:
+    """The orders of the products with enough stock, every one of them is delivered."""
+    if product_ids is None:
+        return {"productId": {"$nin": short_products}}
+    short = set(short_products)
+    return {"productId": {"$in": [product_id for product_id in product_ids if product_id not in short]}}
+
+def merge_delivery_status_pipeline(orders_name: str, inventory_name: str, product_ids: Optional[List] = None) -> list:
+    """The first-in-first-out allocation as a $setWindowFields running sum, written back with $merge."""
+    # Stock of the product if it can't cover all its orders, otherwise null
+    stock = {"$min": "$stock.quantity"}
+    return [
+        {"$match": in_products({}, product_ids)},
+        {
+            "$setWindowFields": {
+                "partitionBy": "$productId",
+                "sortBy": {"dateTime": 1, "_id": 1},
+                "output": {
+                    "orderedQuantity": {"$sum": "$quantity", "window": {"documents": ["unbounded", "current"]}}
+                }
+            }
+        },
+        {
+            "$lookup": {
+                "from": inventory_name,
+                "localField": "productId",
+                "foreignField": "productId",
+                "pipeline": [
+                    {"$match": SHORT_INVENTORY_QUERY},
+                    {"$project": {"_id": 0, "quantity": 1}}
+                ],
+                "as": "stock"
+            }
+        },
+        {
+            "$project": {
+                "deliveryStatus": {
+                    "$cond": [
+                        {"$and": [{"$ne": [stock, None]}, {"$gt": ["$orderedQuantity", stock]}]},
+                        CANNOT_DELIVER,
+                        DELIVERED
+                    ]
+                }
+            }
+        },
+        {"$merge": {"into": orders_name, "on": "_id", "whenMatched": "merge", "whenNotMatched": "discard"}}
+    ]
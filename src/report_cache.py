@@ -0,0 +1,269 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional
+from bson import json_util
+from pymongo import IndexModel, UpdateOne
+from pymongo.collection import Collection
+
+try:
+    from .reporting import DeliverySummary, InventoryReport, PipelineReport
+except ImportError:
+    from reporting import DeliverySummary, InventoryReport, PipelineReport
+
+# The result types that can be stored persistently besides lists, dicts with str keys and BSON
+# values. Stored entries are data, decoding one never runs code of the shared store
+REPORT_TYPES: Dict[str, type] = {cls.__name__: cls for cls in (PipelineReport, InventoryReport, DeliverySummary)}
+TYPE_FIELD: str = "__reportType__"
+
+def _is_collection(value: Any) -> bool:
+    """Whether an argument is a collection, pymongo's or mongomock's."""
+    return hasattr(value, "full_name") and hasattr(value, "aggregate")
+
+class DataVersions:
+    """
+    A version number per collection, kept in a small collection and bumped by every write path.
+
+    Cached results remember the versions of the collections they were computed from, a write
+    bumps the version and so makes them stale. Writes from outside the pipeline must bump the
+    versions as well, or rely on the TTL of the cache.
+    """
+
+    def __init__(self, collection: Collection):
+        self.collection = collection
+
+    def get(self, names: Iterable[str]) -> Dict[str, int]:
+        """The current versions, 0 for collections that were never bumped."""
+        names = sorted(set(names))
+        found = {doc["_id"]: doc["version"] for doc in self.collection.find({"_id": {"$in": names}})}
+        return {name: found.get(name, 0) for name in names}
+
+    def bump(self, *names: str) -> None:
+        """Records that the collections were written to."""
+        if names:
+            now = datetime.now(timezone.utc)
+            self.collection.bulk_write([UpdateOne({"_id": name}, {"$inc": {"version": 1}, "$set": {"updatedAt": now}}, upsert=True)
+                                        for name in sorted(set(names))], ordered=False)
+
+class CacheEntry(NamedTuple):
+    """A cached result and the data versions it was computed from."""
+    versions: Dict[str, int]
+    value: Any
+    expires_at: Optional[float] = None  # time.time(), None if it doesn't expire
+
+    def is_valid(self, versions: Dict[str, int], now: float) -> bool:
+        return self.versions == versions and (self.expires_at is None or now < self.expires_at)
+
+def encode_value(value: Any) -> Any:
+    """A result as a BSON document value, report types are tagged with their name (see REPORT_TYPES)."""
+    if isinstance(value, tuple) and type(value).__name__ in REPORT_TYPES:
+        if REPORT_TYPES[type(value).__name__]._fields != value._fields:
+            raise TypeError(f"Cannot store a {type(value).__qualname__}, only the report types of REPORT_TYPES.")
+        return {TYPE_FIELD: type(value).__name__, **{field: encode_value(item) for field, item in value._asdict().items()}}
+    if isinstance(value, (list, tuple)):
+        return [encode_value(item) for item in value]
+    if isinstance(value, dict):
+        if not all(isinstance(key, str) for key in value) or TYPE_FIELD in value:
+            raise TypeError(f"Cannot store a dict with keys {list(value)}, keys must be strings other than {TYPE_FIELD}.")
+        return {key: encode_value(item) for key, item in value.items()}
+    if isinstance(value, (bytes, set, frozenset)) or callable(value):
+        raise TypeError(f"Cannot store a value of type {type(value).__qualname__}.")
+    return value
+
+def decode_value(value: Any) -> Any:
+    """The result of an encode_value value."""
+    if isinstance(value, list):
+        return [decode_value(item) for item in value]
+    if isinstance(value, dict):
+        decoded = {key: decode_value(item) for key, item in value.items() if key != TYPE_FIELD}
+        if TYPE_FIELD not in value:
+            return decoded
+        if value[TYPE_FIELD] not in REPORT_TYPES:
+            raise ValueError(f"Unknown report type '{value[TYPE_FIELD]}'")
+        return REPORT_TYPES[value[TYPE_FIELD]](**decoded)
+    if isinstance(value, bytes):
+        raise ValueError("Binary values aren't report results")
+    return value
+
+class MongoCacheStore:
+    """Cached results in a collection, shared by every process using the database. Expired entries are removed by a TTL index."""
+
+    def __init__(self, collection: Collection):
+        self.collection = collection
+        self.collection.create_indexes([IndexModel([("expiresAt", 1)], expireAfterSeconds=0)])
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        doc = self.collection.find_one({"_id": key})
+        if doc is None:
+            return None
+        expires_at = doc.get("expiresAt")
+        try:
+            value = decode_value(doc["value"])
+        except (TypeError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable report cache entry {key}: {e}")
+            return None
+        return CacheEntry(doc["versions"], value, expires_at.replace(tzinfo=timezone.utc).timestamp() if expires_at else None)
+
+    def put(self, key: str, query: str, entry: CacheEntry) -> None:
+        expires_at = datetime.fromtimestamp(entry.expires_at, timezone.utc) if entry.expires_at is not None else None
+        self.collection.replace_one({"_id": key}, {"_id": key, "query": query, "versions": entry.versions,
+                                                   "value": encode_value(entry.value), "expiresAt": expires_at}, upsert=True)
+
+class FileCacheStore:
+    """Cached results as JSON files (MongoDB Extended JSON) in a folder, for runs on one host."""
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.folder, f"{key}.json")
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                doc = json_util.loads(f.read())
+            return CacheEntry(doc["versions"], decode_value(doc["value"]), doc["expiresAt"])
+        except FileNotFoundError:
+            return None
+        except (KeyError, TypeError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable report cache file {self._path(key)}: {e}")
+            return None
+
+    def put(self, key: str, query: str, entry: CacheEntry) -> None:
+        # Replace the file at once so a concurrent run never reads half of it
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        document = {"query": query, "versions": entry.versions, "value": encode_value(entry.value), "expiresAt": entry.expires_at}
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json_util.dumps(document))
+        os.replace(tmp_path, path)
+
+def open_store(kind: str, collection: Collection, folder: str):
+    """The persistent store of a cache kind: "mongo" (in collection), "file" (JSON files in folder), otherwise None."""
+    if kind == "mongo":
+        return MongoCacheStore(collection)
+    if kind == "file":
+        return FileCacheStore(folder)
+    return None
+
+class CacheStats(NamedTuple):
+    """How the report calls were served."""
+    hits: int = 0  # From the in-process tier
+    persistent_hits: int = 0  # From the persistent store
+    misses: int = 0  # Computed, the result was missing, expired or of older data
+    evictions: int = 0  # Removed from the in-process tier to stay within max_entries
+
+    @property
+    def hit_ratio(self) -> float:
+        calls = self.hits + self.persistent_hits + self.misses
+        return (self.hits + self.persistent_hits) / calls if calls else 0.0
+
+class ReportCache:
+    """
+    Caches the results of report functions by query and data version.
+
+    A call is keyed on the function and its arguments, collections by their full name. Its
+    result is served from the in-process LRU tier, then from the persistent store (optional,
+    see MongoCacheStore and FileCacheStore), as long as the versions of the collections in the
+    arguments are unchanged (see DataVersions) and it is younger than ttl seconds. Checking
+    the versions costs one small query, the report collections aren't read at all. One entry
+    is kept per query, a newer result replaces it.
+
+    Results are stored persistently as data, not pickled: lists, dicts with str keys, BSON
+    values and the report types of REPORT_TYPES (see encode_value). Others raise a TypeError.
+
+    Usage:
+        versions = DataVersions(db["data_versions"])
+        cache = ReportCache(versions, ttl=3600, store=MongoCacheStore(db["report_cache"]))
+        report = cache.call(build_report, db["inventory"], db["orders"])
+        ...
+        versions.bump("orders")  # By the write paths
+    """
+
+    def __init__(self, versions: DataVersions, max_entries: int = 128, ttl: Optional[float] = None, store=None):
+        if max_entries <= 0:
+            raise ValueError("max_entries must be a positive integer.")
+        self.versions = versions
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.store = store
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._counts = {field: 0 for field in CacheStats._fields}
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(**self._counts)
+
+    def _count(self, field: str) -> None:
+        with self._lock:
+            self._counts[field] += 1
+
+    def _remember(self, key: str, entry: CacheEntry) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counts["evictions"] += 1
+
+    def call(self, function: Callable, *args, **kwargs) -> Any:
+        """Returns function(*args, **kwargs), from the cache if the collections in the arguments are unchanged."""
+        arguments = [arg.full_name if _is_collection(arg) else repr(arg) for arg in args]
+        arguments += [f"{name}={value.full_name if _is_collection(value) else repr(value)}" for name, value in sorted(kwargs.items())]
+        query = f"{function.__module__}.{function.__qualname__}({', '.join(arguments)})"
+        key = hashlib.sha256(query.encode()).hexdigest()
+        versions = self.versions.get(arg.name for arg in (*args, *kwargs.values()) if _is_collection(arg))
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.is_valid(versions, now):
+                self._entries.move_to_end(key)
+                self._counts["hits"] += 1
+                return entry.value
+
+        if self.store is not None:
+            entry = self.store.get(key)
+            if entry is not None and entry.is_valid(versions, now):
+                self._remember(key, entry)
+                self._count("persistent_hits")
+                return entry.value
+
+        self._count("misses")
+        entry = CacheEntry(versions, function(*args, **kwargs), now + self.ttl if self.ttl else None)
+        self._remember(key, entry)
+        if self.store is not None:
+            self.store.put(key, query, entry)
+        return entry.value
+
+    def clear(self) -> None:
+        """Drops the in-process tier, e.g. after writes that didn't bump the versions."""
+        with self._lock:
+            self._entries.clear()
+
+    def log_stats(self) -> None:
+        """Logs the stats as a JSON line, like the stage metrics."""
+        stats = self.stats
+        logging.info(json.dumps({"event": "report_cache", **stats._asdict(), "hit_ratio": round(stats.hit_ratio, 3)}))
+
+    def openmetrics(self) -> List[str]:
+        """The stats as OpenMetrics counters, see Instrumentation.openmetrics."""
+        stats = self.stats
+        return [
+            "# HELP pipeline_report_cache_calls Report calls by how they were served.",
+            "# TYPE pipeline_report_cache_calls counter",
+            f'pipeline_report_cache_calls_total{{result="hit"}} {stats.hits}',
+            f'pipeline_report_cache_calls_total{{result="persistent_hit"}} {stats.persistent_hits}',
+            f'pipeline_report_cache_calls_total{{result="miss"}} {stats.misses}',
+            "# HELP pipeline_report_cache_evictions Entries evicted from the in-process tier.",
+            "# TYPE pipeline_report_cache_evictions counter",
+            f"pipeline_report_cache_evictions_total {stats.evictions}",
+        ]
@@ -0,0 +1,121 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional
+from pymongo.collection import Collection
+
+try:
+    from .queries import DELIVERED, CANNOT_DELIVER, HAS_ORDERS_QUERY, ORDERED_QUANTITY_EXPR, SHORT_INVENTORY_QUERY, decimal_to_float
+except ImportError:
+    from queries import DELIVERED, CANNOT_DELIVER, HAS_ORDERS_QUERY, ORDERED_QUANTITY_EXPR, SHORT_INVENTORY_QUERY, decimal_to_float
+
+class DeliverySummary(NamedTuple):
+    """Number of orders with one delivery status and their total amount."""
+    count: int = 0
+    total_amount: float = 0
+
+class InventoryReport(NamedTuple):
+    """The inventory part of the report."""
+    best_selling_product: Optional[dict]  # productId, productName and totalOrderQuantity, None without orders
+    negative_balance: List[dict]  # productId and productName of the products to fill up
+
+class PipelineReport(NamedTuple):
+    """The end of run report."""
+    inventory: InventoryReport
+    deliveries: Dict[str, DeliverySummary]  # By deliveryStatus
+
+    @property
+    def delivered(self) -> DeliverySummary:
+        return self.deliveries.get(DELIVERED, DeliverySummary())
+
+    @property
+    def cannot_deliver(self) -> DeliverySummary:
+        return self.deliveries.get(CANNOT_DELIVER, DeliverySummary())
+
+# The best selling product, the only row of the aggregation. The sort is followed by the limit,
+# so the server only keeps the top row in memory, however many products were ordered
+BEST_SELLING_PIPELINE: list = [
+    {"$match": HAS_ORDERS_QUERY},
+    {
+        "$group": {
+            "_id": "$productId",
+            "Productname": {"$first": "$name"},
+            "InventoryQuantity": {"$first": "$quantity"},
+            "totalQuantityOrdered": {"$sum": ORDERED_QUANTITY_EXPR}
+        }
+    },
+    {"$sort": {"totalQuantityOrdered": -1, "_id": 1}},  # Ties by productId, so the report is deterministic
+    {"$limit": 1}
+]
+
+# The products to fill up, on the InventoryBalanceAfterOrder index
+NEGATIVE_BALANCE_PIPELINE: list = [
+    {"$match": SHORT_INVENTORY_QUERY},
+    {"$project": {"_id": 0, "productId": 1, "productName": "$name"}}
+]
+
+# The orders and their total amount per deliveryStatus, one $group over the orders collection
+DELIVERY_SUMMARY_PIPELINE: list = [
+    {"$match": {"deliveryStatus": {"$exists": True}}},
+    {"$group": {"_id": "$deliveryStatus", "count": {"$sum": 1}, "totalAmount": {"$sum": "$amount"}}}
+]
+
+def inventory_report_from(best_selling: List[dict], negative_balance: List[dict]) -> InventoryReport:
+    """The inventory report from the results of BEST_SELLING_PIPELINE and NEGATIVE_BALANCE_PIPELINE."""
+    best_selling_product = None
+    if best_selling:
+        best_selling_product = {
+            "productId": best_selling[0]["_id"],
+            "productName": best_selling[0]["Productname"],
+            "totalOrderQuantity": best_selling[0]["totalQuantityOrdered"],
+        }
+    return InventoryReport(best_selling_product, negative_balance)
+
+def delivery_summaries_from(items: Iterable[dict]) -> Dict[str, DeliverySummary]:
+    """The delivery summaries from the results of DELIVERY_SUMMARY_PIPELINE."""
+    return {item["_id"]: DeliverySummary(item["count"], decimal_to_float(item["totalAmount"])) for item in items}
+
+def inventory_report(inventory: Collection) -> InventoryReport:
+    """Computes the inventory report, one aggregation for the best selling product and one for the negative balances."""
+    return inventory_report_from(list(inventory.aggregate(BEST_SELLING_PIPELINE)), list(inventory.aggregate(NEGATIVE_BALANCE_PIPELINE)))
+
+def delivery_summaries(orders: Collection) -> Dict[str, DeliverySummary]:
+    """Counts the orders and sums their amount per deliveryStatus with a single $group."""
+    return delivery_summaries_from(orders.aggregate(DELIVERY_SUMMARY_PIPELINE))
+
+def build_report(inventory: Collection, orders: Collection, concurrent: bool = True) -> PipelineReport:
+    """
+    Computes the end of run report with three small aggregations, see the *_PIPELINE constants.
+
+    Args:
+        inventory (Collection): The MongoDB inventory collection.
+        orders (Collection): The MongoDB orders collection.
+        concurrent (bool): Run the aggregations at the same time.
+
+    Returns:
+        PipelineReport: The report.
+    """
+    if not concurrent:
+        return PipelineReport(inventory_report(inventory), delivery_summaries(orders))
+
+    with ThreadPoolExecutor(max_workers=3, thread_name_prefix="report") as executor:
+        # Each in a copy of the caller's context, so the round-trips are counted for its stage
+        best_selling_future = executor.submit(contextvars.copy_context().run, lambda: list(inventory.aggregate(BEST_SELLING_PIPELINE)))
+        negative_balance_future = executor.submit(contextvars.copy_context().run, lambda: list(inventory.aggregate(NEGATIVE_BALANCE_PIPELINE)))
+        deliveries_future = executor.submit(contextvars.copy_context().run, delivery_summaries, orders)
+        return PipelineReport(inventory_report_from(best_selling_future.result(), negative_balance_future.result()),
+                              deliveries_future.result())
+
+def print_report(report: PipelineReport) -> None:
+    """Prints the report."""
+    best_selling_product = report.inventory.best_selling_product
+    if best_selling_product:
+        print(f"The best selling product is at the moment {best_selling_product['productName']}, with {best_selling_product['totalOrderQuantity']} pieces ordered")
+
+    print(f" Need to fill up stock on {len(report.inventory.negative_balance)} products")
+    for inv in report.inventory.negative_balance:
+        print(f" Need to fill up stock of: productId: {inv['productId']} and name: {inv['productName']}")
+
+    print(f"There are {report.cannot_deliver.count} orders that can't be delivered because of stock shortage.")
+    print(f"The total order value of these are {report.cannot_deliver.total_amount} SEK.")
+    print(f"There are {report.delivered.count} orders that has been delivered.")
+    print(f"The total order value of these are {report.delivered.total_amount} SEK.")
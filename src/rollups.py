@@ -0,0 +1,239 @@
+import logging
+import uuid
+from datetime import date, datetime, timezone
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import pandas as pd
+from pymongo import DESCENDING, ReplaceOne, UpdateOne
+from pymongo.collection import Collection
+from pymongo.database import Database
+from pymongo.errors import BulkWriteError
+
+try:
+    from .bulk_writer import BulkWriter
+    from .dedup import key_strings
+    from .encoding import decimal_to_float
+except ImportError:
+    from bulk_writer import BulkWriter
+    from dedup import key_strings
+    from encoding import decimal_to_float
+
+class Rollup(NamedTuple):
+    """A pre-aggregated sales collection with one document per UTC day and combination of dimension values."""
+    collection: str
+    dimensions: Tuple[str, ...]
+
+# The category comes from the inventory, its rollup is derived from the product rollup (see refresh_category_rollup)
+ROLLUPS: Dict[str, Rollup] = {
+    "product": Rollup("sales_by_product_day", ("productId",)),
+    "channel": Rollup("sales_by_channel_day", ("channel", "channelGroup")),
+    "campaign": Rollup("sales_by_campaign_day", ("campaign",)),
+    "category": Rollup("sales_by_category_day", ("category",)),
+}
+ORDER_ROLLUPS: List[str] = ["product", "channel", "campaign"]
+DIMENSIONS: List[str] = ["productId", "channel", "channelGroup", "campaign"]
+MEASURES: List[str] = ["orders", "quantity", "amount"]
+# The order fields the rollups are computed from
+ORDER_FIELDS: List[str] = ["orderId", *DIMENSIONS, "quantity", "amount", "dateTime"]
+# Whether the rollups must be rebuilt, after $inc updates that may or may not have been applied
+STATE_COLLECTION: str = "sales_rollups_state"
+
+def _contributions(orders: pd.DataFrame, sign: int) -> pd.DataFrame:
+    """What every order adds to the rollups (sign=1) or what removing it takes away (sign=-1)."""
+    days = pd.to_datetime(orders["dateTime"], format="ISO8601", utc=True).dt.floor("D").dt.tz_localize(None)
+    contributions = pd.DataFrame({"day": days}, index=orders.index)
+    for column in DIMENSIONS:
+        values = orders[column].astype(object) if column in orders.columns else pd.Series(None, index=orders.index, dtype=object)
+        contributions[column] = values.where(values.notna(), None)
+    contributions["orders"] = sign
+    contributions["quantity"] = sign * pd.to_numeric(orders["quantity"]).astype("int64")
+    contributions["amount"] = sign * pd.to_numeric(orders["amount"].map(decimal_to_float)).astype("float64")
+    return contributions
+
+def previous_orders(orders: Collection, df: pd.DataFrame, batch_size: int = 1000) -> pd.DataFrame:
+    """The stored versions of the orders in df, read before df is upserted so sales_deltas can take them out of the rollups."""
+    keys = key_strings(df["orderId"]).drop_duplicates().tolist()
+    documents = []
+    for i in range(0, len(keys), batch_size):
+        documents.extend(orders.find({"orderId": {"$in": keys[i:i + batch_size]}}, {"_id": 0, **{field: 1 for field in ORDER_FIELDS}}))
+    return pd.DataFrame(documents, columns=ORDER_FIELDS)
+
+def sales_deltas(df: pd.DataFrame, previous: pd.DataFrame) -> pd.DataFrame:
+    """
+    The change of the rollups when the previous versions of orders are replaced by the rows of df.
+
+    New orders are added, changed orders move their contribution (e.g. to another day or
+    channel) and orders upserted again unchanged cancel out, so ingesting a file twice doesn't
+    count it twice. One row per day and combination of dimension values with a non-zero change.
+    """
+    contributions = pd.concat([_contributions(df, 1), _contributions(previous, -1)] if not previous.empty else [_contributions(df, 1)])
+    keys = ["day", *DIMENSIONS]
+    deltas = contributions.groupby(keys, dropna=False, sort=False)[MEASURES].sum().reset_index()
+    return deltas[(deltas[MEASURES] != 0).any(axis=1)]
+
+def _key(row: dict, dimensions: Tuple[str, ...]) -> dict:
+    """The rollup document key of a grouped row, BSON values only."""
+    key = {"day": row["day"].to_pydatetime()}
+    key.update((column, None if pd.isna(row[column]) else row[column]) for column in dimensions)
+    return key
+
+def mark_stale(db: Database, stale: bool = True) -> None:
+    """Records that the rollups must be rebuilt from the orders (see refresh_rollups), or that they were."""
+    db[STATE_COLLECTION].update_one({"_id": "rollups"}, {"$set": {"stale": stale, "updatedAt": datetime.now(timezone.utc)}}, upsert=True)
+
+def is_stale(db: Database) -> bool:
+    """Whether a failed update left the rollups to be rebuilt."""
+    state = db[STATE_COLLECTION].find_one({"_id": "rollups"})
+    return bool(state and state.get("stale"))
+
+def apply_sales_deltas(db: Database, deltas: pd.DataFrame, concurrency: int = 1) -> int:
+    """
+    Adds the changes of sales_deltas to the product, channel and campaign rollups with $inc upserts.
+
+    Rollup documents left without orders are deleted. An $inc can't be retried safely after a
+    lost connection, it may have been applied, so failed updates aren't retried: the rollups
+    are marked stale and rebuilt by the next rollups stage. Returns the number of documents updated.
+    """
+    updated = 0
+    for name in ORDER_ROLLUPS:
+        rollup = ROLLUPS[name]
+        grouped = deltas.groupby(["day", *rollup.dimensions], dropna=False, sort=False)[MEASURES].sum().reset_index()
+        grouped = grouped[(grouped[MEASURES] != 0).any(axis=1)]
+        collection = db[rollup.collection]
+        try:
+            with BulkWriter(collection, concurrency=concurrency, idempotent=False) as writer:
+                for row in grouped.to_dict("records"):
+                    key = _key(row, rollup.dimensions)
+                    increments = {"orders": int(row["orders"]), "quantity": int(row["quantity"]), "amount": float(row["amount"])}
+                    writer.add(UpdateOne(key, {"$inc": increments}, upsert=True))
+        except BulkWriteError as e:
+            logging.warning(f"{rollup.collection}: {len(e.details['writeErrors'])} updates failed, the rollups will be rebuilt")
+            mark_stale(db)
+        if (grouped["orders"] < 0).any():
+            collection.delete_many({"orders": {"$lte": 0}})
+        updated += len(grouped)
+    return updated
+
+def _replace_rollup(collection: Collection, rows: pd.DataFrame, dimensions: Tuple[str, ...], concurrency: int = 1) -> int:
+    """Replaces the content of a rollup with rows, documents of an earlier refresh are deleted once every row is written."""
+    refresh = uuid.uuid4().hex
+    with BulkWriter(collection, concurrency=concurrency) as writer:
+        for row in rows.to_dict("records"):
+            key = _key(row, dimensions)
+            document = {**key, "orders": int(row["orders"]), "quantity": int(row["quantity"]), "amount": float(row["amount"]), "refresh": refresh}
+            writer.add(ReplaceOne(key, document, upsert=True))
+    collection.delete_many({"refresh": {"$ne": refresh}})
+    return len(rows)
+
+def refresh_category_rollup(db: Database, inventory: Collection, concurrency: int = 1) -> int:
+    """
+    Recomputes the category rollup from the product rollup and the categories of the inventory.
+
+    Reads the product rollup, which is small next to the orders, so a changed category of a
+    product moves its sales as well. Products without a category are summed under None.
+    """
+    product_rollup = ROLLUPS["product"]
+    products = pd.DataFrame(list(db[product_rollup.collection].find({}, {"_id": 0, "day": 1, "productId": 1, **{m: 1 for m in MEASURES}})),
+                            columns=["day", "productId", *MEASURES])
+    categories = {doc["productId"]: doc.get("category") for doc in inventory.find({}, {"_id": 0, "productId": 1, "category": 1})}
+    products["category"] = products["productId"].map(categories).astype(object)
+    products["day"] = pd.to_datetime(products["day"])
+    rows = products.groupby(["day", "category"], dropna=False, sort=False)[MEASURES].sum().reset_index()
+    return _replace_rollup(db[ROLLUPS["category"].collection], rows, ROLLUPS["category"].dimensions, concurrency)
+
+def rebuild_sales_rollups(db: Database, orders: Collection, inventory: Collection, batch_size: int = 100_000,
+                          concurrency: int = 1) -> Dict[str, int]:
+    """
+    Recomputes every rollup from the stored orders, e.g. after a crashed run or to backfill them.
+
+    The orders are read in batches of batch_size and only their aggregates are kept in memory.
+
+    Returns:
+        Dict[str, int]: The number of documents per rollup.
+    """
+    keys = ["day", *DIMENSIONS]
+    totals = []
+    cursor = orders.find({}, {"_id": 0, **{field: 1 for field in ORDER_FIELDS}}, batch_size=batch_size)
+    while True:
+        documents = [document for _, document in zip(range(batch_size), cursor)]
+        if not documents:
+            break
+        contributions = _contributions(pd.DataFrame(documents, columns=ORDER_FIELDS), 1)
+        totals.append(contributions.groupby(keys, dropna=False, sort=False)[MEASURES].sum().reset_index())
+    combined = pd.concat(totals) if totals else pd.DataFrame(columns=[*keys, *MEASURES])
+
+    counts = {}
+    for name in ORDER_ROLLUPS:
+        rollup = ROLLUPS[name]
+        rows = combined.groupby(["day", *rollup.dimensions], dropna=False, sort=False)[MEASURES].sum().reset_index()
+        counts[name] = _replace_rollup(db[rollup.collection], rows, rollup.dimensions, concurrency)
+    counts["category"] = refresh_category_rollup(db, inventory, concurrency)
+    mark_stale(db, False)
+    return counts
+
+def refresh_rollups(db: Database, orders: Collection, inventory: Collection, rebuild: bool = False,
+                    concurrency: int = 1) -> Optional[Dict[str, int]]:
+    """
+    The rollups stage after an ingestion.
+
+    Rebuilds every rollup if rebuild is set or they were marked stale, otherwise only refreshes
+    the category rollup from the product rollup and the ingested inventory.
+
+    Returns:
+        Optional[Dict[str, int]]: The counts of rebuild_sales_rollups, None if there was no rebuild.
+    """
+    if rebuild or is_stale(db):
+        return rebuild_sales_rollups(db, orders, inventory, concurrency=concurrency)
+    refresh_category_rollup(db, inventory, concurrency)
+    return None
+
+def query_sales(db: Database, by: str, start: Optional[date] = None, end: Optional[date] = None,
+                filters: Optional[dict] = None, daily: bool = True, limit: Optional[int] = None) -> List[dict]:
+    """
+    Sales per day (or in total with daily=False) by "product", "channel", "campaign" or "category".
+
+    Reads only the rollup, so the cost depends on the days and dimension values asked for and
+    not on the number of orders.
+
+    Args:
+        db (Database): The pipeline database.
+        by (str): The rollup, see ROLLUPS.
+        start (date): First day, inclusive.
+        end (date): Last day, exclusive.
+        filters (dict): Dimension values to match, e.g. {"channelGroup": "sem"}.
+        daily (bool): One row per day and dimension values, otherwise summed over the days.
+        limit (int): Max number of rows.
+
+    Returns:
+        List[dict]: Rows with day (if daily), the dimensions, orders, quantity and amount. By day
+        and then by amount, highest first.
+    """
+    if by not in ROLLUPS:
+        raise ValueError(f"Unknown rollup '{by}', expected one of: {', '.join(ROLLUPS)}")
+    rollup = ROLLUPS[by]
+    match = dict(filters or {})
+    unknown = set(match) - set(rollup.dimensions)
+    if unknown:
+        raise ValueError(f"The {by} rollup can't be filtered by: {', '.join(sorted(unknown))}")
+    days = {}
+    if start is not None:
+        days["$gte"] = datetime(start.year, start.month, start.day)
+    if end is not None:
+        days["$lt"] = datetime(end.year, end.month, end.day)
+    if days:
+        match["day"] = days
+
+    pipeline = [{"$match": match}]
+    if daily:
+        pipeline += [
+            {"$project": {"_id": 0, "day": 1, **{column: 1 for column in rollup.dimensions}, **{m: 1 for m in MEASURES}}},
+            {"$sort": {"day": 1, "amount": DESCENDING}},
+        ]
+    else:
+        pipeline += [
+            {"$group": {"_id": {column: f"${column}" for column in rollup.dimensions}, **{m: {"$sum": f"${m}"} for m in MEASURES}}},
+            {"$project": {"_id": 0, **{column: f"$_id.{column}" for column in rollup.dimensions}, **{m: 1 for m in MEASURES}}},
+            {"$sort": {"amount": DESCENDING}},
+        ]
+    if limit:
+        pipeline.append({"$limit": limit})
+    return list(db[rollup.collection].aggregate(pipeline))
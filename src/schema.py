@@ -0,0 +1,112 @@
+from typing import Dict, List, NamedTuple
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:  # Optional, without pyarrow strings are Python objects and UUIDs can't be binary
+    pa = None
+
+class ColumnType(NamedTuple):
+    """The in-memory type of one column."""
+    column: str
+    kind: str  # "string", "category", "integer", "number", "datetime" or "uuid"
+
+# Low-cardinality columns are categoricals, identifiers pyarrow strings. Amounts stay float64,
+# float32 would change the totals. Quantities are int32, like they are stored (see encoding.py)
+ORDERS_SCHEMA: List[ColumnType] = [
+    ColumnType("orderId", "uuid"),
+    ColumnType("productId", "string"),
+    ColumnType("currency", "category"),
+    ColumnType("quantity", "integer"),
+    ColumnType("shippingCost", "number"),
+    ColumnType("amount", "number"),
+    ColumnType("channel", "category"),
+    ColumnType("channelGroup", "category"),
+    ColumnType("campaign", "category"),
+    ColumnType("dateTime", "datetime"),
+]
+
+INVENTORY_SCHEMA: List[ColumnType] = [
+    ColumnType("productId", "string"),
+    ColumnType("name", "string"),
+    ColumnType("quantity", "integer"),
+    ColumnType("category", "category"),
+    ColumnType("subCategory", "category"),
+]
+
+SCHEMAS: Dict[str, List[ColumnType]] = {"orders": ORDERS_SCHEMA, "inventory": INVENTORY_SCHEMA}
+
+# About 4 bytes per value plus the characters, instead of a Python object of 50+ bytes
+STRING_DTYPE = pd.StringDtype("pyarrow") if pa is not None else object
+UUID_DTYPE = pd.ArrowDtype(pa.binary(16)) if pa is not None else None
+
+def csv_dtypes(schema: List[ColumnType]) -> dict:
+    """
+    Column types for pd.read_csv.
+
+    Integers, numbers and UUIDs are read as strings. A typed reader fails the whole file on one
+    malformed value (e.g. "1.5" or "abc" as a quantity), read as strings validate_rows rejects
+    only its row, converts the numbers of the valid rows and apply_schema narrows them.
+    """
+    read_as = {"string": STRING_DTYPE, "uuid": STRING_DTYPE, "category": "category", "integer": STRING_DTYPE, "number": STRING_DTYPE}
+    return {column.column: read_as[column.kind] for column in schema if column.kind in read_as}
+
+def date_columns(schema: List[ColumnType]) -> List[str]:
+    """The columns to parse as ISO 8601 datetimes."""
+    return [column.column for column in schema if column.kind == "datetime"]
+
+def is_uuid_binary(values: pd.Series) -> bool:
+    return UUID_DTYPE is not None and values.dtype == UUID_DTYPE
+
+def uuid_to_binary(values: pd.Series) -> pd.Series:
+    """Canonical UUID strings as 16-byte binary values, vectorized. The values must be valid UUIDs (see ORDERS_RULES)."""
+    if pa is None:
+        raise ImportError("Binary UUIDs require pyarrow, install it with: pip install pyarrow")
+    if values.isna().any():
+        raise ValueError(f"{values.name} has missing values, they can't be stored as binary UUIDs")
+    hex_digits = "".join(values.astype(str).str.replace("-", "", regex=False).tolist())
+    array = pa.FixedSizeBinaryArray.from_buffers(pa.binary(16), len(values), [None, pa.py_buffer(bytes.fromhex(hex_digits))])
+    return pd.Series(pd.arrays.ArrowExtensionArray(array), index=values.index, name=values.name)
+
+def binary_to_uuid(values: pd.Series) -> pd.Series:
+    """16-byte binary values as canonical lowercase UUID strings, the reverse of uuid_to_binary."""
+    array = pa.array(values)
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    digits = array.buffers()[1].to_pybytes()[16 * array.offset:16 * (array.offset + len(array))].hex()
+    strings = [f"{digits[i:i + 8]}-{digits[i + 8:i + 12]}-{digits[i + 12:i + 16]}-{digits[i + 16:i + 20]}-{digits[i + 20:i + 32]}"
+               for i in range(0, len(digits), 32)]
+    return pd.Series(strings, index=values.index, name=values.name, dtype=STRING_DTYPE)
+
+def apply_schema(df: pd.DataFrame, schema: List[ColumnType], uuid_binary: bool = False) -> pd.DataFrame:
+    """
+    Converts validated rows to their in-memory types, columns not in the schema are left as they are.
+
+    Integers without missing values are downcast to int32, categoricals and pyarrow strings
+    replace Python object columns and datetimes are parsed as UTC. With uuid_binary the UUID
+    columns are held as 16-byte binary values; everything that leaves the DataFrame (documents,
+    key hashes, queries) converts them back to their canonical strings.
+    """
+    types = {}
+    for column in schema:
+        if column.column not in df.columns:
+            continue
+        values = df[column.column]
+        if column.kind in ("integer", "number") and not pd.api.types.is_numeric_dtype(values):
+            # Not validated, e.g. parse_file without rules, malformed values become missing
+            values = pd.to_numeric(values, errors="coerce")
+            types[column.column] = values.astype("Int64" if column.kind == "integer" else "float64")
+        elif column.kind == "integer" and pd.api.types.is_integer_dtype(values) and not values.isna().any():
+            if len(values) == 0 or (values.min() >= np.iinfo(np.int32).min and values.max() <= np.iinfo(np.int32).max):
+                types[column.column] = values.astype(np.int32)
+        elif column.kind == "category" and not isinstance(values.dtype, pd.CategoricalDtype):
+            types[column.column] = values.astype("category")
+        elif column.kind == "uuid" and uuid_binary:
+            if not is_uuid_binary(values):
+                types[column.column] = uuid_to_binary(values)
+        elif column.kind in ("string", "uuid") and values.dtype != STRING_DTYPE:
+            types[column.column] = values.astype(STRING_DTYPE)
+        elif column.kind == "datetime" and not pd.api.types.is_datetime64_any_dtype(values):
+            types[column.column] = pd.to_datetime(values, format="ISO8601", utc=True)
+    return df.assign(**types) if types else df
@@ -0,0 +1,170 @@
+import glob
+import logging
+import os
+import threading
+import time
+from typing import Callable, Iterable, List, Optional, Set
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+try:
+    from .backends import INVENTORY_ENRICHED_FIELDS
+except ImportError:
+    from backends import INVENTORY_ENRICHED_FIELDS
+
+# Fields only the enrichment writes, changing them doesn't call for a recompute
+DERIVED_FIELDS: frozenset = frozenset(INVENTORY_ENRICHED_FIELDS + ["ordersDetails", "orderIds", "deliveryStatus"])
+# Id of the document in the state collection holding the resume token of the change stream
+RESUME_TOKEN_ID: str = "change_stream"
+
+class FileWatcher:
+    """
+    Polls a folder for new files matching the patterns.
+
+    A file is reported once its size and modification time are the same in two polls in a row,
+    so a file that is still being copied is not read half way. A file is only reported again if
+    it changes, e.g. a file that failed to ingest and was left in the folder.
+    """
+
+    def __init__(self, directory: str, patterns: Iterable[str]):
+        self.directory = directory
+        self.patterns = list(patterns)
+        self._pending = {}
+        self._reported = {}
+
+    def poll(self) -> List[str]:
+        """The files that are ready, oldest name first."""
+        current = {}
+        for pattern in self.patterns:
+            for path in glob.glob(os.path.join(self.directory, pattern)):
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:  # Moved between glob and stat
+                    continue
+                current[path] = (stat.st_size, stat.st_mtime_ns)
+
+        ready = sorted(path for path, signature in current.items()
+                       if self._pending.get(path) == signature and self._reported.get(path) != signature)
+        # Forget the files that are gone, so a new file with the same name is reported
+        self._reported = {path: signature for path, signature in self._reported.items() if path in current}
+        self._reported.update((path, current[path]) for path in ready)
+        self._pending = current
+        return ready
+
+def products_from_change(event: dict) -> Optional[Set[str]]:
+    """
+    The productIds affected by a change stream event.
+
+    Returns an empty set for updates of derived fields only (the enrichment's own writes) and
+    None if the products can't be known, e.g. a delete without a pre-image or a dropped
+    collection; every product is then recomputed.
+    """
+    operation = event.get("operationType")
+    if operation not in ("insert", "update", "replace", "delete"):
+        return None
+    if operation == "update":
+        description = event.get("updateDescription", {})
+        fields = set(description.get("updatedFields", {})) | set(description.get("removedFields", []))
+        if {field.split(".")[0] for field in fields} <= DERIVED_FIELDS:
+            return set()
+
+    products = set()
+    for key in ("fullDocument", "fullDocumentBeforeChange"):
+        document = event.get(key)
+        if document and "productId" in document:
+            products.add(document["productId"])
+    return products or None
+
+def _union(products: Optional[set], more: Optional[set]) -> Optional[set]:
+    """Union of two sets of productIds, where None stands for every product."""
+    if products is None or more is None:
+        return None
+    return products | more
+
+class ChangeListener:
+    """
+    Collects the productIds affected by changes to the watched collections from a MongoDB change
+    stream, see products_from_change. Requires a replica set (see docker-compose.yml).
+
+    The resume token is stored in the state collection by commit, so a restarted service picks
+    up the changes it missed. Pre-images (MongoDB 6.0+, changeStreamPreAndPostImages on the
+    collections) give the previous productId of changed and deleted orders; without them a
+    delete recomputes every product.
+    """
+
+    def __init__(self, db: Database, collections: Iterable[str], state: Optional[Collection] = None,
+                 max_await_ms: int = 100, full_document_before_change: Optional[str] = "whenAvailable"):
+        self.state = state
+        stored = state.find_one({"_id": RESUME_TOKEN_ID}) if state is not None else None
+        options = {"full_document_before_change": full_document_before_change} if full_document_before_change else {}
+        self.stream = db.watch(
+            [{"$match": {"ns.coll": {"$in": list(collections)}}}],
+            full_document="updateLookup",
+            resume_after=stored["resumeToken"] if stored else None,
+            max_await_time_ms=max_await_ms,
+            **options,
+        )
+
+    def poll(self, max_events: int = 10_000) -> Optional[Set[str]]:
+        """The products affected by the events that arrived, waits at most max_await_ms for the first one."""
+        products = set()
+        for _ in range(max_events):
+            event = self.stream.try_next()
+            if event is None:
+                break
+            products = _union(products, products_from_change(event))
+        return products
+
+    def commit(self) -> None:
+        """Stores the resume token, call once the polled changes are processed."""
+        token = self.stream.resume_token
+        if self.state is not None and token is not None:
+            self.state.update_one({"_id": RESUME_TOKEN_ID}, {"$set": {"resumeToken": token}}, upsert=True)
+
+    def close(self) -> None:
+        self.stream.close()
+
+def run_service(enrich: Callable[[Optional[set]], dict], ingest_files: Optional[Callable[[List[str]], Optional[set]]] = None,
+                watcher: Optional[FileWatcher] = None, listener: Optional[ChangeListener] = None,
+                poll_interval: float = 1.0, stop: Optional[threading.Event] = None) -> None:
+    """
+    Keeps the derived fields up to date until stop is set.
+
+    New files found by the watcher are ingested with ingest_files, which returns the affected
+    productIds. With a listener the changes come from the change stream instead, which also sees
+    writes from outside the pipeline, and only the affected products are enriched, typically
+    well within a second of the write.
+
+    Args:
+        enrich (Callable): Enriches the given products (None for every product), e.g. MongoBackend.enrich.
+        ingest_files (Callable): Ingests new files and returns the affected productIds.
+        watcher (FileWatcher): Optional watcher of the raw folder.
+        listener (ChangeListener): Optional change stream listener.
+        poll_interval (float): Seconds between two polls of the raw folder.
+        stop (threading.Event): Set to stop the service, e.g. from a signal handler.
+    """
+    stop = stop or threading.Event()
+    next_file_poll = 0.0
+    while not stop.is_set():
+        products = set()
+        if watcher is not None and time.monotonic() >= next_file_poll:
+            next_file_poll = time.monotonic() + poll_interval
+            files = watcher.poll()
+            if files:
+                logging.info(f"Ingesting {len(files)} new files: {', '.join(os.path.basename(path) for path in files)}")
+                ingested = ingest_files(files)
+                # With a listener the writes of the ingestion arrive as changes
+                if listener is None:
+                    products = _union(products, ingested)
+        if listener is not None:
+            products = _union(products, listener.poll())
+
+        if products is None or products:
+            started = time.perf_counter()
+            summary = enrich(products)
+            affected = "every product" if products is None else f"{len(products)} products"
+            logging.info(f"Re-enriched {affected} in {(time.perf_counter() - started) * 1000:.0f} ms: {summary}")
+        if listener is not None:
+            listener.commit()
+        else:
+            stop.wait(poll_interval)
@@ -0,0 +1,152 @@
+import glob
+import os
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional
+import pandas as pd
+
+try:
+    from .schema import is_uuid_binary, binary_to_uuid
+except ImportError:
+    from schema import is_uuid_binary, binary_to_uuid
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Optional, staging is only available with pyarrow
+    pa = None
+
+# Arrow schemas of the staged files, the column types the validated rows are stored with
+if pa is not None:
+    ORDERS_SCHEMA = pa.schema([
+        ("orderId", pa.string()),
+        ("productId", pa.string()),
+        ("currency", pa.string()),
+        ("quantity", pa.int64()),
+        ("shippingCost", pa.float64()),
+        ("amount", pa.float64()),
+        ("channel", pa.string()),
+        ("channelGroup", pa.string()),
+        ("campaign", pa.string()),
+        ("dateTime", pa.timestamp("ms", tz="UTC")),  # BSON datetimes have millisecond precision
+    ])
+    INVENTORY_SCHEMA = pa.schema([
+        ("productId", pa.string()),
+        ("name", pa.string()),
+        ("quantity", pa.int64()),
+        ("category", pa.string()),
+        ("subCategory", pa.string()),
+    ])
+    STAGING_SCHEMAS: dict = {"orders": ORDERS_SCHEMA, "inventory": INVENTORY_SCHEMA}
+else:
+    STAGING_SCHEMAS: dict = {}
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise ImportError("Parquet staging requires pyarrow, install it with: pip install pyarrow")
+
+def to_table(df: pd.DataFrame, schema: "pa.Schema") -> "pa.Table":
+    """
+    Converts validated rows to an Arrow table with the given schema.
+
+    Columns missing from df are null, columns not in the schema are dropped. ISO 8601 strings
+    are parsed for timestamp columns and binary UUIDs are stored as their canonical strings.
+    """
+    _require_pyarrow()
+    arrays = []
+    for field in schema:
+        values = df[field.name] if field.name in df.columns else pd.Series(None, index=df.index, dtype=object)
+        if is_uuid_binary(values):
+            values = binary_to_uuid(values)
+        if pa.types.is_timestamp(field.type) and not pd.api.types.is_datetime64_any_dtype(values):
+            values = pd.to_datetime(values, format="ISO8601", utc=True)
+        arrays.append(pa.array(values, type=field.type, from_pandas=True, safe=False))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+def staged_path(staging_dir: str, dataset: str, source_file: str) -> str:
+    """A new staged file for a source file, named so the staged files of a dataset sort in the order they were written."""
+    stem = os.path.splitext(os.path.basename(source_file))[0]
+    return os.path.join(staging_dir, dataset, f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}-{stem}.parquet")
+
+def list_staged_files(staging_dir: str, dataset: str) -> List[str]:
+    """The staged files of a dataset, oldest first."""
+    return sorted(glob.glob(os.path.join(staging_dir, dataset, "*.parquet")))
+
+class StagedFileWriter:
+    """
+    Writes batches of validated rows as row groups of one typed, compressed Parquet file.
+
+    The file is written under a temporary name and only appears under its final name once it
+    is closed without error, so a failed run never leaves a partial staged file behind. No file
+    is written if no rows are.
+
+    Usage:
+        with StagedFileWriter(staged_path(staging_dir, "orders", file_path), ORDERS_SCHEMA) as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+    """
+
+    def __init__(self, path: str, schema: "pa.Schema", compression: str = "zstd"):
+        _require_pyarrow()
+        self.path = path
+        self.schema = schema
+        self.compression = compression
+        self.rows = 0
+        self._tmp_path = f"{path}.tmp"
+        self._writer = None
+
+    def __enter__(self) -> "StagedFileWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close(commit=exc_type is None)
+
+    def write(self, df: pd.DataFrame) -> None:
+        """Appends the rows as one row group."""
+        if df.empty:
+            return
+        if self._writer is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._writer = pq.ParquetWriter(self._tmp_path, self.schema, compression=self.compression)
+        self._writer.write_table(to_table(df, self.schema))
+        self.rows += len(df)
+
+    def close(self, commit: bool = True) -> None:
+        """Closes the file and moves it to its final name, or removes it if commit is False."""
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._writer = None
+        if commit:
+            os.replace(self._tmp_path, self.path)
+        else:
+            os.remove(self._tmp_path)
+
+def read_staged(path: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Reads a staged file, memory-mapped and only the given columns."""
+    _require_pyarrow()
+    return pq.read_table(path, columns=columns, memory_map=True).to_pandas()
+
+def iter_staged_batches(path: str, columns: Optional[List[str]] = None, batch_size: int = 65_536) -> Iterator[pd.DataFrame]:
+    """Reads a staged file as DataFrames of at most batch_size rows, memory-mapped and only the given columns."""
+    _require_pyarrow()
+    staged_file = pq.ParquetFile(path, memory_map=True)
+    for batch in staged_file.iter_batches(batch_size=batch_size, columns=columns):
+        yield batch.to_pandas()
+
+def read_latest(paths: List[str], key: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Reads staged files into the rows the processed collection holds after upserting them in order.
+
+    Within a file the first row of a key is kept, like remove_dublicates, and a later file
+    replaces the row of an earlier one. Rows keep the position of the first time their key
+    was seen, like documents updated in place.
+    """
+    if columns is not None and key not in columns:
+        columns = [key] + columns
+    frames = [read_staged(path, columns).drop_duplicates(subset=[key]) for path in paths]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    rows = pd.concat(frames, ignore_index=True)
+    first_seen = rows.drop_duplicates(subset=[key], keep="first")[key]
+    latest = rows.drop_duplicates(subset=[key], keep="last").set_index(key)
+    return latest.loc[first_seen].reset_index()[rows.columns]
@@ -0,0 +1,106 @@
+import asyncio
+import mongomock
+import pandas as pd
+import pytest
+from pymongo import InsertOne
+from .. async_mongodb_utils import bulk_write_batches, store_raw_data_async, upsert_dataframe_async, build_report_async
+from .. mongodb_utils import combine_orders_to_inventory_with_aggregates, update_quantity_per_product, update_order_with_delivery_status
+from .. reporting import build_report
+
+class AsyncCursor:
+    def __init__(self, documents):
+        self.documents = list(documents)
+
+    async def to_list(self, length=None):
+        return self.documents
+
+class AsyncCollection:
+    """The part of PyMongo's AsyncCollection the pipeline uses, over a mongomock collection."""
+
+    def __init__(self, collection, delay: float = 0):
+        self.collection = collection
+        self.name = collection.name
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def bulk_write(self, operations, ordered=True):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            return self.collection.bulk_write(operations, ordered=ordered)
+        finally:
+            self.in_flight -= 1
+
+    async def aggregate(self, pipeline):
+        return AsyncCursor(self.collection.aggregate(pipeline))
+
+def test_bulk_write_batches_bounds_concurrency(mock_mongo_client):
+    # Given: A slow collection and 10 batches of rows
+    collection = AsyncCollection(mock_mongo_client["test_db"]["raw_orders"], delay=0.01)
+    df = pd.DataFrame({"orderId": [str(i) for i in range(100)]})
+
+    # When: Storing them with at most 3 batches in flight
+    stats = asyncio.run(store_raw_data_async(collection, df, batch_size=10, concurrency=3))
+
+    # Then: Every row is stored and the batches overlapped, up to the limit
+    assert collection.collection.count_documents({}) == stats.documents == 100
+    assert stats.batches == 10 and collection.max_in_flight == 3
+
+def test_bulk_write_batches_raises_errors(mock_mongo_client):
+    # Given: A collection where one of the batches fails
+    class FailingCollection(AsyncCollection):
+        async def bulk_write(self, operations, ordered=True):
+            if len(operations) == 1:
+                raise RuntimeError("write failed")
+            return await super().bulk_write(operations, ordered)
+
+    collection = FailingCollection(mock_mongo_client["test_db"]["raw_orders"])
+    batches = [[InsertOne({"a": 1}), InsertOne({"a": 2})], [InsertOne({"a": 3})]]
+
+    # Then: The error is raised once the other batches are written
+    with pytest.raises(RuntimeError, match="write failed"):
+        asyncio.run(bulk_write_batches(collection, batches))
+    assert collection.collection.count_documents({}) == 2
+
+def test_upsert_dataframe_async(mock_mongo_client):
+    # Given: An existing order and new rows
+    collection = AsyncCollection(mock_mongo_client["test_db"]["orders"])
+    collection.collection.insert_one({"orderId": "1", "quantity": 1})
+    df = pd.DataFrame({"orderId": ["1", "2"], "quantity": [5, 6]})
+
+    # When: Upserting them
+    asyncio.run(upsert_dataframe_async(collection, df, "orderId", batch_size=1))
+
+    # Then: The existing order is updated and the new one inserted
+    assert {doc["orderId"]: doc["quantity"] for doc in collection.collection.find()} == {"1": 5, "2": 6}
+    with pytest.raises(ValueError, match="unique"):
+        asyncio.run(upsert_dataframe_async(collection, pd.concat([df, df]), "orderId"))
+
+def test_build_report_async_matches_build_report(mock_mongo_client):
+    # Given: An enriched pipeline run where product A is short
+    db = mock_mongo_client["test_db"]
+    db["inventory"].insert_many([
+        {"productId": "A", "name": "Product A", "quantity": 4},
+        {"productId": "B", "name": "Product B", "quantity": 5},
+    ])
+    db["orders"].insert_many([
+        {"orderId": "1", "productId": "A", "quantity": 3, "amount": 30.0, "dateTime": "2023-02-01T10:00:00Z"},
+        {"orderId": "2", "productId": "A", "quantity": 3, "amount": 20.0, "dateTime": "2023-02-02T10:00:00Z"},
+        {"orderId": "3", "productId": "B", "quantity": 1, "amount": 15.5, "dateTime": "2023-02-01T10:00:00Z"},
+    ])
+    combine_orders_to_inventory_with_aggregates(db["inventory"], db["orders"])
+    update_quantity_per_product(db["inventory"])
+    update_order_with_delivery_status(db["orders"], db["inventory"])
+
+    # When: Building the report with the asyncio driver
+    report = asyncio.run(build_report_async(AsyncCollection(db["inventory"]), AsyncCollection(db["orders"])))
+
+    # Then: It is the same as the blocking one
+    assert report == build_report(db["inventory"], db["orders"])
+    assert report.cannot_deliver.count == 1 and report.inventory.negative_balance
+
+@pytest.fixture
+def mock_mongo_client():
+    return mongomock.MongoClient()
@@ -0,0 +1,118 @@
+import os
+import mongomock
+import pandas as pd
+import pytest
+from .. backends import MergeBackend, MongoBackend, PandasBackend
+
+RAW_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "data", "raw")
+
+@pytest.fixture
+def sample_data():
+    orders = pd.read_csv(os.path.join(RAW_DIR, "orders.csv")).drop_duplicates(subset=["orderId"])
+    inventory = pd.read_csv(os.path.join(RAW_DIR, "inventory.csv")).drop_duplicates(subset=["productId"])
+    return orders, inventory
+
+def test_backends_give_identical_results(mock_mongo_client, sample_data):
+    # Given: The sample data stored in two databases
+    orders, inventory = sample_data
+    results = []
+    for db_name, backend in [
+        ("mongo_db", lambda db: MongoBackend(db['inventory'], db['orders'])),
+        ("pandas_db", lambda db: PandasBackend.from_collections(db['inventory'], db['orders'])),
+    ]:
+        db = mock_mongo_client[db_name]
+        db['orders'].insert_many(orders.to_dict('records'))
+        db['inventory'].insert_many(inventory.to_dict('records'))
+
+        # When: Enriching with each backend
+        pipeline = backend(db)
+        summary = pipeline.enrich()
+        results.append((
+            summary,
+            pipeline.report(),
+            [{k: v for k, v in doc.items() if k != "_id"} for doc in db['inventory'].find()],
+            [{k: v for k, v in doc.items() if k != "_id"} for doc in db['orders'].find()],
+        ))
+
+    # Then: The stored documents, the statuses and the reports are identical
+    (mongo_summary, mongo_report, mongo_inventory, mongo_orders), (pandas_summary, pandas_report, pandas_inventory, pandas_orders) = results
+    assert mongo_summary == pandas_summary == {"Delivered": 336, "Cannot Deliver": 73}
+    assert mongo_inventory == pandas_inventory
+    assert mongo_orders == pandas_orders
+    assert mongo_report.inventory == pandas_report.inventory
+    assert mongo_report.deliveries.keys() == pandas_report.deliveries.keys()
+    for status, summary in mongo_report.deliveries.items():
+        assert pandas_report.deliveries[status].count == summary.count
+        assert pandas_report.deliveries[status].total_amount == pytest.approx(summary.total_amount)
+
+def test_pandas_backend_in_memory(sample_data):
+    # Given: The sample data as DataFrames only
+    orders, inventory = sample_data
+    backend = PandasBackend(inventory, orders)
+
+    # When: Enriching without any collections
+    backend.enrich()
+    report = backend.report()
+
+    # Then: The report is computed in memory
+    assert report.cannot_deliver.count == 73
+    assert report.cannot_deliver.total_amount == pytest.approx(772149.492)
+    assert report.delivered.total_amount == pytest.approx(2828034.081)
+    assert len(report.inventory.negative_balance) > 0
+
+@pytest.mark.parametrize("backend", [MongoBackend, PandasBackend.from_collections])
+def test_product_that_lost_its_orders_is_reset(mock_mongo_client, backend):
+    # Given: Enriched products where X's only order exceeds its stock
+    db = mock_mongo_client["test_db"]
+    db["inventory"].insert_many([{"productId": "X", "name": "Shoe", "quantity": 1}, {"productId": "Y", "name": "Belt", "quantity": 10}])
+    db["orders"].insert_one({"orderId": "o1", "productId": "X", "quantity": 5, "amount": 10.0, "dateTime": "2023-02-01T10:00:00Z"})
+    backend(db["inventory"], db["orders"]).enrich()
+
+    # When: The order is moved to Y and both products are enriched again
+    db["orders"].update_one({"orderId": "o1"}, {"$set": {"productId": "Y"}})
+    pipeline = backend(db["inventory"], db["orders"])
+    pipeline.enrich(product_ids={"X", "Y"})
+
+    # Then: X is stored like a product that was never ordered and is no longer short
+    product_x = db["inventory"].find_one({"productId": "X"}, {"_id": 0})
+    assert product_x == {"productId": "X", "name": "Shoe", "quantity": 1, "ordersDetailsCount": 0, "ordersQuantity": 0}
+    assert db["inventory"].find_one({"productId": "Y"})["InventoryBalanceAfterOrder"] == 5
+    assert pipeline.report().inventory.negative_balance == []
+
+class RecordingCollection:
+    """Records the commands sent to a collection, it has no find or bulk_write to read or write documents with."""
+
+    def __init__(self, name):
+        self.name = name
+        self.pipelines = []
+
+    def aggregate(self, pipeline, **kwargs):
+        self.pipelines.append(pipeline)
+        return iter([])
+
+    def create_index(self, *args, **kwargs):
+        pass
+
+    def update_many(self, *args, **kwargs):
+        pass
+
+    def distinct(self, *args, **kwargs):
+        return []
+
+def test_merge_backend_runs_on_the_server():
+    # Given: Collections that only accept server-side commands
+    inventory, orders = RecordingCollection("inventory"), RecordingCollection("orders")
+
+    # When: Enriching with the merge backend
+    summary = MergeBackend(inventory, orders).enrich(product_ids=["A"])
+
+    # Then: Every derived field is written with $merge into its own collection
+    merges = [pipeline[-1]["$merge"] for pipeline in inventory.pipelines + orders.pipelines if "$merge" in pipeline[-1]]
+    assert [merge["into"] for merge in merges] == ["inventory", "inventory", "orders"]
+    assert "$setWindowFields" in orders.pipelines[-2][1]
+    assert all(pipeline[0]["$match"]["productId"] == {"$in": ["A"]} for pipeline in inventory.pipelines[-1:] + orders.pipelines)
+    assert summary == {"Delivered": 0, "Cannot Deliver": 0}
+
+@pytest.fixture
+def mock_mongo_client():
+    return mongomock.MongoClient()
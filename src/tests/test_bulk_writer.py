@@ -0,0 +1,151 @@
+import mongomock
+import pytest
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import AutoReconnect, BulkWriteError
+from .. bulk_writer import BulkWriter
+
+def test_bulk_writer_keeps_order_per_key(mock_mongo_client):
+    # Given: Many upserts of few keys, written 3 operations per batch by 4 threads
+    collection = mock_mongo_client['test_db']['orders']
+
+    # When: Writing them concurrently
+    with BulkWriter(collection, concurrency=4, batch_size=3) as writer:
+        for i in range(60):
+            key = f"order-{i % 5}"
+            writer.add(UpdateOne({"orderId": key}, {"$set": {"orderId": key, "version": i}}, upsert=True), key=key)
+
+    # Then: The last upsert of every key wins and every operation is counted
+    assert {doc["orderId"]: doc["version"] for doc in collection.find()} == {f"order-{i}": 55 + i for i in range(5)}
+    assert writer.stats.documents == 60
+    assert writer.stats.failed == 0
+
+
+def test_bulk_writer_splits_batches_by_bytes(mock_mongo_client):
+    collection = mock_mongo_client['test_db']['raw_orders']
+    documents = [{"orderId": str(i), "payload": "x" * 100} for i in range(10)]
+
+    # Each document is over 100 bytes, so at most 2 fit in a 300 byte batch
+    with BulkWriter(collection, concurrency=2, batch_size=1000, max_batch_bytes=300) as writer:
+        for document in documents:
+            writer.add(InsertOne(document), document=document)
+
+    assert collection.count_documents({}) == 10
+    assert writer.stats.batches == 5
+
+
+def test_bulk_writer_retries_failed_operations(mock_mongo_client):
+    # Given: A collection whose first bulk_write fails the second operation with a retryable error
+    collection = FlakyCollection(mock_mongo_client['test_db']['raw_orders'], code=112)
+
+    # When: Writing two documents
+    with BulkWriter(collection, concurrency=1, retry_backoff=0) as writer:
+        writer.add(InsertOne({"orderId": "1"}))
+        writer.add(InsertOne({"orderId": "2"}))
+
+    # Then: Only the failed operation is retried
+    assert sorted(doc["orderId"] for doc in collection.find()) == ["1", "2"]
+    assert writer.stats.retries == 1
+    assert writer.stats.documents == 2
+
+
+def test_bulk_writer_raises_non_retryable_errors(mock_mongo_client):
+    collection = FlakyCollection(mock_mongo_client['test_db']['raw_orders'], code=121)
+
+    with pytest.raises(BulkWriteError):
+        with BulkWriter(collection, concurrency=1, retry_backoff=0) as writer:
+            writer.add(InsertOne({"orderId": "1"}))
+            writer.add(InsertOne({"orderId": "2"}))
+
+    assert writer.stats.failed == 1
+
+
+def test_bulk_writer_duplicate_keys(mock_mongo_client):
+    # Given: A collection that loses the connection after writing the first batch, like a primary stepping down
+    collection = DisconnectingCollection(mock_mongo_client['test_db']['raw_orders'])
+
+    # When: Inserting two documents, which the retry finds already written
+    with BulkWriter(collection, concurrency=1, retry_backoff=0) as writer:
+        writer.add(InsertOne({"_id": "1"}))
+        writer.add(InsertOne({"_id": "2"}))
+
+    # Then: The duplicate key errors of the retry count as written
+    assert collection.count_documents({}) == 2
+    assert (writer.stats.documents, writer.stats.failed) == (2, 0)
+
+    # When / Then: A duplicate key on a later attempt, after a retry that wasn't lost, is an error
+    collection = ScriptedCollection([AutoReconnect("connection closed"), 112, 11000])
+    with pytest.raises(BulkWriteError):
+        with BulkWriter(collection, concurrency=1, retry_backoff=0) as writer:
+            writer.add(InsertOne({"_id": "3"}))
+    assert (writer.stats.retries, writer.stats.failed) == (2, 1)
+
+    # When / Then: Inserting a document that was stored before is an error, it isn't retried
+    with pytest.raises(BulkWriteError):
+        with BulkWriter(mock_mongo_client['test_db']['raw_orders'], concurrency=1, retry_backoff=0) as writer:
+            writer.add(InsertOne({"_id": "1"}))
+    assert (writer.stats.retries, writer.stats.failed) == (0, 1)
+
+    # When / Then: An upsert that loses the race to insert its key is retried
+    collection = FlakyCollection(mock_mongo_client['test_db']['orders'], code=11000)
+    with BulkWriter(collection, concurrency=1, retry_backoff=0) as writer:
+        writer.add(UpdateOne({"orderId": "1"}, {"$set": {"quantity": 1}}, upsert=True))
+        writer.add(UpdateOne({"orderId": "2"}, {"$set": {"quantity": 2}}, upsert=True))
+    assert writer.stats.retries == 1 and collection.count_documents({}) == 2
+
+
+class ScriptedCollection:
+    """Fails its bulk_writes in turn with the given errors: an exception to raise or the code of a write error."""
+
+    def __init__(self, errors):
+        self.name = "scripted"
+        self._errors = list(errors)
+
+    def bulk_write(self, operations, ordered=True):
+        error = self._errors.pop(0)
+        if isinstance(error, Exception):
+            raise error
+        raise BulkWriteError({"writeErrors": [{"index": i, "code": error, "errmsg": "failed"} for i in range(len(operations))]})
+
+
+class DisconnectingCollection:
+    """Writes the first bulk_write, then raises AutoReconnect as if the reply was lost."""
+
+    def __init__(self, collection):
+        self._collection = collection
+        self._failed = False
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def bulk_write(self, operations, ordered=True):
+        result = self._collection.bulk_write(operations, ordered=ordered)
+        if self._failed:
+            return result
+        self._failed = True
+        raise AutoReconnect("connection closed")
+
+
+class FlakyCollection:
+    """Fails the second operation of the first bulk_write with the given error code."""
+
+    def __init__(self, collection, code: int):
+        self._collection = collection
+        self._code = code
+        self._failed = False
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def bulk_write(self, operations, ordered=True):
+        if self._failed or len(operations) < 2:
+            return self._collection.bulk_write(operations, ordered=ordered)
+        self._failed = True
+        self._collection.bulk_write(operations[:1], ordered=ordered)
+        raise BulkWriteError({"writeErrors": [{"index": 1, "code": self._code, "errmsg": "failed"}]})
+
+
+# Mock MongoClient
+@pytest.fixture
+def mock_mongo_client():
+    # Use mongomock to simulate MongoDB
+    return mongomock.MongoClient()
@@ -0,0 +1,64 @@
+import pytest
+import mongomock
+import pandas as pd
+from .. checkpoint import RunManifest, source_id
+from .. mongodb_utils import store_raw_data_to_mongo
+
+def test_unfinished_run_is_resumed(mock_mongo_client):
+    # Given: A run that committed two batches of a file and the ingest stage, then crashed
+    runs = mock_mongo_client["test_db"]["pipeline_runs"]
+    crashed = RunManifest.open(runs, "streaming")
+    crashed.commit_batch("orders.csv", "abc", rows=500, changed_products={"A"})
+    crashed.commit_batch("orders.csv", "abc", rows=500, changed_products={"A", "B"})
+    crashed.mark_done("ingest")
+
+    # When: Opening the next run of the same mode, and of another mode
+    resumed = RunManifest.open(runs, "streaming")
+    other = RunManifest.open(runs, "parallel")
+
+    # Then: The crashed run is resumed with its markers, the other mode starts a new run
+    assert resumed.resumed and resumed.run_id == crashed.run_id
+    assert resumed.is_done("ingest") and not resumed.is_done("enrich")
+    assert resumed.committed_batches("orders.csv", "abc") == 2
+    assert resumed.changed_products == {"A", "B"}
+    assert not other.resumed and other.run_id != crashed.run_id
+
+def test_changed_source_and_completed_run_start_over(mock_mongo_client):
+    # Given: A run with committed batches of a file
+    runs = mock_mongo_client["test_db"]["pipeline_runs"]
+    manifest = RunManifest.open(runs, "streaming")
+    manifest.commit_batch("orders.csv", "abc", rows=500)
+    manifest.finish_source("orders.csv", "abc")
+
+    # When / Then: A file with other content has no committed batches, and restarts its count
+    assert manifest.is_source_done("orders.csv", "abc")
+    assert manifest.committed_batches("orders.csv", "def") == 0
+    manifest.commit_batch("orders.csv", "def", rows=100)
+    assert manifest.committed_batches("orders.csv", "def") == 1
+    assert not manifest.is_source_done("orders.csv", "def")
+
+    # When / Then: A completed run isn't resumed, without resume an unfinished one is abandoned
+    manifest.complete()
+    unfinished = RunManifest.open(runs, "streaming")
+    assert not unfinished.resumed
+    fresh = RunManifest.open(runs, "streaming", resume=False)
+    assert fresh.run_id != unfinished.run_id
+    assert runs.find_one({"_id": unfinished.run_id})["status"] == "abandoned"
+
+def test_storing_raw_rows_again_replaces_them(mock_mongo_client):
+    # Given: Raw rows with their row numbers in the source file, already stored once
+    df = pd.DataFrame({"orderId": ["1", "2", "1"], "quantity": [1, 2, 3]}, index=[10, 11, 12])
+    raw_id = source_id("0123456789abcdef0123")
+    store_raw_data_to_mongo("test_db", "raw_orders", df, mock_mongo_client, batch_size=2, source_id=raw_id)
+
+    # When: Storing them again, as a resumed run does
+    store_raw_data_to_mongo("test_db", "raw_orders", df, mock_mongo_client, batch_size=2, source_id=raw_id)
+
+    # Then: Every row is stored once, under an _id from the source and its row number
+    raw_orders = mock_mongo_client["test_db"]["raw_orders"]
+    assert raw_orders.count_documents({}) == 3
+    assert raw_orders.find_one({"_id": "0123456789abcdef:12"})["quantity"] == 3
+
+@pytest.fixture
+def mock_mongo_client():
+    return mongomock.MongoClient()
@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+from .. cli import build_parser, export_options, INGEST_OPTIONS
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_commands_and_options(monkeypatch):
+    # Given: The parser of the command line
+    parser = build_parser()
+
+    # When: Parsing a run of some stages and an ingestion with some options
+    run = parser.parse_args(["--db", "test_db", "--raw-dir", "/tmp/raw", "run", "--stages", "enrich, report"])
+    ingest = parser.parse_args(["ingest", "--streaming", "--chunk-size", "10"])
+
+    # Then: The stages are listed and only the given ingest options are set, the others default to the environment
+    assert run.stages == ["enrich", "report"]
+    assert {name: getattr(ingest, name) for name in INGEST_OPTIONS if hasattr(ingest, name)} == {"streaming": True, "chunk_size": 10}
+
+    # When / Then: The paths and the database are passed on to main.py by the environment
+    monkeypatch.setattr(os, "environ", dict(os.environ))
+    export_options(run)
+    assert (os.environ["MONGO_DB"], os.environ["RAW_DIR"]) == ("test_db", "/tmp/raw")
+
+def test_report_commands_do_not_import_pandas():
+    # Given / When: A new interpreter that loads what the report and health commands load
+    code = ("import sys, cli, reporting, report_cache, mongo_config; cli.build_parser(); "
+            "print(sorted(name for name in ('pandas', 'numpy', 'pyarrow', 'main') if name in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", code], cwd=SRC_DIR, capture_output=True, text=True, check=True)
+
+    # Then: None of the heavy modules are imported
+    assert result.stdout.strip() == "[]"
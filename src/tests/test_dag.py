@@ -0,0 +1,82 @@
+import asyncio
+import pytest
+from .. dag import Stage, run_stages, topological_order
+from .. instrumentation import Instrumentation, ROUND_TRIPS
+
+def test_independent_stages_run_concurrently():
+    # Given: Two independent stages that each wait for the other to have started, and a stage using both
+    started = []
+
+    async def ingest(name):
+        started.append(name)
+        while len(started) < 2:
+            await asyncio.sleep(0)
+        return name
+
+    async def report(orders, inventory):
+        return f"{orders}+{inventory}"
+
+    stages = [
+        Stage("report", report, ("orders", "inventory")),
+        Stage("orders", lambda: ingest("orders")),
+        Stage("inventory", lambda: ingest("inventory")),
+    ]
+    instrumentation = Instrumentation()
+
+    # When: Running them
+    results = asyncio.run(asyncio.wait_for(run_stages(stages, instrumentation), timeout=5))
+
+    # Then: Both ingest stages overlapped, the report got their results and every stage was measured
+    assert results["report"] == "orders+inventory"
+    assert sorted(metrics.stage for metrics in instrumentation.metrics) == ["inventory", "orders", "report"]
+
+def test_concurrent_stages_count_their_own_round_trips():
+    # Given: Two overlapping stages sending a different number of commands, one of them from a worker thread
+    started = []
+
+    async def ingest(name, commands):
+        started.append(name)
+        while len(started) < 2:
+            await asyncio.sleep(0)
+        for _ in range(commands):
+            await asyncio.to_thread(ROUND_TRIPS.started, None)
+            await asyncio.sleep(0)
+
+    stages = [Stage("orders", lambda: ingest("orders", 3)), Stage("inventory", lambda: ingest("inventory", 1))]
+    instrumentation = Instrumentation()
+
+    # When: Running them
+    asyncio.run(asyncio.wait_for(run_stages(stages, instrumentation), timeout=5))
+
+    # Then: Every stage only counts its own commands
+    assert {metrics.stage: metrics.round_trips for metrics in instrumentation.metrics} == {"orders": 3, "inventory": 1}
+
+def test_failed_stage_cancels_the_others():
+    # Given: A stage that fails while another one is still running
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append("slow")
+            raise
+
+    async def fail():
+        raise RuntimeError("lost connection")
+
+    stages = [Stage("slow", slow), Stage("fail", fail), Stage("after", fail, ("fail",))]
+
+    # Then: The error is raised and the running stage was cancelled
+    with pytest.raises(RuntimeError, match="lost connection"):
+        asyncio.run(run_stages(stages))
+    assert cancelled == ["slow"]
+
+def test_invalid_dependencies():
+    async def noop(*args):
+        pass
+
+    with pytest.raises(ValueError, match="unknown"):
+        topological_order([Stage("enrich", noop, ("ingest",))])
+    with pytest.raises(ValueError, match="cycle"):
+        topological_order([Stage("a", noop, ("b",)), Stage("b", noop, ("a",))])
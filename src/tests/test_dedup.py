@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+from .. dedup import BloomFilter, Deduplicator, HashedKeySet, hash_keys, open_key_store
+
+def chunks():
+    return [
+        pd.DataFrame({"orderId": ["a", "b", "a"], "quantity": [1, 2, 3]}),
+        pd.DataFrame({"orderId": ["c", "b"], "quantity": [4, 5]}),
+    ]
+
+def test_hashed_key_set():
+    # Given: A million keys added in chunks
+    keys = np.random.default_rng(0).integers(0, 2**63, 1_000_000).astype(np.uint64)
+    key_set = HashedKeySet()
+    for i in range(0, len(keys), 50_000):
+        key_set.add(keys[i:i + 50_000])
+
+    # Then: Every key is found, few sorted arrays are kept and other keys aren't found
+    assert key_set.contains(keys).all()
+    assert len(key_set) == len(keys) and len(key_set.runs) <= 20
+    assert not key_set.contains(np.array([1, 2, 3], dtype=np.uint64)).any()
+
+def test_bloom_filter(tmp_path):
+    # Given: A Bloom filter with 10,000 keys, stored and loaded again
+    keys = np.random.default_rng(0).integers(0, 2**63, 20_000).astype(np.uint64)
+    bloom = BloomFilter(10_000, error_rate=0.01)
+    bloom.add(keys[:10_000])
+    bloom.save(str(tmp_path / "orders.bloom.npz"))
+    bloom = BloomFilter.load(str(tmp_path / "orders.bloom.npz"))
+
+    # Then: Every added key is found and about 1% of the others
+    assert bloom.contains(keys[:10_000]).all()
+    assert bloom.contains(keys[10_000:]).mean() < 0.02
+
+def test_bloom_filter_works_in_slices():
+    # Given: Two filters, one adding and looking up 1,000 hashes at a time
+    keys = np.random.default_rng(1).integers(0, 2**63, 5_000).astype(np.uint64)
+    whole, sliced = BloomFilter(5_000), BloomFilter(5_000)
+    sliced.slice_size = 1_000
+
+    # When: Adding the same keys, some of them twice
+    whole.add(np.concatenate([keys, keys[:100]]))
+    sliced.add(np.concatenate([keys, keys[:100]]))
+
+    # Then: They hold the same bits and find the same keys, a slice can only be counted as
+    # present already if the earlier slices gave a false positive
+    assert (whole.bits == sliced.bits).all() and whole.count == 5_000 and sliced.count > 4_990
+    assert (sliced.contains(keys[::-1]) == whole.contains(keys[::-1])).all()
+
+def test_hash_keys_independent_of_dtype():
+    assert (hash_keys(pd.Series(["a", "b"])) == hash_keys(pd.Series(["a", "b"], dtype="string"))).all()
+
+def test_deduplicate_streamed_chunks():
+    # Given: Chunks with duplicates within and across chunks
+    deduplicator = Deduplicator("orderId")
+
+    # When: Deduplicating them one at a time
+    kept = pd.concat([deduplicator.drop_duplicates(chunk) for chunk in chunks()])
+
+    # Then: The first row of every key is kept, like drop_duplicates over all rows
+    assert kept.to_dict("records") == pd.concat(chunks()).drop_duplicates(subset=["orderId"]).to_dict("records")
+    assert (deduplicator.unique_keys, deduplicator.run_duplicates, deduplicator.hit_rate) == (3, 2, 0.4)
+
+def test_deduplicate_across_runs(tmp_path):
+    # Given: A first run that stored its keys
+    path = str(tmp_path / "orders")
+    first = Deduplicator("orderId", store=open_key_store(path, "exact"), store_path=path)
+    first.drop_duplicates(chunks()[0])
+    first.save()
+
+    # When: The next run reads chunks with keys of the first run
+    second = Deduplicator("orderId", store=open_key_store(path, "exact"), store_path=path)
+    kept = [second.drop_duplicates(second.drop_ingested(chunk)) for chunk in chunks()]
+
+    # Then: Only the new key is kept and the hits are reported
+    assert kept[0].empty and kept[1]["orderId"].tolist() == ["c"]
+    assert second.ingested_duplicates == 4
+    assert "4 ingested by an earlier run" in second.summary()
+
+def test_bloom_hits_are_confirmed(tmp_path):
+    # Given: A Bloom filter store that reports every key as ingested
+    path = str(tmp_path / "orders")
+    bloom = open_key_store(path, "bloom", capacity=100)
+    bloom.contains = lambda hashes: np.ones(len(hashes), dtype=bool)
+    deduplicator = Deduplicator("orderId", store=bloom, confirm=lambda keys: {"b"})
+
+    # When: Dropping the ingested keys
+    kept = deduplicator.drop_ingested(chunks()[0])
+
+    # Then: Only the confirmed key is dropped
+    assert kept["orderId"].tolist() == ["a", "a"]
+
+def test_stored_keys_are_kept_without_drop_stored(tmp_path):
+    # Given: A store with the keys of a first run
+    path = str(tmp_path / "orders")
+    first = Deduplicator("orderId", store=open_key_store(path, "exact"), store_path=path)
+    first.drop_duplicates(chunks()[0])
+    first.save()
+
+    # When: An incremental run reads corrected rows of the same keys
+    second = Deduplicator("orderId", store=open_key_store(path, "exact"), store_path=path, drop_stored=False)
+    kept = [second.drop_duplicates(second.drop_ingested(chunk)) for chunk in chunks()]
+    second.save()
+
+    # Then: Only the duplicates within the run are dropped, and the store has every key
+    assert [chunk["orderId"].tolist() for chunk in kept] == [["a", "b"], ["c"]]
+    assert second.ingested_duplicates == 0
+    assert len(open_key_store(path, "exact")) == 3
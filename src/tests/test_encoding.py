@@ -0,0 +1,87 @@
+from datetime import datetime
+import mongomock
+import numpy as np
+import pandas as pd
+import pytest
+from bson import Decimal128, Int64
+from .. encoding import DocumentEncoder, FieldSpec, ORDERS_FIELDS, ORDERS_ENCODER, decimal_to_float
+from .. mongodb_utils import store_raw_data_to_mongo, upsert_dataframe_to_mongo
+
+def orders_df():
+    return pd.DataFrame([
+        {"orderId": "1", "productId": "A", "currency": "SEK", "quantity": np.int64(2), "shippingCost": 0.0,
+         "amount": 7095.93, "channel": "direct", "channelGroup": "sem", "campaign": "", "dateTime": "2023-02-01T17:12:52Z"},
+        {"orderId": "2", "productId": "B", "currency": "EUR", "quantity": np.int64(1), "shippingCost": np.nan,
+         "amount": 10.1, "channel": "direct", "channelGroup": "direct", "campaign": None, "dateTime": "2023-02-02T06:16Z"},
+    ])
+
+def test_encode_native_types():
+    # When: Encoding orders as read from the CSV file
+    docs = ORDERS_ENCODER.encode(orders_df())
+
+    # Then: Every value has its native BSON type and missing values and empty strings are left out
+    assert docs[0] == {"orderId": "1", "productId": "A", "currency": "SEK", "quantity": 2, "shippingCost": 0.0,
+                       "amount": Decimal128("7095.93"), "channel": "direct", "channelGroup": "sem",
+                       "dateTime": datetime(2023, 2, 1, 17, 12, 52)}
+    assert type(docs[0]["quantity"]) is int
+    assert "shippingCost" not in docs[1] and "campaign" not in docs[1]
+    assert docs[1]["dateTime"] == datetime(2023, 2, 2, 6, 16)
+
+def test_encode_compact():
+    # Given: An encoder with short field names that leaves out default values
+    encoder = DocumentEncoder(ORDERS_FIELDS, short_names=True, omit_defaults=True)
+
+    # When: Encoding and decoding the orders
+    docs = encoder.encode(orders_df())
+
+    # Then: The fields have short names, the default currency is left out and decode restores both
+    assert set(docs[0]) == {"o", "p", "q", "sc", "a", "ch", "cg", "t"}
+    assert docs[1]["cu"] == "EUR"
+    assert encoder.decode(docs[0])["currency"] == "SEK"
+    assert encoder.decode(docs[0])["amount"] == Decimal128("7095.93")
+
+def test_encode_parsed_and_unknown_columns():
+    # Given: Parsed datetimes, a nullable int64 and a column without a FieldSpec
+    encoder = DocumentEncoder([FieldSpec("dateTime", "datetime"), FieldSpec("count", "int64")])
+    df = pd.DataFrame({
+        "dateTime": pd.to_datetime(["2023-02-01T06:16+01:00", None], utc=True),
+        "count": pd.array([3, None], dtype="Int64"),
+        "rowHash": np.array([-5, 7], dtype="int64"),
+    })
+
+    # When: Encoding the rows
+    docs = encoder.encode(df)
+
+    # Then: Datetimes are in UTC, int64 are bson.Int64 and the other columns plain Python values
+    assert docs == [{"dateTime": datetime(2023, 2, 1, 5, 16), "count": Int64(3), "rowHash": -5}, {"rowHash": 7}]
+    assert type(docs[1]["rowHash"]) is int
+
+def test_write_with_encoder(mock_mongo_client):
+    # Given: Orders stored with the encoder, raw with short names and processed with native types
+    db = mock_mongo_client["test_db"]
+    store_raw_data_to_mongo("test_db", "raw_orders", orders_df(), mock_mongo_client, batch_size=1,
+                            encoder=DocumentEncoder(ORDERS_FIELDS, short_names=True))
+    upsert_dataframe_to_mongo("test_db", "orders", orders_df(), mock_mongo_client, match_field="orderId", encoder=ORDERS_ENCODER)
+
+    # When: The second order gets a campaign and then loses it again
+    changed = orders_df().iloc[[1]].assign(campaign="kr_pmax")
+    upsert_dataframe_to_mongo("test_db", "orders", changed, mock_mongo_client, match_field="orderId", encoder=ORDERS_ENCODER)
+    upsert_dataframe_to_mongo("test_db", "orders", orders_df().iloc[[1]], mock_mongo_client, match_field="orderId", encoder=ORDERS_ENCODER)
+
+    # Then: The raw documents have short names and the processed one no longer has a campaign
+    assert db["raw_orders"].find_one({"o": "1"})["a"] == Decimal128("7095.93")
+    assert "campaign" not in db["orders"].find_one({"orderId": "2"})
+
+    # And: Amounts sum as Decimal128 on the server and are reported as floats
+    total = next(db["orders"].aggregate([{"$group": {"_id": None, "total": {"$sum": "$amount"}}}]))["total"]
+    assert decimal_to_float(total) == 7106.03
+
+def test_upsert_rejects_short_names(mock_mongo_client):
+    # Then: Upserts need the column names to match on
+    with pytest.raises(ValueError):
+        upsert_dataframe_to_mongo("test_db", "orders", orders_df(), mock_mongo_client, match_field="orderId",
+                                  encoder=DocumentEncoder(ORDERS_FIELDS, short_names=True))
+
+@pytest.fixture
+def mock_mongo_client():
+    return mongomock.MongoClient()
@@ -0,0 +1,62 @@
+import mongomock
+import pandas as pd
+import pytest
+from .. incremental import (
+    add_row_hashes,
+    filter_changed_rows,
+    file_fingerprint,
+    is_file_processed,
+    mark_file_processed,
+    ROW_HASH_FIELD,
+)
+
+def test_filter_changed_rows(mock_mongo_client):
+    # Given: Two stored orders
+    df = add_row_hashes(pd.DataFrame([
+        {"orderId": "1", "productId": "A", "quantity": 1},
+        {"orderId": "2", "productId": "A", "quantity": 2},
+    ]))
+    collection = mock_mongo_client['test_db']['orders']
+    collection.insert_many(df.to_dict("records"))
+
+    # When: A new drop has one unchanged order, one order moved to another product and one new order
+    new_df = add_row_hashes(pd.DataFrame([
+        {"orderId": "1", "productId": "A", "quantity": 1},
+        {"orderId": "2", "productId": "B", "quantity": 2},
+        {"orderId": "3", "productId": "C", "quantity": 3},
+    ]))
+    changed, previous_products = filter_changed_rows(collection, new_df, "orderId", related_field="productId")
+
+    # Then: Only the moved and the new order are returned, with the product the moved order had before
+    assert changed["orderId"].tolist() == ["2", "3"]
+    assert previous_products == {"A"}
+
+
+def test_add_row_hashes_is_stable():
+    df = pd.DataFrame([{"orderId": "1", "quantity": 1}, {"orderId": "2", "quantity": 2}])
+
+    # Hashing twice gives the same values, and changes to a row change its hash
+    assert add_row_hashes(df)[ROW_HASH_FIELD].tolist() == add_row_hashes(add_row_hashes(df))[ROW_HASH_FIELD].tolist()
+    assert add_row_hashes(df.assign(quantity=[1, 3]))[ROW_HASH_FIELD].tolist()[1] != add_row_hashes(df)[ROW_HASH_FIELD].tolist()[1]
+
+
+def test_file_processed_state(mock_mongo_client, tmp_path):
+    # Given: A processed file
+    file_path = tmp_path / "orders.csv"
+    file_path.write_text("orderId\n1\n")
+    state = mock_mongo_client['test_db']['pipeline_state']
+    fingerprint = file_fingerprint(str(file_path))
+    assert not is_file_processed(state, str(file_path), fingerprint)
+    mark_file_processed(state, str(file_path), fingerprint, 1)
+
+    # Then: The same content is recognized and a new drop with the same name is not
+    assert is_file_processed(state, str(file_path), fingerprint)
+    file_path.write_text("orderId\n1\n2\n")
+    assert not is_file_processed(state, str(file_path), file_fingerprint(str(file_path)))
+
+
+# Mock MongoClient
+@pytest.fixture
+def mock_mongo_client():
+    # Use mongomock to simulate MongoDB
+    return mongomock.MongoClient()
@@ -0,0 +1,78 @@
+import mongomock
+import pytest
+from pymongo.errors import DuplicateKeyError
+from .. indexes import ensure_indexes, explain_pipeline_queries, report_collscans
+from .. queries import HAS_ORDERS_QUERY
+
+def test_ensure_indexes(mock_mongo_client):
+    # Given: An empty database
+    db = mock_mongo_client['test_db']
+
+    # When: The indexes are created twice
+    ensure_indexes(db)
+    created = ensure_indexes(db)
+
+    # Then: The indexes exist once and the keys are unique
+    assert "orderId_1" in created["orders"]
+    assert "productId_1_dateTime_1" in db["orders"].index_information()
+    assert db["inventory"].index_information()["productId_1"]["unique"]
+    db["orders"].insert_one({"orderId": "1"})
+    with pytest.raises(DuplicateKeyError):
+        db["orders"].insert_one({"orderId": "1"})
+
+def test_ensure_indexes_with_duplicates(mock_mongo_client):
+    # Given: Orders that already have a duplicate key
+    db = mock_mongo_client['test_db']
+    db["orders"].insert_many([{"orderId": "1"}, {"orderId": "1"}])
+
+    # When: The indexes are created
+    created = ensure_indexes(db)
+
+    # Then: The orders indexes are skipped and the inventory indexes are still created
+    assert "orders" not in created
+    assert "productId_1" in db["inventory"].index_information()
+
+class ExplainDatabase:
+    """Answers explain commands with a fixed winning plan per collection."""
+
+    def __init__(self, plans):
+        self.plans = plans
+        self.commands = []
+
+    def command(self, name, command, verbosity=None):
+        self.commands.append(command)
+        collection = next(iter(command.values()))
+        return {"queryPlanner": {"winningPlan": self.plans[collection], "rejectedPlans": [{"stage": "COLLSCAN"}]}}
+
+def test_report_collscans():
+    # Given: Orders queries that use an index and inventory queries that scan the collection
+    db = ExplainDatabase({
+        "orders": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}},
+        "inventory": {"stage": "COLLSCAN"},
+    })
+
+    # When: The pipeline queries are explained
+    plans = explain_pipeline_queries(db)
+    collscans = report_collscans(db)
+
+    # Then: Only the winning plans count, and only the inventory queries are reported
+    assert [plan.stages for plan in plans if plan.collection == "orders"][0] == ["FETCH", "IXSCAN"]
+    assert collscans and all(plan.collection == "inventory" for plan in collscans)
+
+    # And: The aggregations and updates the pipeline runs are explained, with their real filters
+    assert {next(iter(command)) for command in db.commands} == {"find", "update", "aggregate", "distinct"}
+    assert {"$match": HAS_ORDERS_QUERY} in db.commands[[plan.name for plan in plans].index("quantity per ordered product")]["pipeline"]
+
+def test_has_orders_query_uses_an_index(mock_mongo_client):
+    # Given: A product with aggregates, one with embedded orders of an older enrichment and one without orders
+    inventory = mock_mongo_client["test_db"]["inventory"]
+    inventory.insert_many([{"productId": "A", "ordersDetailsCount": 2}, {"productId": "B", "ordersDetails": [{"quantity": 1}]},
+                           {"productId": "C", "ordersDetailsCount": 0, "ordersDetails": []}])
+
+    # Then: Both enrichment modes match and every branch bounds the indexed ordersDetailsCount
+    assert sorted(doc["productId"] for doc in inventory.find(HAS_ORDERS_QUERY)) == ["A", "B"]
+    assert all("ordersDetailsCount" in branch for branch in HAS_ORDERS_QUERY["$or"])
+
+@pytest.fixture
+def mock_mongo_client():
+    return mongomock.MongoClient()
@@ -0,0 +1,102 @@
+from .. ingestion import (
+    load_csv,
+    iter_csv_chunks,
+    move_to_processed,
+    discover_files,
+    parse_files_parallel,
+    ORDERS_DTYPES,
+    ORDERS_DATE_COLUMNS,
+    INVENTORY_DTYPES,
+)
+from .. validation import ColumnRule, validate_rows, ORDERS_RULES, INVENTORY_RULES
+from .. schema import INVENTORY_SCHEMA, ORDERS_SCHEMA, apply_schema
+import pandas as pd
+import pytest
+
+CSV = """orderId,productId,currency,quantity,shippingCost,amount,channel,channelGroup,campaign,dateTime
+o1,p1,SEK,1,0,10.5,direct,sem,,2023-02-01T17:12:52Z
+o2,p2,SEK,2,0,20.0,google,sem,kr_pmax,2023-02-01T06:16Z
+o3,p1,SEK,3,0,30.0,direct,direct,,2023-02-02T10:00:00Z
+"""
+
+def test_iter_csv_chunks(tmp_path):
+
+    # Given: A CSV file with three orders
+    file_path = tmp_path / "orders.csv"
+    file_path.write_text(CSV)
+
+    # When: Streaming it two rows at a time
+    chunks = list(iter_csv_chunks(str(file_path), 2, dtype=ORDERS_DTYPES, parse_dates=ORDERS_DATE_COLUMNS))
+
+    # Then: The dates are parsed, numbers are left to validation and the file is left in place
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    assert all(not pd.api.types.is_numeric_dtype(chunk["quantity"]) for chunk in chunks)
+    assert all(pd.api.types.is_datetime64_any_dtype(chunk["dateTime"]) for chunk in chunks)
+    assert chunks[0]["dateTime"].iloc[1] == pd.Timestamp("2023-02-01T06:16Z")
+    assert file_path.exists()
+
+
+def test_malformed_numbers_only_reject_their_rows(tmp_path):
+
+    # Given: Inventory and orders with a fractional, a non-numeric and a valid number
+    (tmp_path / "inventory.csv").write_text("productId,name,quantity\nprod1#prod2,Shoe,1.5\nprod3#prod4,Hat,abc\nprod5#prod6,Cap,4\n")
+    (tmp_path / "orders.csv").write_text(
+        "orderId,productId,currency,quantity,shippingCost,amount,channel,channelGroup,campaign,dateTime\n"
+        "0f8fad5b-d9cb-469f-a165-70867728950e,prod1#prod2,SEK,1,0,ten,direct,sem,,2023-02-01T17:12:52Z\n"
+        "7c9e6679-7425-40de-944b-e07fc1f90ae7,prod3#prod4,SEK,2,,20.0,google,sem,kr_pmax,2023-02-01T06:16Z\n")
+
+    # When: Reading the inventory at once and the orders in chunks, then validating them
+    inventory = validate_rows(load_csv(str(tmp_path / "inventory.csv"), None, dtype=INVENTORY_DTYPES), INVENTORY_RULES)
+    orders = [validate_rows(chunk, ORDERS_RULES, parse_datetimes=True)
+              for chunk in iter_csv_chunks(str(tmp_path / "orders.csv"), 2, dtype=ORDERS_DTYPES, parse_dates=ORDERS_DATE_COLUMNS)]
+
+    # Then: The files are read, the bad rows are rejected with their reasons and the others get their types
+    assert inventory.rejected_with_reasons()["validationErrors"].tolist() == [["quantity: integer"], ["quantity: integer"]]
+    assert apply_schema(inventory.valid, INVENTORY_SCHEMA)["quantity"].tolist() == [4]
+    assert apply_schema(inventory.valid, INVENTORY_SCHEMA)["quantity"].dtype == "int32"
+    assert orders[0].rejected_with_reasons()["validationErrors"].tolist() == [["amount: number"]]
+    valid = apply_schema(orders[0].valid, ORDERS_SCHEMA)
+    assert valid["amount"].tolist() == [20.0] and valid["shippingCost"].dtype == "float64"
+
+
+def test_iter_csv_chunks_invalid_chunk_size(tmp_path):
+
+    # Expect a ValueError
+    with pytest.raises(ValueError, match="chunk_size must be a positive integer."):
+        next(iter_csv_chunks(str(tmp_path / "orders.csv"), 0))
+
+
+def test_move_to_processed(tmp_path):
+
+    # Given: A loaded file
+    file_path = tmp_path / "orders.csv"
+    file_path.write_text(CSV)
+
+    # When: Moving it to a processed folder that doesn't exist yet
+    new_path = move_to_processed(str(file_path), str(tmp_path / "processed"))
+
+    # Then: The file is moved
+    assert not file_path.exists()
+    assert new_path == str(tmp_path / "processed" / "orders.csv")
+    assert (tmp_path / "processed" / "orders.csv").exists()
+
+
+def test_parse_files_parallel_isolates_failures(tmp_path):
+
+    # Given: Two valid order files, one that can't be parsed and a file not matching the pattern
+    (tmp_path / "orders_2.csv").write_text(CSV)
+    (tmp_path / "orders_1.csv").write_text(CSV)
+    (tmp_path / "orders_3.csv").write_text('orderId,quantity\n"broken\n')
+    (tmp_path / "inventory.csv").write_text("productId,quantity\np1,1\n")
+    file_paths = discover_files(str(tmp_path), "orders*.csv")
+
+    # When: Parsing them in worker processes
+    rules = [ColumnRule("orderId"), ColumnRule("quantity", dtype="integer", min_value=2)]
+    results = list(parse_files_parallel(file_paths, ORDERS_DTYPES, ORDERS_DATE_COLUMNS, rules, max_workers=2, max_pending=2))
+
+    # Then: Results come in file name order and only the broken file failed
+    assert [result.file_path for result in results] == [str(tmp_path / f"orders_{i}.csv") for i in (1, 2, 3)]
+    assert [len(result.df) for result in results[:2]] == [2, 2]
+    assert results[0].error is None
+    assert results[0].rejected["validationErrors"].tolist() == [["quantity: min"]]
+    assert results[2].df is None and "Failed to load data" in results[2].error
@@ -0,0 +1,59 @@
+import json
+import logging
+import os
+import pytest
+from .. instrumentation import Instrumentation, count, ROUND_TRIPS
+
+def test_stage_metrics(tmp_path, caplog):
+    # Given: Instrumentation that profiles the "enrich" stage
+    instrumentation = Instrumentation(profile_stages={"enrich"}, trace_memory_stages={"enrich"}, profile_dir=str(tmp_path))
+
+    # When: Two stages count rows, bytes and round-trips
+    with caplog.at_level(logging.INFO, logger="pipeline.metrics"):
+        with instrumentation.stage("ingest"):
+            count(rows_in=10, bytes_read=100)
+            count(rows_in=5, rows_out=12)
+            ROUND_TRIPS.started(None)
+        with instrumentation.stage("enrich"):
+            count(rows_out=3)
+    count(rows_in=1)  # Outside of a stage
+
+    # Then: Every stage has its own metrics
+    ingest, enrich = instrumentation.metrics
+    assert (ingest.rows_in, ingest.rows_out, ingest.bytes_read, ingest.round_trips) == (15, 12, 100, 1)
+    assert (enrich.rows_in, enrich.rows_out, enrich.round_trips) == (0, 3, 0)
+    assert ingest.wall_seconds >= 0 and ingest.peak_rss_bytes > 0
+
+    # And: They are logged as JSON and only the enrich stage is profiled
+    logged = [json.loads(record.message) for record in caplog.records if record.message.startswith("{")]
+    assert [item["stage"] for item in logged] == ["ingest", "enrich"]
+    assert os.listdir(tmp_path) == ["enrich.prof"]
+
+def test_stage_metrics_on_error():
+    # Given: A stage that fails
+    instrumentation = Instrumentation()
+
+    # When: The error is raised in the stage
+    with pytest.raises(ValueError):
+        with instrumentation.stage("ingest"):
+            count(rows_in=1)
+            raise ValueError("bad file")
+
+    # Then: The stage is still measured
+    assert instrumentation.metrics[0].rows_in == 1
+
+def test_write_openmetrics(tmp_path):
+    # Given: One measured stage
+    instrumentation = Instrumentation()
+    with instrumentation.stage("report"):
+        count(rows_out=2)
+
+    # When: Writing the metrics file
+    path = tmp_path / "pipeline.prom"
+    instrumentation.write_openmetrics(str(path))
+
+    # Then: It has one sample per metric in the text format
+    lines = path.read_text().splitlines()
+    assert 'pipeline_stage_rows_out{stage="report"} 2' in lines
+    assert "# TYPE pipeline_stage_wall_seconds gauge" in lines
+    assert lines[-1] == "# EOF"
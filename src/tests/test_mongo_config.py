@@ -0,0 +1,75 @@
+import json
+import pytest
+import mongomock
+import pandas as pd
+from pymongo import WriteConcern
+from .. mongo_config import MongoSettings, load_settings, parse_write_concern
+from .. mongodb_utils import store_raw_data_to_mongo
+
+def test_environment_overrides_the_config_file(tmp_path):
+    # Given: A config file and environment variables setting some of the same options
+    path = tmp_path / "mongo.json"
+    path.write_text(json.dumps({"max_pool_size": 20, "compressors": ["zlib"], "write_concerns": {"processed": {"w": "majority"}}}))
+    environ = {"MONGO_CONFIG": str(path), "MONGO_MAX_POOL_SIZE": "50", "MONGO_COMPRESSORS": "zstd, zlib",
+               "MONGO_RETRY_WRITES": "false", "MONGO_WRITE_CONCERN_STATE": "w=majority,j=true,wtimeout=5000"}
+
+    # When: Loading the settings
+    settings = load_settings(environ)
+
+    # Then: The environment wins, the file fills in the rest and the raw default is kept
+    assert settings.max_pool_size == 50
+    assert settings.compressors == ("zstd", "zlib")
+    assert settings.retry_writes is False
+    assert settings.write_concern("raw") == WriteConcern(w=1, j=False)
+    assert settings.write_concern("processed") == WriteConcern(w="majority")
+    assert settings.write_concern("state") == WriteConcern(w="majority", j=True, wtimeout=5000)
+    assert settings.write_concern("enrich") is None
+
+def test_invalid_settings_are_rejected(tmp_path):
+    # Given: A config file with a misspelled option
+    path = tmp_path / "mongo.json"
+    path.write_text(json.dumps({"max_pool": 20}))
+
+    # When / Then: Loading it, an unknown write concern option or stage all raise
+    with pytest.raises(ValueError, match="max_pool"):
+        load_settings({}, path=str(path))
+    with pytest.raises(ValueError, match="journal"):
+        parse_write_concern("w=1,journal=false")
+    with pytest.raises(ValueError, match="staging"):
+        MongoSettings().write_concern("staging")
+
+def test_client_options_leave_out_unset_options():
+    # Given: Settings with compression and an operation timeout, without socket timeout
+    settings = MongoSettings(compressors=("zstd", "zlib"), timeout_ms=60_000)
+
+    # When: Building the client options
+    options = settings.client_options()
+
+    # Then: Only set options are passed on, in the names MongoClient expects
+    assert options["compressors"] == "zstd,zlib"
+    assert options["timeoutMS"] == 60_000
+    assert options["maxPoolSize"] == 100
+    assert "socketTimeoutMS" not in options
+
+def test_store_raw_data_uses_the_write_concern(mock_mongo_client):
+    # Given: Raw rows and the raw write concern
+    df = pd.DataFrame({"orderId": ["1", "2"], "quantity": [1, 2]})
+    write_concerns = []
+    get_collection = mock_mongo_client["test_db"].get_collection
+
+    def recording_get_collection(name, **kwargs):
+        write_concerns.append(kwargs.get("write_concern"))
+        return get_collection(name, **kwargs)
+
+    mock_mongo_client["test_db"].get_collection = recording_get_collection
+
+    # When: Storing them
+    store_raw_data_to_mongo("test_db", "raw_orders", df, mock_mongo_client, batch_size=1000, write_concern=WriteConcern(w=1, j=False))
+
+    # Then: The collection was opened with it and every row was stored
+    assert write_concerns == [WriteConcern(w=1, j=False)]
+    assert mock_mongo_client["test_db"]["raw_orders"].count_documents({}) == 2
+
+@pytest.fixture
+def mock_mongo_client():
+    return mongomock.MongoClient()
@@ -1,7 +1,16 @@
 import pytest
 import mongomock
 import pandas as pd
-from  .. mongodb_utils import upsert_dataframe_to_mongo, update_quantity_per_product
+from  .. mongodb_utils import (
+    upsert_dataframe_to_mongo,
+    update_quantity_per_product,
+    update_order_with_delivery_status,
+    update_order_with_delivery_status_legacy,
+    combine_orders_to_inventory_with_count,
+    combine_orders_to_inventory_with_aggregates,
+    total_quantity_per_product,
+    get_inventory_with_highest_order,
+)
 
 def test_insert_dataframe_to_mongo(mock_mongo_client):
     # Given: A DataFrame to insert
@@ -63,4 +72,80 @@ def test_update_quantity_per_product(mock_mongo_client):
 @pytest.fixture
 def mock_mongo_client():
     # Use mongomock to simulate MongoDB
-    return mongomock.MongoClient()
\ No newline at end of file
+    return mongomock.MongoClient()
+
+def test_update_order_with_delivery_status_matches_legacy(mock_mongo_client):
+    # Given: Two short products (one with tied dateTimes) and one product with enough stock
+    inventory_data = [
+        {"productId": "A", "quantity": 3, "InventoryBalanceAfterOrder": -2},
+        {"productId": "B", "quantity": 1, "InventoryBalanceAfterOrder": -1},
+        {"productId": "C", "quantity": 10, "InventoryBalanceAfterOrder": 8},
+    ]
+    orders_data = [
+        {"orderId": "1", "productId": "A", "quantity": 2, "dateTime": "2023-02-03T10:00:00Z"},
+        {"orderId": "2", "productId": "A", "quantity": 2, "dateTime": "2023-02-01T10:00:00Z"},
+        {"orderId": "3", "productId": "A", "quantity": 1, "dateTime": "2023-02-02T10:00:00Z"},
+        {"orderId": "4", "productId": "B", "quantity": 1, "dateTime": "2023-02-01T10:00:00Z"},
+        {"orderId": "5", "productId": "B", "quantity": 1, "dateTime": "2023-02-01T10:00:00Z"},
+        {"orderId": "6", "productId": "C", "quantity": 2, "dateTime": "2023-02-01T10:00:00Z"},
+        {"orderId": "7", "productId": "D", "quantity": 5, "dateTime": "2023-02-01T10:00:00Z"},
+    ]
+    statuses = []
+    for db_name, update in [("legacy_db", update_order_with_delivery_status_legacy), ("bulk_db", update_order_with_delivery_status)]:
+        db = mock_mongo_client[db_name]
+        db['inventory'].insert_many([dict(item) for item in inventory_data])
+        db['orders'].insert_many([dict(order) for order in orders_data])
+
+        # When: Updating the delivery status
+        update(db['orders'], db['inventory'])
+        statuses.append({order["orderId"]: order["deliveryStatus"] for order in db['orders'].find()})
+
+    # Then: Both implementations agree and allocate oldest orders first
+    assert statuses[0] == statuses[1]
+    assert statuses[1] == {
+        "1": "Cannot Deliver", "2": "Delivered", "3": "Delivered",
+        "4": "Delivered", "5": "Cannot Deliver", "6": "Delivered", "7": "Delivered",
+    }
+
+
+def test_combine_orders_to_inventory_with_aggregates(mock_mongo_client):
+    # Given: Inventory where one product has orders and one has none
+    inventory_data = [
+        {"productId": "A", "name": "Product A", "quantity": 10},
+        {"productId": "B", "name": "Product B", "quantity": 5},
+    ]
+    orders_data = [
+        {"orderId": "1", "productId": "A", "quantity": 2, "dateTime": "2023-02-03T10:00:00Z"},
+        {"orderId": "2", "productId": "A", "quantity": 3, "dateTime": "2023-02-01T10:00:00Z"},
+    ]
+    results = []
+    for db_name, combine in [
+        ("embedded_db", lambda db: combine_orders_to_inventory_with_count(db['inventory'])),
+        ("aggregate_db", lambda db: combine_orders_to_inventory_with_aggregates(db['inventory'], db['orders'], include_order_ids=True)),
+    ]:
+        db = mock_mongo_client[db_name]
+        db['inventory'].insert_many([dict(item) for item in inventory_data])
+        db['orders'].insert_many([dict(order) for order in orders_data])
+
+        # When: Enriching the inventory and computing the balances
+        combine(db)
+        update_quantity_per_product(db['inventory'])
+        results.append((
+            total_quantity_per_product(db['inventory']),
+            get_inventory_with_highest_order(db['inventory']),
+            {item["productId"]: item.get("InventoryBalanceAfterOrder") for item in db['inventory'].find()},
+        ))
+
+    # Then: Both enrichment modes give the same report results
+    assert results[0] == results[1]
+    assert results[1][2] == {"A": 5, "B": None}
+
+    # And: Only the aggregates are stored
+    product_a = mock_mongo_client['aggregate_db']['inventory'].find_one({"productId": "A"})
+    assert "ordersDetails" not in product_a
+    assert product_a["ordersDetailsCount"] == 2
+    assert product_a["ordersQuantity"] == 5
+    assert product_a["firstOrderDate"] == "2023-02-01T10:00:00Z"
+    assert product_a["lastOrderDate"] == "2023-02-03T10:00:00Z"
+    assert sorted(product_a["orderIds"]) == ["1", "2"]
+    assert mock_mongo_client['aggregate_db']['inventory'].find_one({"productId": "B"})["ordersDetailsCount"] == 0
@@ -0,0 +1,71 @@
+import os
+import pytest
+import mongomock
+import pandas as pd
+from datetime import datetime
+from .. partitions import (
+    partition_name,
+    split_by_month,
+    list_partitions,
+    source_month,
+    partitions_between,
+    find_partitioned,
+    archive_partitions,
+    read_archive,
+    restore_archive,
+)
+from .. mongodb_utils import store_raw_data_to_mongo
+
+def store_by_month(client, df, column="dateTime", now=datetime(2023, 6, 15)):
+    first_month = source_month(client["test_db"]["raw_sources"], "abc", now=now)
+    for month, rows in split_by_month(df, column, now=first_month):
+        store_raw_data_to_mongo("test_db", partition_name("raw_orders", month), rows, client, batch_size=2, source_id="abc")
+
+def test_rows_are_stored_and_queried_by_month(mock_mongo_client):
+    # Given: Raw orders of three months, one of them without a valid dateTime
+    df = pd.DataFrame({"orderId": ["1", "2", "3", "4"]}, index=[10, 11, 12, 13])
+    df["dateTime"] = pd.Series([datetime(2023, 2, 28, 23, 59), datetime(2023, 3, 1), datetime(2023, 4, 10, 8), None],
+                               index=df.index, dtype=object)
+
+    # When: Storing them by month, twice like a re-run, the second time a month later
+    store_by_month(mock_mongo_client, df)
+    store_by_month(mock_mongo_client, df, now=datetime(2023, 7, 2))
+
+    # Then: Every row is stored once in the partition of its month, rows without a date in the month of the first run
+    db = mock_mongo_client["test_db"]
+    assert {name: db[name].count_documents({}) for name in db.list_collection_names() if name != "raw_sources"} == {
+        "raw_orders_202302": 1, "raw_orders_202303": 1, "raw_orders_202304": 1, "raw_orders_202306": 1}
+    assert db["raw_orders_202304"].find_one()["_id"] == "abc:12"
+
+    assert [month for _, month in list_partitions(db, "raw_orders")] == [
+        datetime(2023, 2, 1), datetime(2023, 3, 1), datetime(2023, 4, 1), datetime(2023, 6, 1)]
+
+    # When / Then: A range query only reads the partitions of the range
+    assert partitions_between(db, "raw_orders", datetime(2023, 3, 1), datetime(2023, 5, 1)) == ["raw_orders_202303", "raw_orders_202304"]
+    found = find_partitioned(db, "raw_orders", start=datetime(2023, 3, 1), end=datetime(2023, 4, 1))
+    assert [doc["orderId"] for doc in found] == ["2"]
+
+def test_old_partitions_are_archived_and_dropped(mock_mongo_client, tmp_path):
+    # Given: Partitions of February to April and one left half archived by an interrupted run
+    db = mock_mongo_client["test_db"]
+    for month, count in ((2, 3), (3, 2), (4, 1)):
+        db[f"raw_orders_20230{month}"].insert_many([{"_id": f"{month}:{i}", "quantity": i} for i in range(count)])
+    db["raw_orders_202301_archiving"].insert_one({"_id": "1:0"})
+
+    # When: Archiving with a retention of 30 days in the middle of May
+    archived = archive_partitions(db, "raw_orders", 30, str(tmp_path), now=datetime(2023, 5, 15))
+
+    # Then: Partitions that ended before mid April are in archive files and gone from the database
+    assert [(partition.collection, partition.documents) for partition in archived] == [
+        ("raw_orders_202301", 1), ("raw_orders_202302", 3), ("raw_orders_202303", 2)]
+    assert sorted(db.list_collection_names()) == ["raw_orders_202304"]
+    assert all(os.path.dirname(partition.path) == str(tmp_path / "raw_orders") for partition in archived)
+
+    # When / Then: An archive file can be read and restored
+    assert [doc["_id"] for doc in read_archive(archived[1].path)] == ["2:0", "2:1", "2:2"]
+    assert restore_archive(db["restored"], archived[1].path, batch_size=2) == 3
+    assert db["restored"].find_one({"_id": "2:1"})["quantity"] == 1
+
+@pytest.fixture
+def mock_mongo_client():
+    return mongomock.MongoClient()
@@ -0,0 +1,113 @@
+import json
+import pytest
+import mongomock
+from .. report_cache import DataVersions, ReportCache, MongoCacheStore, FileCacheStore, CacheEntry
+from .. mongodb_utils import summarize_delivered_orders, get_inventory_with_negative_balance
+from .. reporting import build_report
+
+def counting(function, calls):
+    """function, counting its calls by name."""
+    def wrapper(*args, **kwargs):
+        calls.append(function.__name__)
+        return function(*args, **kwargs)
+    wrapper.__module__, wrapper.__qualname__ = function.__module__, function.__qualname__
+    return wrapper
+
+def test_results_are_cached_until_the_data_version_changes(mock_mongo_client):
+    # Given: Delivered orders and a cache
+    db = mock_mongo_client["test_db"]
+    db["orders"].insert_many([{"orderId": "1", "deliveryStatus": "Delivered", "amount": 10.0},
+                              {"orderId": "2", "deliveryStatus": "Delivered", "amount": 5.5}])
+    versions = DataVersions(db["data_versions"])
+    cache = ReportCache(versions)
+    calls = []
+    summarize = counting(summarize_delivered_orders, calls)
+
+    # When: Calling the report twice, the second time the orders are read from the collection no more
+    first = cache.call(summarize, db["orders"])
+    db["orders"].insert_one({"orderId": "3", "deliveryStatus": "Delivered", "amount": 1.0})
+    second = cache.call(summarize, db["orders"])
+
+    # Then: The cached result is served, even though a write that didn't bump the version happened
+    assert first == second == {"count": 2, "totalAmount": 15.5}
+    assert calls == ["summarize_delivered_orders"]
+
+    # When: A write path bumps the version of the orders
+    versions.bump("orders")
+
+    # Then: The result is computed again
+    assert cache.call(summarize, db["orders"]) == {"count": 3, "totalAmount": 16.5}
+    assert cache.stats._asdict() == {"hits": 1, "persistent_hits": 0, "misses": 2, "evictions": 0}
+
+@pytest.mark.parametrize("store_type", ["mongo", "file"])
+def test_persistent_store_serves_other_processes(mock_mongo_client, tmp_path, store_type):
+    # Given: A product with negative balance and a result cached by an earlier run
+    db = mock_mongo_client["test_db"]
+    db["inventory"].insert_one({"productId": "A", "name": "Shoe", "InventoryBalanceAfterOrder": -1})
+    make_store = lambda: MongoCacheStore(db["report_cache"]) if store_type == "mongo" else FileCacheStore(str(tmp_path))
+    ReportCache(DataVersions(db["data_versions"]), store=make_store()).call(get_inventory_with_negative_balance, db["inventory"])
+
+    # When: A new cache (e.g. the next run) calls the same report
+    calls = []
+    cache = ReportCache(DataVersions(db["data_versions"]), store=make_store())
+    result = cache.call(counting(get_inventory_with_negative_balance, calls), db["inventory"])
+
+    # Then: It is served from the persistent store
+    assert result == [{"productId": "A", "productName": "Shoe"}]
+    assert calls == []
+    assert cache.stats.persistent_hits == 1
+
+@pytest.mark.parametrize("store_type", ["mongo", "file"])
+def test_reports_are_stored_as_data(mock_mongo_client, tmp_path, store_type):
+    # Given: A report of an enriched order and a persistent store
+    db = mock_mongo_client["test_db"]
+    db["inventory"].insert_one({"productId": "A", "name": "Shoe", "quantity": 1, "ordersDetailsCount": 1,
+                                "ordersDetails": [{"quantity": 2}], "InventoryBalanceAfterOrder": -1})
+    db["orders"].insert_one({"orderId": "1", "productId": "A", "deliveryStatus": "Delivered", "amount": 10.0})
+    store = MongoCacheStore(db["report_cache"]) if store_type == "mongo" else FileCacheStore(str(tmp_path))
+    report = build_report(db["inventory"], db["orders"])
+
+    # When: Storing it and reading it back
+    store.put("report", "build_report()", CacheEntry({"orders": 1}, report))
+    entry = store.get("report")
+
+    # Then: The report types are decoded, from a document with only plain values
+    assert entry.value == report and type(entry.value.deliveries["Delivered"]) is type(report.deliveries["Delivered"])
+    stored = db["report_cache"].find_one()["value"] if store_type == "mongo" else json.loads((tmp_path / "report.json").read_text())["value"]
+    assert stored["__reportType__"] == "PipelineReport" and stored["deliveries"]["Delivered"] == {
+        "__reportType__": "DeliverySummary", "count": 1, "total_amount": 10.0}
+
+    # When / Then: A value of an unknown type is a miss, it isn't constructed
+    if store_type == "mongo":
+        db["report_cache"].update_one({"_id": "report"}, {"$set": {"value.__reportType__": "os.system"}})
+    else:
+        (tmp_path / "report.json").write_text((tmp_path / "report.json").read_text().replace("PipelineReport", "os.system"))
+    assert store.get("report") is None
+
+def test_lru_eviction_and_ttl(mock_mongo_client, monkeypatch):
+    # Given: A cache with room for one result that expires after 60 seconds
+    db = mock_mongo_client["test_db"]
+    now = [1000.0]
+    monkeypatch.setattr("time.time", lambda: now[0])
+    cache = ReportCache(DataVersions(db["data_versions"]), max_entries=1, ttl=60)
+    calls = []
+    negative_balance = counting(get_inventory_with_negative_balance, calls)
+    delivered = counting(summarize_delivered_orders, calls)
+
+    # When: Calling two reports, then the first again, then again once it expired
+    cache.call(negative_balance, db["inventory"])
+    cache.call(delivered, db["orders"])
+    cache.call(negative_balance, db["inventory"])
+    cache.call(negative_balance, db["inventory"])
+    now[0] += 61
+    cache.call(negative_balance, db["inventory"])
+
+    # Then: The evicted and the expired result were computed again
+    assert calls == ["get_inventory_with_negative_balance", "summarize_delivered_orders",
+                     "get_inventory_with_negative_balance", "get_inventory_with_negative_balance"]
+    assert cache.stats.evictions == 2 and cache.stats.hits == 1
+    assert 'pipeline_report_cache_calls_total{result="miss"} 4' in cache.openmetrics()
+
+@pytest.fixture
+def mock_mongo_client():
+    return mongomock.MongoClient()
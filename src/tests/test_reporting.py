@@ -0,0 +1,63 @@
+import mongomock
+import pytest
+from .. mongodb_utils import (
+    combine_orders_to_inventory_with_aggregates,
+    update_quantity_per_product,
+    update_order_with_delivery_status,
+    get_inventory_with_highest_order,
+    get_inventory_with_negative_balance,
+    summarize_cannot_deliver_orders,
+    summarize_delivered_orders,
+)
+from .. reporting import build_report, DeliverySummary
+
+@pytest.mark.parametrize("concurrent", [True, False])
+def test_build_report(mock_mongo_client, concurrent):
+    # Given: An enriched pipeline run where product A is short
+    db = mock_mongo_client['test_db']
+    db['inventory'].insert_many([
+        {"productId": "A", "name": "Product A", "quantity": 4},
+        {"productId": "B", "name": "Product B", "quantity": 5},
+        {"productId": "C", "name": "Product C", "quantity": 1},
+    ])
+    db['orders'].insert_many([
+        {"orderId": "1", "productId": "A", "quantity": 3, "amount": 30.0, "dateTime": "2023-02-01T10:00:00Z"},
+        {"orderId": "2", "productId": "A", "quantity": 3, "amount": 20.0, "dateTime": "2023-02-02T10:00:00Z"},
+        {"orderId": "3", "productId": "B", "quantity": 1, "amount": 15.5, "dateTime": "2023-02-01T10:00:00Z"},
+    ])
+    combine_orders_to_inventory_with_aggregates(db['inventory'], db['orders'])
+    update_quantity_per_product(db['inventory'])
+    update_order_with_delivery_status(db['orders'], db['inventory'])
+
+    # When: Building the report
+    report = build_report(db['inventory'], db['orders'], concurrent=concurrent)
+
+    # Then: It has the same results as the separate report queries
+    best_selling = get_inventory_with_highest_order(db['inventory'])
+    assert report.inventory.best_selling_product == {
+        "productId": best_selling["_id"],
+        "productName": best_selling["productName"],
+        "totalOrderQuantity": best_selling["totalOrderQuantity"],
+    }
+    assert report.inventory.negative_balance == get_inventory_with_negative_balance(db['inventory'])
+    assert report.cannot_deliver == DeliverySummary(1, 20.0)
+    assert report.delivered == DeliverySummary(2, 45.5)
+    assert report.cannot_deliver._asdict() == {"count": 1, "total_amount": 20.0}
+    assert summarize_cannot_deliver_orders(db['orders']) == {"count": 1, "totalAmount": 20.0}
+    assert summarize_delivered_orders(db['orders']) == {"count": 2, "totalAmount": 45.5}
+
+def test_build_report_empty(mock_mongo_client):
+    # Given: Empty collections
+    db = mock_mongo_client['test_db']
+
+    # When: Building the report
+    report = build_report(db['inventory'], db['orders'])
+
+    # Then: Nothing is reported
+    assert report.inventory.best_selling_product is None
+    assert report.inventory.negative_balance == []
+    assert report.delivered == DeliverySummary(0, 0)
+
+@pytest.fixture
+def mock_mongo_client():
+    return mongomock.MongoClient()
@@ -0,0 +1,142 @@
+import pytest
+import mongomock
+import pandas as pd
+from datetime import date, datetime
+from pymongo.errors import AutoReconnect
+from .. rollups import (
+    previous_orders,
+    sales_deltas,
+    apply_sales_deltas,
+    refresh_category_rollup,
+    rebuild_sales_rollups,
+    refresh_rollups,
+    is_stale,
+    query_sales,
+)
+
+def orders_frame(rows):
+    return pd.DataFrame(rows, columns=["orderId", "productId", "channel", "channelGroup", "campaign", "quantity", "amount", "dateTime"])
+
+def upsert_orders(db, df):
+    """Upserts the orders the way the pipeline does, updating the rollups by the difference."""
+    previous = previous_orders(db["orders"], df)
+    for record in df.to_dict("records"):
+        db["orders"].replace_one({"orderId": record["orderId"]}, record, upsert=True)
+    apply_sales_deltas(db, sales_deltas(df, previous))
+
+def test_rollups_follow_new_changed_and_repeated_orders(mock_mongo_client):
+    # Given: Two orders of a product on the same day, one of them without campaign
+    db = mock_mongo_client["test_db"]
+    upsert_orders(db, orders_frame([
+        ("1", "A", "google", "sem", "spring", 1, 100.0, datetime(2023, 2, 1, 10)),
+        ("2", "A", "direct", "direct", None, 2, 50.0, datetime(2023, 2, 1, 23)),
+    ]))
+
+    # When: Upserting the first order again unchanged and moving the second to the next day
+    upsert_orders(db, orders_frame([
+        ("1", "A", "google", "sem", "spring", 1, 100.0, datetime(2023, 2, 1, 10)),
+        ("2", "A", "direct", "direct", None, 3, 60.0, datetime(2023, 2, 2, 8)),
+    ]))
+
+    # Then: The repeated order is counted once, the changed one only on its new day
+    products = {doc["day"].day: (doc["orders"], doc["quantity"], doc["amount"])
+                for doc in db["sales_by_product_day"].find({"productId": "A"})}
+    assert products == {1: (1, 1, 100.0), 2: (1, 3, 60.0)}
+    assert db["sales_by_channel_day"].count_documents({}) == 2
+    assert db["sales_by_campaign_day"].find_one({"campaign": None})["day"] == datetime(2023, 2, 2)
+
+def test_lost_rollup_updates_are_not_retried_but_rebuilt(mock_mongo_client):
+    # Given: A database that loses the connection after applying the first update of the product rollup
+    db = mock_mongo_client["test_db"]
+    orders = orders_frame([("1", "A", "google", "sem", "spring", 2, 100.0, datetime(2023, 2, 1, 10))])
+    db["orders"].insert_many(orders.to_dict("records"))
+    flaky = DisconnectingDatabase(db, "sales_by_product_day")
+
+    # When: Applying the deltas of the order
+    apply_sales_deltas(flaky, sales_deltas(orders, previous_orders(db["orders"], orders.iloc[:0])))
+
+    # Then: The $inc isn't applied twice and the rollups are marked stale
+    assert db["sales_by_product_day"].find_one()["orders"] == 1
+    assert is_stale(db)
+
+    # When / Then: The next rollups stage rebuilds them from the orders
+    assert refresh_rollups(db, db["orders"], db["inventory"]) is not None
+    assert db["sales_by_product_day"].find_one()["quantity"] == 2 and not is_stale(db)
+    assert refresh_rollups(db, db["orders"], db["inventory"]) is None
+
+class DisconnectingDatabase:
+    """A database whose collection `name` applies its first bulk_write, then raises AutoReconnect as if the reply was lost."""
+
+    def __init__(self, db, name):
+        self._db = db
+        self._name = name
+        self._failed = False
+
+    def __getitem__(self, name):
+        collection = self._db[name]
+        if name != self._name:
+            return collection
+        database = self
+
+        class Collection:
+            def __getattr__(self, attribute):
+                return getattr(collection, attribute)
+
+            def bulk_write(self, operations, ordered=True):
+                result = collection.bulk_write(operations, ordered=ordered)
+                if database._failed:
+                    return result
+                database._failed = True
+                raise AutoReconnect("connection closed")
+
+        return Collection()
+
+def test_category_rollup_and_rebuild(mock_mongo_client):
+    # Given: Orders of two products of one category and one product missing from the inventory
+    db = mock_mongo_client["test_db"]
+    upsert_orders(db, orders_frame([
+        ("1", "A", "google", "sem", None, 1, 100.0, datetime(2023, 2, 1, 10)),
+        ("2", "B", "google", "sem", None, 2, 50.0, datetime(2023, 2, 1, 11)),
+        ("3", "C", "direct", "direct", None, 1, 10.0, datetime(2023, 2, 1, 12)),
+    ]))
+    db["inventory"].insert_many([{"productId": "A", "category": "Shoes"}, {"productId": "B", "category": "Shoes"}])
+
+    # When: Refreshing the category rollup
+    refresh_category_rollup(db, db["inventory"])
+
+    # Then: Sales are summed per category, products without one under None
+    categories = {doc["category"]: doc["amount"] for doc in db["sales_by_category_day"].find()}
+    assert categories == {"Shoes": 150.0, None: 10.0}
+
+    # When: The product rollup got out of step (e.g. a crash between upsert and update) and is rebuilt
+    db["sales_by_product_day"].update_one({"productId": "A"}, {"$inc": {"orders": 5}})
+    counts = rebuild_sales_rollups(db, db["orders"], db["inventory"], batch_size=2)
+
+    # Then: Every rollup matches the orders again
+    assert counts == {"product": 3, "channel": 2, "campaign": 1, "category": 2}
+    assert db["sales_by_product_day"].find_one({"productId": "A"})["orders"] == 1
+
+def test_query_sales(mock_mongo_client):
+    # Given: Orders over three days
+    db = mock_mongo_client["test_db"]
+    upsert_orders(db, orders_frame([
+        ("1", "A", "google", "sem", None, 1, 100.0, datetime(2023, 2, 1, 10)),
+        ("2", "A", "google", "organic", None, 1, 20.0, datetime(2023, 2, 2, 10)),
+        ("3", "A", "google", "sem", None, 1, 30.0, datetime(2023, 2, 3, 10)),
+        ("4", "A", "direct", "direct", None, 1, 40.0, datetime(2023, 2, 2, 12)),
+    ]))
+
+    # When: Querying the channels from the second day on, per day and in total
+    daily = query_sales(db, "channel", start=date(2023, 2, 2))
+    total = query_sales(db, "channel", start=date(2023, 2, 2), filters={"channel": "google"}, daily=False)
+
+    # Then: Rows are sorted by day and amount, totals are summed over the days
+    assert [(row["day"].day, row["channelGroup"]) for row in daily] == [(2, "direct"), (2, "organic"), (3, "sem")]
+    assert total == [{"channel": "google", "channelGroup": "sem", "orders": 1, "quantity": 1, "amount": 30.0},
+                     {"channel": "google", "channelGroup": "organic", "orders": 1, "quantity": 1, "amount": 20.0}]
+    with pytest.raises(ValueError, match="campaign"):
+        query_sales(db, "product", filters={"campaign": "spring"})
+
+@pytest.fixture
+def mock_mongo_client():
+    return mongomock.MongoClient()
@@ -0,0 +1,48 @@
+import pandas as pd
+from .. schema import ORDERS_SCHEMA, STRING_DTYPE, UUID_DTYPE, apply_schema, binary_to_uuid, uuid_to_binary
+from .. dedup import hash_keys
+from .. encoding import ORDERS_ENCODER
+from .. incremental import add_row_hashes
+
+def orders():
+    return pd.DataFrame({
+        "orderId": ["0f8fad5b-d9cb-469f-a165-70867728950e", "7c9e6679-7425-40de-944b-e07fc1f90ae7", "0f8fad5b-d9cb-469f-a165-70867728950e"],
+        "productId": ["prod1#prod2", "prod3#prod4", "prod1#prod2"],
+        "currency": ["SEK", "SEK", "SEK"],
+        "quantity": pd.Series([1, 2, 3], dtype="int64"),
+        "amount": [10.5, 20.0, 30.25],
+        "channel": ["Web", "Store", "Web"],
+        "dateTime": ["2023-02-01T10:00:00Z", "2023-02-02T10:00:00Z", "2023-02-03T10:00:00Z"],
+    })
+
+def test_apply_schema():
+    # When: Applying the orders schema to validated rows
+    df = apply_schema(orders(), ORDERS_SCHEMA)
+
+    # Then: Every column gets its lean type and the values are the same
+    assert df["orderId"].dtype == df["productId"].dtype == STRING_DTYPE
+    assert isinstance(df["currency"].dtype, pd.CategoricalDtype) and isinstance(df["channel"].dtype, pd.CategoricalDtype)
+    assert df["quantity"].dtype == "int32" and df["amount"].dtype == "float64"
+    assert pd.api.types.is_datetime64_any_dtype(df["dateTime"])
+    assert df["currency"].tolist() == ["SEK"] * 3 and df["quantity"].tolist() == [1, 2, 3]
+
+def test_binary_uuids_round_trip():
+    # Given: orderIds held as 16-byte binary values
+    order_ids = orders()["orderId"]
+    binary = uuid_to_binary(order_ids)
+
+    # Then: They convert back to the same strings, also after filtering
+    assert binary.dtype == UUID_DTYPE
+    assert binary_to_uuid(binary).tolist() == order_ids.tolist()
+    assert binary_to_uuid(binary.iloc[1:]).tolist() == order_ids.iloc[1:].tolist()
+    assert binary.duplicated().tolist() == [False, False, True]
+
+def test_binary_uuids_are_stored_and_hashed_as_strings():
+    # Given: The same rows with string and with binary orderIds
+    strings = apply_schema(orders(), ORDERS_SCHEMA)
+    binary = apply_schema(orders(), ORDERS_SCHEMA, uuid_binary=True)
+
+    # Then: Documents, key hashes and row hashes don't depend on the representation
+    assert ORDERS_ENCODER.encode(binary) == ORDERS_ENCODER.encode(strings) == ORDERS_ENCODER.encode(orders())
+    assert (hash_keys(binary["orderId"]) == hash_keys(orders()["orderId"])).all()
+    assert add_row_hashes(binary)["rowHash"].tolist() == add_row_hashes(strings)["rowHash"].tolist()
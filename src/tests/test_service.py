@@ -0,0 +1,111 @@
+import threading
+import mongomock
+import pytest
+from .. service import ChangeListener, FileWatcher, products_from_change, run_service
+
+def test_file_watcher(tmp_path):
+    # Given: A watched folder with a file that is still being written
+    watcher = FileWatcher(str(tmp_path), ["orders*.csv"])
+    path = tmp_path / "orders_1.csv"
+    path.write_text("orderId\n")
+    (tmp_path / "inventory.csv").write_text("productId\n")
+
+    # When: Polling while it grows, and after it stopped changing
+    first = watcher.poll()
+    path.write_text("orderId\n1\n")
+    second = watcher.poll()
+    third = watcher.poll()
+    fourth = watcher.poll()
+
+    # Then: It is reported once, when it didn't change between two polls
+    assert (first, second, third, fourth) == ([], [], [str(path)], [])
+
+def test_products_from_change():
+    # Then: Changes of source fields affect the product, derived fields don't and unknown products affect all
+    insert = {"operationType": "insert", "fullDocument": {"orderId": "1", "productId": "A"}}
+    moved = {"operationType": "update", "updateDescription": {"updatedFields": {"productId": "B"}},
+             "fullDocument": {"productId": "B"}, "fullDocumentBeforeChange": {"productId": "A"}}
+    enriched = {"operationType": "update", "updateDescription": {"updatedFields": {"deliveryStatus": "Delivered"}},
+                "fullDocument": {"productId": "A"}}
+    aggregates = {"operationType": "update", "updateDescription": {"updatedFields": {"ordersQuantity": 3},
+                                                                   "removedFields": ["ordersDetails.0"]}}
+    deleted = {"operationType": "delete", "documentKey": {"_id": 1}}
+    assert products_from_change(insert) == {"A"}
+    assert products_from_change(moved) == {"A", "B"}
+    assert products_from_change(enriched) == products_from_change(aggregates) == set()
+    assert products_from_change(deleted) is None
+    assert products_from_change({"operationType": "drop"}) is None
+
+class FakeStream:
+    def __init__(self, events):
+        self.events = list(events)
+        self.resume_token = None
+
+    def try_next(self):
+        if not self.events:
+            return None
+        self.resume_token = {"_data": len(self.events)}
+        return self.events.pop(0)
+
+    def close(self):
+        pass
+
+class FakeDatabase:
+    def __init__(self, events):
+        self.events = events
+        self.watch_options = None
+
+    def watch(self, pipeline, **options):
+        self.watch_options = options
+        return FakeStream(self.events)
+
+def test_run_service_with_change_stream(mock_mongo_client):
+    # Given: A change stream with an insert and the service's own update
+    state = mock_mongo_client["test_db"]["pipeline_state"]
+    state.insert_one({"_id": "change_stream", "resumeToken": {"_data": 9}})
+    db = FakeDatabase([
+        {"operationType": "insert", "fullDocument": {"productId": "A"}},
+        {"operationType": "update", "updateDescription": {"updatedFields": {"deliveryStatus": "Delivered"}}},
+    ])
+    listener = ChangeListener(db, ["orders", "inventory"], state=state)
+    stop = threading.Event()
+    enriched = []
+
+    def enrich(product_ids):
+        enriched.append(product_ids)
+        stop.set()
+        return {}
+
+    # When: Running the service until the first enrichment
+    run_service(enrich, listener=listener, stop=stop)
+
+    # Then: It resumed from the stored token, only enriched the inserted product and stored the new token
+    assert db.watch_options["resume_after"] == {"_data": 9}
+    assert enriched == [{"A"}]
+    assert state.find_one({"_id": "change_stream"})["resumeToken"] == {"_data": 1}
+
+def test_run_service_with_files(tmp_path):
+    # Given: A new file in the watched folder
+    (tmp_path / "orders_1.csv").write_text("orderId\n")
+    stop = threading.Event()
+    ingested, enriched = [], []
+
+    def ingest_files(file_paths):
+        ingested.extend(file_paths)
+        return {"A"}
+
+    def enrich(product_ids):
+        enriched.append(product_ids)
+        stop.set()
+        return {}
+
+    # When: Running the service until the first enrichment
+    run_service(enrich, ingest_files, FileWatcher(str(tmp_path), ["orders*.csv"]), poll_interval=0.01, stop=stop)
+
+    # Then: The file was ingested and its products enriched
+    assert ingested == [str(tmp_path / "orders_1.csv")]
+    assert enriched == [{"A"}]
+
+@pytest.fixture
+def mock_mongo_client():
+    return mongomock.MongoClient()
@@ -0,0 +1,74 @@
+import os
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from .. staging import (
+    StagedFileWriter,
+    iter_staged_batches,
+    list_staged_files,
+    read_latest,
+    read_staged,
+    staged_path,
+    ORDERS_SCHEMA,
+    INVENTORY_SCHEMA,
+)
+
+def test_staged_file_round_trip(tmp_path):
+    # Given: Two validated batches of orders, as read from the CSV file
+    batches = [
+        pd.DataFrame([{"orderId": "1", "productId": "A", "quantity": 1, "amount": 10.5, "campaign": None, "dateTime": "2023-02-01T06:16Z"}]),
+        pd.DataFrame([{"orderId": "2", "productId": "B", "quantity": 2, "amount": 20.0, "campaign": "kr_pmax", "dateTime": "2023-02-02T10:00:00Z"}]),
+    ]
+    path = staged_path(str(tmp_path), "orders", "/data/raw/orders.csv")
+
+    # When: Staging them as row groups of one file
+    with StagedFileWriter(path, ORDERS_SCHEMA) as writer:
+        for batch in batches:
+            writer.write(batch)
+
+    # Then: The file has the schema types, and is read back batch by batch or projected
+    assert list_staged_files(str(tmp_path), "orders") == [path]
+    df = read_staged(path)
+    assert list(df.columns) == ORDERS_SCHEMA.names
+    assert df["dateTime"].tolist() == [pd.Timestamp("2023-02-01T06:16Z"), pd.Timestamp("2023-02-02T10:00Z")]
+    assert df["quantity"].dtype == "int64"
+    assert df["campaign"].tolist() == [None, "kr_pmax"]
+    assert [len(batch) for batch in iter_staged_batches(path, batch_size=1)] == [1, 1]
+    assert list(read_staged(path, columns=["orderId", "amount"]).columns) == ["orderId", "amount"]
+
+def test_staged_file_not_written_on_error(tmp_path):
+    # Given: A staging writer
+    path = staged_path(str(tmp_path), "inventory", "inventory.csv")
+
+    # When: The ingestion fails after a first batch
+    with pytest.raises(RuntimeError):
+        with StagedFileWriter(path, INVENTORY_SCHEMA) as writer:
+            writer.write(pd.DataFrame([{"productId": "A", "name": "Product A", "quantity": 1}]))
+            raise RuntimeError("Connection lost")
+
+    # Then: No partial file is left behind
+    assert os.listdir(os.path.dirname(path)) == []
+
+def test_read_latest(tmp_path):
+    # Given: Two staged inventory files, with a duplicate in the first and a changed product in the second
+    paths = [str(tmp_path / "1.parquet"), str(tmp_path / "2.parquet")]
+    files = [
+        [{"productId": "A", "name": "A1", "quantity": 1}, {"productId": "B", "name": "B1", "quantity": 2},
+         {"productId": "A", "name": "A duplicate", "quantity": 9}],
+        [{"productId": "C", "name": "C2", "quantity": 3}, {"productId": "A", "name": "A2", "quantity": 4}],
+    ]
+    for path, rows in zip(paths, files):
+        with StagedFileWriter(path, INVENTORY_SCHEMA) as writer:
+            writer.write(pd.DataFrame(rows))
+
+    # When: Reading the rows the processed collection holds after upserting both files
+    df = read_latest(paths, "productId", columns=["quantity"])
+
+    # Then: The first row of a key wins within a file, later files win over earlier ones
+    assert df.to_dict("records") == [
+        {"productId": "A", "quantity": 4},
+        {"productId": "B", "quantity": 2},
+        {"productId": "C", "quantity": 3},
+    ]
@@ -1,4 +1,5 @@
-from .. validation import validate_data
+from .. validation import validate_data, validate_rows, ColumnRule, ORDERS_RULES
+from .. import validation
 import pandas as pd
 import pytest
 
@@ -98,3 +99,51 @@ def test_valid_data():
 
     # Assert that the function returns True
     assert validate_data(df, critical_columns) is None
+
+
+@pytest.mark.parametrize("use_pyarrow", [True, False])
+def test_validate_rows(monkeypatch, use_pyarrow):
+
+    if not use_pyarrow:
+        monkeypatch.setattr(validation, "pa", None)
+
+    # Create orders where every row but the first breaks a different rule
+    data = {
+        "orderId": ["efb921c1-6733-3811-b4c2-aa0d80800638"] * 5,
+        "productId": ["prod1520#prod100011001100", "prod1520", None, "prod1520#prod100011001100", "prod1520#prod100011001100"],
+        "quantity": [1, 1, 1, -1, "x"],
+        "amount": [10.0, 10.0, 10.0, 10.0, 10.0],
+        "dateTime": ["2023-02-01T17:12:52Z", "2023-02-01T06:16Z", "2023-02-01T06:16Z", "yesterday", "2023-02-01T06:16Z"],
+    }
+    df = pd.DataFrame(data)
+
+    result = validate_rows(df, ORDERS_RULES)
+
+    # Only the first row is valid, its quantity is cast to an integer
+    assert result.valid.index.tolist() == [0]
+    assert pd.api.types.is_integer_dtype(result.valid["quantity"])
+    assert result.rejected_with_reasons()["validationErrors"].tolist() == [
+        ["productId: pattern"],
+        ["productId: required"],
+        ["quantity: min", "dateTime: datetime"],
+        ["quantity: integer"],
+    ]
+
+
+def test_validate_rows_missing_columns():
+
+    # Without a required column no row can be valid, expect a ValueError
+    df = pd.DataFrame({"quantity": [5, 10, 15]})
+    with pytest.raises(ValueError, match="Missing required columns: productId"):
+        validate_rows(df, [ColumnRule("productId"), ColumnRule("quantity", dtype="integer")])
+
+
+def test_validate_rows_valid_data():
+
+    df = pd.DataFrame({"productId": ["A1", "B2"], "quantity": [5, 10]})
+    result = validate_rows(df, [ColumnRule("productId"), ColumnRule("quantity", dtype="integer", min_value=0)])
+
+    assert len(result.valid) == 2
+    assert result.rejected.empty
+    assert result.errors.empty
+    assert result.rejected_with_reasons().empty
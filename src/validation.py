@@ -1,5 +1,13 @@
+from typing import List, NamedTuple, Optional
+import numpy as np
 import pandas as pd
 
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # Optional, only makes the regex checks faster
+    pa = None
+
 def validate_data(df: pd.DataFrame, critical_columns: list) -> bool:
     """
     Validate the data in the DataFrame to ensure it is clean and correct.
@@ -40,4 +48,130 @@ def remove_dublicates(df: pd.DataFrame, key: str, collection_name: str):
         print(f"{collection_name} count AFTER cleaning duplicates: {df.shape[0]}")
         return df
     
-    
\ No newline at end of file
+    
+class ColumnRule(NamedTuple):
+    """Declarative checks for one column, evaluated by validate_rows."""
+    column: str
+    required: bool = True  # Column must exist and values must be non-null and non-blank
+    dtype: Optional[str] = None  # "integer", "number" or "datetime" (ISO 8601)
+    min_value: Optional[float] = None
+    max_value: Optional[float] = None
+    pattern: Optional[str] = None  # Regex the whole value must match
+
+class ValidationResult(NamedTuple):
+    """The outcome of validate_rows."""
+    valid: pd.DataFrame
+    rejected: pd.DataFrame
+    errors: pd.DataFrame  # One row per failed check: row (index label), column and rule
+
+    def rejected_with_reasons(self, column: str = "validationErrors") -> pd.DataFrame:
+        """Returns the rejected rows with a list of 'column: rule' failures per row."""
+        if self.errors.empty:
+            return self.rejected.assign(**{column: pd.Series(dtype=object)})
+        reasons = (self.errors["column"] + ": " + self.errors["rule"]).groupby(self.errors["row"]).agg(list)
+        return self.rejected.assign(**{column: self.rejected.index.map(reasons)})
+
+ORDERS_RULES: List[ColumnRule] = [
+    ColumnRule('orderId', pattern=r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}'),
+    ColumnRule('productId', pattern=r'prod\d+#prod\d+'),
+    ColumnRule('quantity', dtype='integer', min_value=0),
+    ColumnRule('amount', dtype='number', min_value=0),
+    ColumnRule('shippingCost', required=False, dtype='number', min_value=0),
+    ColumnRule('dateTime', dtype='datetime'),
+]
+INVENTORY_RULES: List[ColumnRule] = [
+    ColumnRule('productId', pattern=r'prod\d+#prod\d+'),
+    ColumnRule('name'),
+    ColumnRule('quantity', dtype='integer', min_value=0),
+]
+
+def _fullmatch(values: pd.Series, pattern: str) -> pd.Series:
+    """Vectorized regex full match, with pyarrow's RE2 engine when it is installed."""
+    if pa is not None:
+        try:
+            # pyarrow strings (see schema.STRING_DTYPE) are matched without a copy
+            array = pa.array(values) if values.dtype == "string[pyarrow]" else pa.array(values.to_numpy(), type=pa.string())
+        except (pa.ArrowTypeError, pa.ArrowInvalid):
+            array = pa.array(values.astype(str).to_numpy(), type=pa.string())
+        matches = pc.match_substring_regex(array, f"^(?:{pattern})$")
+        return pd.Series(matches.to_numpy(zero_copy_only=False), index=values.index)
+    return values.astype(str).str.fullmatch(pattern).astype(bool)
+
+def validate_rows(df: pd.DataFrame, rules: List[ColumnRule], parse_datetimes: bool = False) -> ValidationResult:
+    """
+    Validates every row against a rule set in one vectorized pass and splits valid from rejected rows.
+
+    Unlike validate_data a bad row doesn't fail the batch, it is only rejected. Only missing
+    required columns raise, since then no row can be valid. Integer and number columns read as
+    strings (see schema.csv_dtypes) are converted for the valid rows: required integers to
+    int64, optional ones to nullable Int64 and numbers to float64.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to validate, with a unique index.
+        rules (List[ColumnRule]): The rules, e.g. ORDERS_RULES.
+        parse_datetimes (bool): Also convert datetime columns of the valid rows to UTC datetimes,
+            for typed readers where one bad value left the whole column unparsed.
+
+    Returns:
+        ValidationResult: The valid rows, the rejected rows and a table of the failed checks.
+    """
+    missing_columns = [rule.column for rule in rules if rule.required and rule.column not in df.columns]
+    if missing_columns:
+        raise ValueError(f"Missing required columns: {', '.join(missing_columns)}")
+
+    checks = []  # (column, rule, mask of failing rows)
+    numeric_values = {}
+    datetime_values = {}
+    for rule in rules:
+        if rule.column not in df.columns:
+            continue
+        values = df[rule.column]
+        present = values.notna()
+        # Blank strings are caught by the pattern and datetime checks, only strip when nothing else would
+        if (values.dtype == object or isinstance(values.dtype, pd.StringDtype)) and not rule.pattern and rule.dtype != "datetime":
+            present &= values.astype(str).str.strip().ne('')
+
+        if rule.required:
+            checks.append((rule.column, "required", ~present))
+
+        if rule.dtype in ("integer", "number") or rule.min_value is not None or rule.max_value is not None:
+            numeric = values if pd.api.types.is_numeric_dtype(values) else pd.to_numeric(values, errors="coerce")
+            numeric_values[rule.column] = numeric
+            if rule.dtype in ("integer", "number"):
+                not_numeric = present & numeric.isna()
+                if rule.dtype == "integer":
+                    not_numeric |= present & numeric.notna() & numeric.mod(1).ne(0)
+                checks.append((rule.column, rule.dtype, not_numeric))
+            if rule.min_value is not None:
+                checks.append((rule.column, "min", present & numeric.lt(rule.min_value).fillna(False)))
+            if rule.max_value is not None:
+                checks.append((rule.column, "max", present & numeric.gt(rule.max_value).fillna(False)))
+
+        if rule.dtype == "datetime" and not pd.api.types.is_datetime64_any_dtype(values):
+            parsed = pd.to_datetime(values, errors="coerce", format="ISO8601", utc=True)
+            datetime_values[rule.column] = parsed
+            checks.append((rule.column, "datetime", present & parsed.isna()))
+
+        if rule.pattern:
+            checks.append((rule.column, "pattern", present & ~_fullmatch(values.where(present, ""), rule.pattern)))
+
+    failed = np.column_stack([mask.to_numpy(dtype=bool) for _, _, mask in checks]) if checks else np.zeros((len(df), 0), dtype=bool)
+    rejected_mask = failed.any(axis=1)
+
+    # Compact error table, one row per failed check
+    rows, check_ids = np.nonzero(failed)
+    errors = pd.DataFrame({
+        "row": df.index.to_numpy()[rows],
+        "column": pd.Series([checks[i][0] for i in check_ids], dtype=object),
+        "rule": pd.Series([checks[i][1] for i in check_ids], dtype=object),
+    })
+
+    valid = df[~rejected_mask]
+    for rule in rules:
+        if rule.required and rule.dtype == "integer" and rule.column in valid.columns and valid[rule.column].dtype != np.int64:
+            valid = valid.assign(**{rule.column: numeric_values[rule.column][~rejected_mask].astype(np.int64)})
+        elif rule.dtype in ("integer", "number") and rule.column in valid.columns and not pd.api.types.is_numeric_dtype(valid[rule.column]):
+            valid = valid.assign(**{rule.column: numeric_values[rule.column][~rejected_mask].astype("Int64" if rule.dtype == "integer" else "float64")})
+        if parse_datetimes and rule.column in datetime_values:
+            valid = valid.assign(**{rule.column: datetime_values[rule.column][~rejected_mask]})
+    return ValidationResult(valid, df[rejected_mask], errors)